@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+Build offline the trajectory library of a session, to be set as the
+TrajectoryLibrary folder of the tracking experiments. Every trial of the
+session, whose seed is derived from the session seed, is generated at every
+given ball speed, for example
+
+    python buildTrajectoryLibrary.py library --session-seed 1234 --trials 100 --speeds 2 4 6
+"""
+from common.SessionSeeds import SessionSeeds
+from common.TrajectoryLibrary import buildLibrary
+from common.Trajectories import PHYSICS_MODES
+
+if __name__ == "__main__":
+    # The guard is needed by the worker processes, that import this module
+    # again on platforms without fork
+    import argparse
+    parser = argparse.ArgumentParser(description='Build a library of precomputed tracking trajectories')
+    parser.add_argument('directory', help='Folder of the library, the missing trajectories are added to it')
+    parser.add_argument('--session-seed', type=int, required=True, help='SessionSeed of the session')
+    parser.add_argument('--trials', type=int, required=True, help='Number of trials of the session')
+    parser.add_argument('--speeds', type=float, nargs='+', required=True, help='Ball speeds [cm/s]')
+    parser.add_argument('--num-balls', type=int, default=4)
+    parser.add_argument('--rect-width', type=float, default=6)
+    parser.add_argument('--rect-height', type=float, default=6)
+    parser.add_argument('--ball-radius', type=float, default=0.25)
+    parser.add_argument('--duration', type=float, default=2)
+    parser.add_argument('--physics-mode', choices=PHYSICS_MODES, default=PHYSICS_MODES[0])
+    parser.add_argument('--processes', type=int, default=None, help='Worker processes, all the cores by default')
+    args = parser.parse_args()
+
+    expInfo = {'NumBalls': args.num_balls, 'RectWidth': args.rect_width, 'RectHeight': args.rect_height,
+               'BallRadius': args.ball_radius, 'Duration': args.duration, 'PhysicsMode': args.physics_mode}
+    seeds = SessionSeeds(args.session_seed).trialSeeds(args.trials)
+    library = buildLibrary(args.directory, expInfo, [(speed, seed) for speed in args.speeds for seed in seeds],
+                           processes=args.processes)
+    print "%d trajectories in %s" % (len(library), args.directory)
@@ -1,38 +1,93 @@
-class Ball():
+import numpy as np
+
+# Largest distance in pixels allowed between the polygon of a circle and
+# the true circle, and bounds of the number of vertices
+MAX_EDGE_ERROR_PIX = 0.1
+MIN_EDGES, MAX_EDGES = 8, 128
+
+
+def pixelRadius(win, radius):
+    """ The radius in pixels of a circle of radius [cm], None if the window does not know its size """
+    if getattr(win, 'scrWidthCM', None) and getattr(win, 'scrWidthPIX', None):
+        return radius * float(win.scrWidthPIX) / float(win.scrWidthCM)
+    return None
+
+
+def circleEdges(win, radius):
+    """
+    The number of vertices of a circle of radius [cm] such that its polygon
+    is never further than MAX_EDGE_ERROR_PIX pixels from the circle
+    """
+    r = pixelRadius(win, radius)
+    if r is None:
+        return MAX_EDGES
+    if r <= MAX_EDGE_ERROR_PIX:
+        return MIN_EDGES
+    edges = int(np.ceil(np.pi / np.arccos(1.0 - MAX_EDGE_ERROR_PIX / r)))
+    return int(min(max(edges, MIN_EDGES), MAX_EDGES))
+
+
+def discTextureRes(win, radius):
+    """
+    The power of two resolution of the disc mask texture of a circle of
+    radius [cm], twice as fine as the screen pixels it covers
+    """
+    r = pixelRadius(win, radius)
+    if r is None:
+        return MAX_EDGES
+    return int(min(max(2 ** int(np.ceil(np.log2(max(4.0 * r, 1.0)))), 16), MAX_EDGES))
+
+
+class Ball(object):
 
     """
     Class to handle ball position and handle ball collisions, will be part
+    The position is a float numpy array owned by the ball, or a row of an
+    (n, 2) array shared with other balls when such a view is passed, that is
+    updated in place so that moving a ball never touches psychopy. The
+    psychopy circle is only created when the ball is first drawn.
     """
 
+    __slots__ = ('win', 'position', 'direction', 'speed', 'radius', 'color', 'shape')
+
     def __init__(self, win, position, direction, speed, radius, color):
-        from psychopy import visual
+        self.win = win
+        self.position = np.asarray(position, dtype=float)
         self.direction = direction
+        self.speed = speed
         self.radius = radius
-        self.shape = visual.Circle(win, radius=self.radius, edges=128,
-                                   lineWidth=1, lineColor=color,
-                                   fillColor=color,
-                                   closeShape=True,
-                                   interpolate=True, pos=position, units='cm')
-        self.shape.setFillColor(color)
-        self.shape.setLineColor(color)
+        self.color = color
+        self.shape = None
 
     def setPos(self, newpos):
-        self.shape.setPos(newpos)
+        self.position[:] = newpos
 
     def move(self, disp):
-        newPos = self.pos() + disp
-        self.shape.setPos(newPos)
+        self.position += disp
 
     def draw(self):
+        if self.shape is None:
+            from psychopy import visual
+            self.shape = visual.Circle(self.win, radius=self.radius, edges=circleEdges(self.win, self.radius),
+                                       lineWidth=1, lineColor=self.color,
+                                       fillColor=self.color,
+                                       closeShape=True,
+                                       interpolate=True, pos=self.position, units='cm')
+        else:
+            self.shape.setPos(self.position)
         self.shape.draw()
 
     def pos(self):
-        import numpy as np
-        return np.array(self.shape.pos)
+        """
+        A copy of the position of the ball, that callers may keep, the
+        position attribute is the array updated in place
+        """
+        return self.position.copy()
 
     """ Change the color of the ball to draw"""
 
     def setColor(self, newColor):
-        # self.shape.setUseShaders(True)
-        self.shape.setFillColor(newColor)
-        self.shape.setLineColor(newColor)
+        self.color = newColor
+        if self.shape is not None:
+            self.shape.setFillColor(newColor)
+            self.shape.setLineColor(newColor)
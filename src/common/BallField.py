@@ -0,0 +1,57 @@
+import numpy as np
+from Ball import discTextureRes
+
+
+def rgbColor(color):
+    """ The [-1, 1] rgb triplet of a psychopy color name or of an rgb triplet """
+    if isinstance(color, basestring):
+        from psychopy.colors import colors
+        return np.array(colors[color.lower()], dtype=float)
+    return np.asarray(color, dtype=float)
+
+
+class BallField():
+
+    """
+    All the balls of a trial drawn at once by a single ElementArrayStim.
+    Balls are identified by their index, positions is the (n, 2) array of
+    their centers in [cm] and colors the (n, 3) array of their rgb colors,
+    both are sent to the stimulus in a single call whatever the number of balls.
+    """
+
+    def __init__(self, win, positions, radius, color='Black'):
+        from psychopy import visual
+        self.positions = np.array(positions, dtype=float)
+        self.colors = np.tile(rgbColor(color), (len(self.positions), 1))
+        self.stim = visual.ElementArrayStim(win, units='cm', nElements=len(self.positions),
+                                            xys=self.positions, sizes=2.0 * radius,
+                                            elementTex=None, elementMask='circle',
+                                            texRes=discTextureRes(win, radius),
+                                            colors=self.colors, colorSpace='rgb')
+
+    def __len__(self):
+        return len(self.positions)
+
+    def update(self, positions=None, colors=None):
+        """ Set the (n, 2) positions and/or the (n, 3) rgb colors of all the balls """
+        if positions is not None:
+            self.positions[:] = positions
+            self.stim.setXYs(self.positions)
+        if colors is not None:
+            self.colors[:] = colors
+            self.stim.setColors(self.colors, colorSpace='rgb')
+
+    def setPositions(self, positions):
+        self.update(positions=positions)
+
+    def setColor(self, color, balls=None):
+        """ Change the color of the balls with the given indices, all of them if None """
+        colors = self.colors.copy()
+        if balls is None:
+            colors[:] = rgbColor(color)
+        else:
+            colors[list(balls)] = rgbColor(color)
+        self.update(colors=colors)
+
+    def draw(self):
+        self.stim.draw()
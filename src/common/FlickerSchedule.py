@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+import numpy as np
+
+# Slowest flicker frequency of the schedule in [Hz]
+MIN_FLICKER_FREQ = 0.5
+
+
+class FlickerSchedule():
+
+    """
+    The flicker frequencies that a display refreshing at fps can show. The
+    balls switch color every whole number of frames N, so the only
+    achievable frequencies are fps / N. The staircase values are snapped to
+    the nearest of them before being shown, and record() compares the
+    frequency of a trial with the one measured from its flip timestamps.
+    """
+
+    def __init__(self, fps, minFreq=MIN_FLICKER_FREQ):
+        self.fps = float(fps)
+        self.frequencies = self.fps / np.arange(1, int(np.ceil(self.fps / minFreq)) + 1)
+
+    def __len__(self):
+        return len(self.frequencies)
+
+    def switchFrames(self, flickerFreq):
+        """ The number of frames N between two color switches of the achievable frequency closest to flickerFreq """
+        return int(np.argmin(np.abs(self.frequencies - flickerFreq))) + 1
+
+    def snap(self, flickerFreq):
+        """ The achievable frequency closest to flickerFreq """
+        return self.frequencies[self.switchFrames(flickerFreq) - 1]
+
+    def record(self, flickerFreq, switchTimes):
+        """
+        The requested and achieved frequencies of a trial, and the frequency
+        and the largest switch interval error [ms] measured from switchTimes,
+        the flip timestamps [s] of its color switches
+        """
+        nFrames = self.switchFrames(flickerFreq)
+        intervals = np.diff(switchTimes)
+        record = OrderedDict()
+        record['FlickerFreqRequested'] = flickerFreq
+        record['SwitchFrames'] = nFrames
+        record['FlickerFreqAchieved'] = self.fps / nFrames
+        if len(intervals):
+            record['FlickerFreqMeasured'] = 1.0 / intervals.mean()
+            record['SwitchIntervalError'] = 1000.0 * np.abs(intervals - nFrames / self.fps).max()
+        else:
+            record['FlickerFreqMeasured'] = np.nan
+            record['SwitchIntervalError'] = np.nan
+        return record
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+import numpy as np
+
+# A flip interval longer than this number of nominal frame intervals means
+# that at least one frame has been dropped
+DROPPED_FRAME_THRESHOLD = 1.5
+
+
+def frameIntervalStats(intervals, frameInterval):
+    """
+    The number of dropped frames, the largest interval and the jitter, the
+    standard deviation of the intervals, of the flip intervals [s] of a
+    display with nominal frameInterval [s]
+    """
+    intervals = np.asarray(intervals, dtype=float)
+    if len(intervals) == 0:
+        return 0, 0.0, 0.0
+    late = intervals > DROPPED_FRAME_THRESHOLD * frameInterval
+    nDropped = int((np.round(intervals[late] / frameInterval) - 1).sum())
+    return nDropped, intervals.max(), intervals.std()
+
+
+def phaseColumns(phases):
+    """ The names of the trial record columns written for phases """
+    return [phase + suffix for phase in phases for suffix in ('Dropped', 'MaxInterval', 'Jitter')]
+
+
+def phaseDtypes(phases):
+    """ The (column, dtype) pairs of the trial record columns written for phases """
+    return [(phase + suffix, dtype) for phase in phases
+            for suffix, dtype in (('Dropped', np.int32), ('MaxInterval', np.float64), ('Jitter', np.float64))]
+
+
+class TrialFrameIntervals():
+
+    """
+    Split among the phases of a trial (cue, blink, motion, mask, response)
+    the flip intervals that psychopy records in win.frameIntervals, see
+    open_window. The trial calls phase(name) before the first flip of every
+    phase, a phase may be entered more than once, and the intervals of the
+    ones that never start are empty. The first interval of the trial, from
+    the last flip of the previous one, spans the response, the saving and
+    the pause between the trials and is not recorded.
+    """
+
+    def __init__(self, win, phases):
+        self.win = win
+        self.phases = list(phases)
+        self.intervals = dict((phase, []) for phase in self.phases)
+        self.current = None
+        self.start = 0
+        # The index of the first interval of the trial, set by its first phase
+        self.first = None
+
+    def phase(self, name):
+        """ End the current phase and start recording phase name """
+        self.end()
+        if name not in self.intervals:
+            self.phases.append(name)
+            self.intervals[name] = []
+        self.current = name
+        if self.first is None:
+            self.first = len(self.win.frameIntervals) + 1
+        self.start = max(len(self.win.frameIntervals), self.first)
+
+    def end(self):
+        if self.current is not None:
+            self.intervals[self.current].extend(self.win.frameIntervals[self.start:])
+            self.current = None
+
+    def record(self):
+        """
+        The number of dropped frames and the largest interval and jitter in
+        [ms] of every phase, named as phaseColumns(phases)
+        """
+        self.end()
+        frameInterval = 1.0 / self.win.measuredFPS
+        record = OrderedDict()
+        for phase in self.phases:
+            nDropped, maxInterval, jitter = frameIntervalStats(self.intervals[phase], frameInterval)
+            record[phase + 'Dropped'] = nDropped
+            record[phase + 'MaxInterval'] = 1000.0 * maxInterval
+            record[phase + 'Jitter'] = 1000.0 * jitter
+        return record
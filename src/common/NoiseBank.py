@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from Ball import pixelRadius
+from StimulusPool import stimulusPool
+
+# Number of textures of a bank, the trials draw a few of them without
+# replacement so that the same combination is rarely repeated
+NOISE_BANK_SIZE = 64
+# Bounds of the power of two texture resolution, the largest one is used when
+# the window does not know its size in pixels
+MIN_NOISE_RES, MAX_NOISE_RES = 16, 1024
+# Random stream of the bank, distinct from the streams [sessionSeed, nTrial]
+# of the trial seeds
+NOISE_STREAM = 2 ** 20
+NOISE_KINDS = ['uniform', 'binary']
+
+
+def noiseResolution(win, radius):
+    """
+    The power of two resolution of a noise texture drawn on a disc of radius
+    [cm], one texel per screen pixel
+    """
+    r = pixelRadius(win, radius)
+    if r is None:
+        return MAX_NOISE_RES
+    return int(min(max(2 ** int(np.ceil(np.log2(max(2.0 * r, 1.0)))), MIN_NOISE_RES), MAX_NOISE_RES))
+
+
+class NoiseBank():
+
+    """
+    Noise textures generated once per session from the session seed, that
+    the trials select by index instead of generating new ones. 'uniform'
+    textures are float32 in [-1, 1], 'binary' ones are int8 -1 or 1.
+    """
+
+    def __init__(self, kind, resolution, seed, nTextures=NOISE_BANK_SIZE):
+        rng = np.random.RandomState([int(seed), NOISE_STREAM])
+        shape = (nTextures, resolution, resolution)
+        if kind == 'uniform':
+            self.textures = rng.uniform(-1.0, 1.0, size=shape).astype(np.float32)
+        elif kind == 'binary':
+            self.textures = rng.randint(0, 2, size=shape).astype(np.int8) * np.int8(2) - np.int8(1)
+        else:
+            raise ValueError("Noise kind must be one of " + str(NOISE_KINDS))
+        self.kind = kind
+
+    def __len__(self):
+        return len(self.textures)
+
+    def __getitem__(self, i):
+        return self.textures[i]
+
+    @property
+    def nbytes(self):
+        return self.textures.nbytes
+
+    def draw(self, rng, n):
+        """ The indices of n different textures, drawn with the trial generator rng """
+        return rng.choice(len(self), n, replace=False)
+
+
+def noiseBank(win, kind, radius, seed):
+    """ The NoiseBank of the noise masks of radius [cm] of win, generated the first time it is needed """
+    return stimulusPool(win).get(('noiseBank', kind, radius, seed),
+                                 lambda win: NoiseBank(kind, noiseResolution(win, radius), seed))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import time
+import numpy as np
+
+CALIBRATION_FILE = os.path.join('data', 'refreshCalibration.json')
+# A stored calibration is reused when the median of SANITY_FLIPS flip
+# intervals differs from its flip time by less than SANITY_TOLERANCE of it
+SANITY_FLIPS = 10
+SANITY_TOLERANCE = 0.05
+
+
+def calibrationKey(monInfo):
+    """ The key of the calibration of a monitor: name, resolution and fullscreen flag """
+    return '%s_%dx%d_%s' % (monInfo['MonitorName'], int(monInfo['ResolutionX']), int(monInfo['ResolutionY']),
+                            'fullscreen' if monInfo['RunFullScreen'] else 'windowed')
+
+
+class RefreshCalibration():
+
+    """
+    The flip time mean and standard deviation [s] measured on every monitor,
+    stored in a json file so that the following sessions only check them
+    with a few flips instead of measuring them again
+    """
+
+    def __init__(self, filename=CALIBRATION_FILE):
+        self.filename = filename
+        self.calibrations = {}
+        if os.path.isfile(filename):
+            with open(filename, 'r') as f:
+                self.calibrations = json.load(f)
+
+    def __len__(self):
+        return len(self.calibrations)
+
+    def get(self, key):
+        """ The calibration stored for key, a dict of flipTime, flipTimeStd and timestamp, or None """
+        return self.calibrations.get(key)
+
+    def set(self, key, intervals):
+        """ Store the calibration of key measured from the flip intervals [s] and save the file """
+        intervals = np.asarray(intervals, dtype=float)
+        self.calibrations[key] = {'flipTime': intervals.mean(), 'flipTimeStd': intervals.std(),
+                                  'nFlips': len(intervals) + 1,
+                                  'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')}
+        self.save()
+        return self.calibrations[key]
+
+    def check(self, key, intervals):
+        """ True if the flip intervals [s] of a sanity check agree with the calibration of key """
+        calibration = self.get(key)
+        if calibration is None or len(intervals) == 0:
+            return False
+        return abs(np.median(intervals) - calibration['flipTime']) < SANITY_TOLERANCE * calibration['flipTime']
+
+    def save(self):
+        directory = os.path.dirname(self.filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.filename + '.tmp', 'w') as f:
+            json.dump(self.calibrations, f, indent=1, sort_keys=True)
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
+        os.rename(self.filename + '.tmp', self.filename)
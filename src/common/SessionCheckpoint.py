@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import os
+import pickle
+
+
+class SessionCheckpoint():
+
+    """
+    The state needed to continue an interrupted session, a log of small
+    pickled dicts, the trial counter and the random generator states, one
+    appended after every response. The trials themselves are replayed from
+    the journal, so that a record does not grow with the session. save()
+    pickles the state right away, since the caller keeps changing it, and
+    appends it in the session writer thread.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def exists(self):
+        return os.path.isfile(self.filename)
+
+    def save(self, writer, **state):
+        """ Append the keyword arguments as a new record in the thread of writer """
+        writer.submit(self._append, pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+
+    def load(self):
+        """
+        The list of the complete records, oldest first. A record torn by a
+        crash is removed, so that the next ones are appended after the last
+        complete one.
+        """
+        records = []
+        with open(self.filename, 'r+b') as f:
+            end = 0
+            while True:
+                try:
+                    records.append(pickle.load(f))
+                    end = f.tell()
+                except Exception:
+                    # The end of the log or a torn record
+                    break
+            f.truncate(end)
+        return records
+
+    def remove(self):
+        """ Delete the checkpoint of a completed session """
+        if self.exists():
+            os.remove(self.filename)
+
+    def _append(self, data):
+        with open(self.filename, 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
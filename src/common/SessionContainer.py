@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import os
+import zipfile
+import numpy as np
+from TrialJournal import _jsonValue
+
+# Members of the container that are not trial arrays
+SETTINGS_MEMBER = 'settings.json'
+TABLE_MEMBER = 'trials.npy'
+
+
+def trialGroup(nTrial):
+    """ The prefix of the members of the arrays of the nTrial-th trial """
+    return 'trial/%05d/' % nTrial
+
+
+class SessionContainer():
+
+    """
+    All the data of a session in a single zip file of compressed .npy
+    arrays, the layout of the numpy .npz files: the settings as json, the
+    arrays of every trial under trial/NNNNN/ (the ball positions drawn on
+    every motion frame, the flip intervals [s] of every phase) and the trial
+    table as one structured array. Every write appends its members and
+    closes the file, so that it stays readable when a session crashes, and
+    every member is read only when it is asked for, so that one trial is
+    loaded without reading the rest of the session.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def _write(self, members):
+        with zipfile.ZipFile(self.filename, 'a', zipfile.ZIP_DEFLATED, allowZip64=True) as container:
+            for name, array in members:
+                data = io.BytesIO()
+                np.lib.format.write_array(data, np.asanyarray(array), allow_pickle=False)
+                container.writestr(name, data.getvalue())
+
+    def saveSettings(self, **settings):
+        """ Store the settings dicts of the session, by name """
+        with zipfile.ZipFile(self.filename, 'a', zipfile.ZIP_DEFLATED, allowZip64=True) as container:
+            container.writestr(SETTINGS_MEMBER, json.dumps(settings, default=_jsonValue, indent=1, sort_keys=True))
+
+    def saveTrial(self, nTrial, trajectory=None, frameIntervals=None):
+        """
+        Store the arrays of a trial, trajectory are the ball positions of the
+        motion frames and frameIntervals the dict of the flip intervals of
+        every phase, as in TrialFrameIntervals.intervals
+        """
+        members = []
+        if trajectory is not None:
+            members.append((trialGroup(nTrial) + 'trajectory.npy', trajectory))
+        for phase, intervals in sorted((frameIntervals or {}).items()):
+            members.append((trialGroup(nTrial) + 'frameIntervals/' + phase + '.npy', np.asarray(intervals, dtype=float)))
+        self._write(members)
+
+    def saveTable(self, table):
+        """ Store a TrialTable as a structured array, the text columns as strings """
+        columns = [table[name] if table[name].dtype.kind != 'O' else table[name].astype(str) for name in table.names]
+        self._write([(TABLE_MEMBER, np.rec.fromarrays(columns, names=table.names))])
+
+    def keepTrials(self, nTrials):
+        """
+        Remove the arrays of the trials from the nTrials-th on, that a resumed
+        session presents again, by copying the other members to a new file
+        """
+        if not os.path.isfile(self.filename):
+            return
+        with zipfile.ZipFile(self.filename, 'r') as container:
+            names = [name for name in container.namelist()
+                     if name.startswith('trial/') and int(name.split('/')[1]) >= nTrials]
+            if not names:
+                return
+            with zipfile.ZipFile(self.filename + '.tmp', 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as kept:
+                for info in container.infolist():
+                    if info.filename not in names:
+                        kept.writestr(info, container.read(info))
+        os.remove(self.filename)
+        os.rename(self.filename + '.tmp', self.filename)
+
+    def _read(self, container, name):
+        return np.lib.format.read_array(io.BytesIO(container.read(name)), allow_pickle=False)
+
+    def settings(self):
+        with zipfile.ZipFile(self.filename, 'r') as container:
+            return json.loads(container.read(SETTINGS_MEMBER))
+
+    def table(self):
+        """ The trial table, a structured array with a field per column """
+        with zipfile.ZipFile(self.filename, 'r') as container:
+            return self._read(container, TABLE_MEMBER)
+
+    def trials(self):
+        """ The indices of the trials whose arrays are stored """
+        with zipfile.ZipFile(self.filename, 'r') as container:
+            return sorted(set(int(name.split('/')[1]) for name in container.namelist() if name.startswith('trial/')))
+
+    def trial(self, nTrial):
+        """
+        The arrays of the nTrial-th trial, a dict of trajectory and of the
+        frame intervals as frameIntervals/<phase>
+        """
+        group = trialGroup(nTrial)
+        with zipfile.ZipFile(self.filename, 'r') as container:
+            return dict((name[len(group):-len('.npy')], self._read(container, name))
+                        for name in container.namelist() if name.startswith(group))
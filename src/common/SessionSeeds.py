@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+MAX_SEED = 2 ** 31 - 1
+
+
+def drawSessionSeed(expInfo):
+    """
+    Draw a new session seed unless one was given in expInfo['SessionSeed'],
+    set to 0 to draw a random one. Returns the seed, stored in expInfo.
+    """
+    expInfo['SessionSeed'] = int(expInfo.get('SessionSeed', 0))
+    if expInfo['SessionSeed'] == 0:
+        expInfo['SessionSeed'] = int(np.random.randint(1, MAX_SEED))
+    return expInfo['SessionSeed']
+
+
+class SessionSeeds():
+
+    """
+    The random streams of a session. Every trial gets its own seed derived
+    from the session seed and the trial index, so that its stimuli can be
+    regenerated exactly, while rng draws the trial schedule (catch trials,
+    shuffling of the conditions).
+    """
+
+    def __init__(self, sessionSeed):
+        self.sessionSeed = int(sessionSeed)
+        self.rng = np.random.RandomState(self.sessionSeed)
+
+    def trialSeed(self, nTrial):
+        """ The seed of the nTrial-th trial of the session """
+        return int(np.random.RandomState([self.sessionSeed, nTrial]).randint(0, MAX_SEED))
+
+    def trialSeeds(self, nTrials):
+        return [self.trialSeed(i) for i in range(0, nTrials)]
+
+
+def trialRng(seed, stream=0):
+    """ The generator of one of the random streams of the trial with the given seed """
+    return np.random.RandomState([seed, stream])
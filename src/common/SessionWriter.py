@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import atexit
+import Queue
+import sys
+import threading
+import traceback
+
+# Number of pending writes after which submit() waits for the writer thread
+MAX_QUEUED_WRITES = 64
+
+
+class SessionWriter():
+
+    """
+    Run the file writes of a session, journal rows, settings and staircase
+    exports, in a background thread in the order they are submitted, so that
+    a slow disk never delays the stimuli. The queue is bounded, submit()
+    blocks when MAX_QUEUED_WRITES writes are pending. The errors of the
+    writes are printed when they happen and raised again by flush(), the
+    writes themselves never raise, so that a crash handler can always
+    submit its writes and raise the error that stopped the session.
+    """
+
+    def __init__(self, maxQueued=MAX_QUEUED_WRITES):
+        self.queue = Queue.Queue(maxsize=maxQueued)
+        self.errors = []
+        self.closed = False
+        self.thread = threading.Thread(target=self._write)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Call function(*args, **kwargs) in the writer thread, the arguments
+        must not change afterwards. Once the writer is closed, as in the
+        crash handlers after a failed close(), it is called right away.
+        """
+        if self.closed:
+            self._call(function, args, kwargs)
+        else:
+            self.queue.put((function, args, kwargs))
+
+    def flush(self, raiseErrors=True):
+        """ Wait for all the submitted writes, raises the first error of a write """
+        self.queue.join()
+        if self.errors:
+            errorType, error, errorTraceback = self.errors[0]
+            del self.errors[:]
+            if raiseErrors:
+                raise errorType, error, errorTraceback
+
+    def close(self, raiseErrors=True):
+        """ Wait for all the submitted writes and stop the writer thread """
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+            self.thread.join()
+        self.flush(raiseErrors)
+
+    def _write(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    break
+                self._call(*item)
+            finally:
+                self.queue.task_done()
+
+    def _call(self, function, args, kwargs):
+        try:
+            function(*args, **kwargs)
+        except Exception:
+            self.errors.append(sys.exc_info())
+            traceback.print_exc()
+
+
+_sessionWriter = None
+
+
+def sessionWriter():
+    """ The SessionWriter of the running session, a new one after the previous is closed """
+    global _sessionWriter
+    if _sessionWriter is None or _sessionWriter.closed:
+        _sessionWriter = SessionWriter()
+        # The pending writes are completed even when the session crashes
+        atexit.register(_sessionWriter.close, False)
+    return _sessionWriter
@@ -0,0 +1,31 @@
+class StimulusPool():
+
+    """
+    The stimuli of a window, created once per session and reused by all the
+    trials, so that their GL resources are not allocated again at every
+    trial. A trial gets a stimulus back with the state left by the previous
+    one and resets what it changes (positions, colors, textures, contrast).
+    """
+
+    def __init__(self, win):
+        self.win = win
+        self.stimuli = {}
+
+    def __len__(self):
+        return len(self.stimuli)
+
+    def get(self, key, create):
+        """ The stimulus stored under key, built by create(win) the first time """
+        if key not in self.stimuli:
+            self.stimuli[key] = create(self.win)
+        return self.stimuli[key]
+
+    def clear(self):
+        self.stimuli.clear()
+
+
+def stimulusPool(win):
+    """ The StimulusPool of win, created the first time it is needed """
+    if getattr(win, 'stimulusPool', None) is None:
+        win.stimulusPool = StimulusPool(win)
+    return win.stimulusPool
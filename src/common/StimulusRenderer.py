@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Headless rendering of the tracking stimulus.
+
+The frames of a trial are rasterized with numpy from its trajectories and
+its blink and probe schedule, without a psychopy window, so that stimulus
+movies for archives, figures and checks can be made in batch on every core,
+much faster than real time. renderTrials writes one image sequence or video
+file per trial, named like the old MovieFilesTracking frames.
+"""
+
+import os
+import numpy as np
+from Trajectories import generateTrialTrajectories, trialRectangles
+from SessionSeeds import trialRng
+from VideoRecorder import frameWriter
+
+# Default frame size, the one of the old MATLAB movies, in pixels
+MOVIE_SIZE = (900, 516)
+# The blinking balls switch color every BLINK_PERIOD seconds, and the probe
+# is shown for PROBE_TIME seconds since there is no response offline
+BLINK_PERIOD = 0.125
+PROBE_TIME = 1.0
+FIXATION_RADIUS = 0.10
+# The rgb colors in [-1, 1] of the psychopy color names used by the trials
+RGB_COLORS = {'black': (-1.0, -1.0, -1.0), 'white': (1.0, 1.0, 1.0),
+              'gray': (0.0, 0.0, 0.0), 'red': (1.0, -1.0, -1.0)}
+
+
+def rgb255(color):
+    """ The uint8 rgb triplet of a color name or of a [-1, 1] rgb triplet """
+    if isinstance(color, basestring):
+        color = RGB_COLORS[color.lower()]
+    return np.round((np.asarray(color, dtype=float) + 1.0) * 127.5).astype(np.uint8)
+
+
+def fitPixelsPerCm(expInfo, size, margin=0.1):
+    """ The scale that fits the rectangles of the trial in a frame of size pixels, leaving a margin """
+    rectangles = np.array(trialRectangles(expInfo))
+    halfWidth, halfHeight = np.abs(rectangles[:, [0, 2]]).max(), np.abs(rectangles[:, [1, 3]]).max()
+    return (1.0 - margin) * min(size[0] / (2.0 * halfWidth), size[1] / (2.0 * halfHeight))
+
+
+class FrameRasterizer():
+
+    """
+    Draw discs in (height, width, 3) uint8 frames with anti-aliased edges.
+    Positions are in [cm] from the center of the frame with y upwards, as in
+    the units='cm' psychopy windows.
+    """
+
+    def __init__(self, size, pixelsPerCm, background='Gray'):
+        self.width, self.height = size
+        self.pixelsPerCm = float(pixelsPerCm)
+        self.background = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self.background[:] = rgb255(background)
+
+    def toPixels(self, positions):
+        """ The (x, y) pixel coordinates of positions in [cm] """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2) * self.pixelsPerCm
+        return np.column_stack([(self.width - 1) / 2.0 + positions[:, 0],
+                                (self.height - 1) / 2.0 - positions[:, 1]])
+
+    def drawDiscs(self, frame, positions, radius, colors):
+        """ Draw in frame discs of radius [cm], colors is a (n, 3) uint8 array """
+        r = radius * self.pixelsPerCm
+        for (x, y), color in zip(self.toPixels(positions), colors):
+            x0, x1 = max(int(np.floor(x - r)), 0), min(int(np.ceil(x + r)) + 1, self.width)
+            y0, y1 = max(int(np.floor(y - r)), 0), min(int(np.ceil(y + r)) + 1, self.height)
+            if x0 >= x1 or y0 >= y1:
+                continue
+            dx, dy = np.arange(x0, x1) - x, np.arange(y0, y1) - y
+            # Fraction of every pixel covered by the disc, linear over the edge pixel
+            coverage = np.clip(r + 0.5 - np.sqrt(dy[:, np.newaxis] ** 2 + dx[np.newaxis, :] ** 2), 0, 1)
+            coverage = coverage[..., np.newaxis]
+            patch = frame[y0:y1, x0:x1]
+            patch[:] = np.round(patch * (1.0 - coverage) + color * coverage)
+
+    def render(self, positions, radius, colors, fixationRadius=FIXATION_RADIUS, fixationColor='White'):
+        """ A new frame with the balls and the central fixation dot """
+        frame = self.background.copy()
+        self.drawDiscs(frame, positions, radius, colors)
+        self.drawDiscs(frame, [[0.0, 0.0]], fixationRadius, [rgb255(fixationColor)])
+        return frame
+
+
+def trackingSchedule(owners, condition, seed, nBallsPerRectangle):
+    """
+    The blinking balls and the probe ball of a tracking trial, chosen as
+    trackingTrial does for condition ('Side' and 'label') and seed
+    """
+    side = {'Left': 0, 'Right': 1}[condition['Side']]
+    ballsLists = [np.flatnonzero(owners == 0), np.flatnonzero(owners == 1)]
+    if condition['label'].split('-')[0] == 'Unilateral':
+        blinkingBalls = list(ballsLists[side][0:2])
+    else:
+        blinkingBalls = list(ballsLists[0][0:2]) + list(ballsLists[1][0:2])
+    probeBall = ballsLists[side][trialRng(seed, 1).randint(0, nBallsPerRectangle)]
+    return blinkingBalls, probeBall
+
+
+def trialFrames(trajectory, duration, blinkingBalls, probeBall, blinkTime, fps,
+                blinkPeriod=BLINK_PERIOD, probeTime=PROBE_TIME):
+    """
+    Generate the (positions, colors) of the balls on every frame of a trial
+    shown at fps frames per second: the blinking phase, a still black frame,
+    the motion and the red probe, colors are (nBalls, 3) uint8 arrays
+    """
+    black, white, red = rgb255('Black'), rgb255('White'), rgb255('Red')
+    colors = np.tile(black, (trajectory.nBalls, 1))
+    start = trajectory.at(0.0)
+    for frame in range(0, int(round(blinkTime * fps))):
+        colors[blinkingBalls] = white if int(frame / (blinkPeriod * fps)) % 2 else black
+        yield start, colors.copy()
+    colors[:] = black
+    yield start, colors.copy()
+    # The motion is drawn at the time of every flip after the start, as in the trials
+    times = np.arange(1, int(round(duration * fps)) + 1) / float(fps)
+    for positions in trajectory.at(np.minimum(times, duration)):
+        yield positions, colors.copy()
+    colors[probeBall] = red
+    end = trajectory.at(duration)
+    for frame in range(0, int(round(probeTime * fps))):
+        yield end, colors.copy()
+
+
+def renderTrial(filename, expInfo, condition, ballSpeed, seed, size=MOVIE_SIZE, pixelsPerCm=None, fps=60.0):
+    """
+    Render a tracking trial to filename, an image sequence or a video file
+    depending on its extension. Returns the number of frames.
+    """
+    if pixelsPerCm is None:
+        pixelsPerCm = fitPixelsPerCm(expInfo, size)
+    trajectory = generateTrialTrajectories(expInfo, ballSpeed, seed)
+    blinkingBalls, probeBall = trackingSchedule(trajectory.owners, condition, seed, expInfo['NumBalls'])
+    rasterizer = FrameRasterizer(size, pixelsPerCm)
+    writer = frameWriter(filename, fps)
+    nFrames = 0
+    for positions, colors in trialFrames(trajectory, expInfo['Duration'], blinkingBalls, probeBall,
+                                         expInfo['BlinkTime'], fps):
+        writer.write(rasterizer.render(positions, expInfo['BallRadius'], colors))
+        nFrames += 1
+    writer.close()
+    return nFrames
+
+
+def _render(args):
+    return renderTrial(*args)
+
+
+def renderTrials(directory, expInfo, trials, size=MOVIE_SIZE, pixelsPerCm=None, fps=60.0,
+                 extension='.png', processes=None):
+    """
+    Render trials, a list of (condition, ballSpeed, seed), in directory as
+    Trial_0001, Trial_0002... using all the available cores. Returns the
+    file names.
+    """
+    import multiprocessing
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    filenames = [os.path.join(directory, 'Trial_%04d%s' % (i + 1, extension)) for i in range(0, len(trials))]
+    pool = multiprocessing.Pool(processes=processes)
+    pool.map(_render, [(filename, expInfo, condition, float(ballSpeed), int(seed), size, pixelsPerCm, fps)
+                       for filename, (condition, ballSpeed, seed) in zip(filenames, trials)])
+    pool.close()
+    pool.join()
+    return filenames
@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized generation of the ball trajectories for the tracking experiments.
+
+The state of every ball is held in (nBalls, 2) arrays and all the forces
+(ball-ball repulsion, edge repulsion and center attraction) are computed at
+once for all the balls and for all the bounding rectangles.
+
+Two motion models are available, selected by expInfo['PhysicsMode']:
+'Forces', the soft-force integrator, and 'Collisions', an event-driven
+model where the balls move in straight lines and bounce on the edges and on
+each other, computed in closed form between two collisions.
+"""
+
+import heapq
+import numpy as np
+
+# The motion is integrated at this fixed rate, the force parameters have been
+# tuned for it, and then interpolated at the flip times of the display
+PHYSICS_RATE = 60.0
+
+# Above this number of balls per rectangle the repulsion is only computed
+# between the balls closer than REPULSION_CUTOFF ball radii, found with a
+# uniform grid of cells, instead of between all the pairs of balls
+NEIGHBOUR_GRID_MIN_BALLS = 50
+REPULSION_CUTOFF = 8.0
+
+PHYSICS_MODES = ['Forces', 'Collisions']
+
+
+class Trajectory(object):
+
+    """
+    Compact storage of the positions of all the balls during a trial, as a
+    function of time. positions is a contiguous float32 (nSamples, nBalls, 2)
+    array sampled every 1/rate seconds from the start of the motion, and the
+    positions at any time are linearly interpolated by at(). owners is the
+    index of the bounding rectangle of every ball, so that the balls of a
+    rectangle are found with columns(). Indexing a trajectory slices it by sample.
+    """
+
+    def __init__(self, positions, owners, rate=PHYSICS_RATE):
+        self.positions = np.ascontiguousarray(positions, dtype=np.float32)
+        self.owners = np.ascontiguousarray(owners, dtype=np.int8)
+        self.rate = float(rate)
+
+    def __len__(self):
+        return self.positions.shape[0]
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def __getitem__(self, samples):
+        return self.positions[samples]
+
+    def at(self, t):
+        """
+        The positions of the balls t seconds after the start of the motion,
+        a (nBalls, 2) array or (len(t), nBalls, 2) if t is an array of times
+        """
+        u = np.clip(np.asarray(t, dtype=float) * self.rate, 0, len(self) - 1)
+        lower = np.minimum(np.floor(u).astype(int), len(self) - 2)
+        weight = (u - lower).astype(np.float32)[..., np.newaxis, np.newaxis]
+        return self.positions[lower] * (1 - weight) + self.positions[lower + 1] * weight
+
+    def sampled(self, rate):
+        """ The trajectory resampled every 1/rate seconds """
+        if rate == self.rate:
+            return self
+        return Trajectory(self.at(np.arange(0, int(round(self.duration * rate)) + 1) / float(rate)), self.owners, rate)
+
+    def columns(self, ballListID):
+        """ Indices of the balls belonging to rectangle ballListID """
+        return np.flatnonzero(self.owners == ballListID)
+
+    @property
+    def duration(self):
+        return (len(self) - 1) / self.rate
+
+    @property
+    def nBalls(self):
+        return self.positions.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.positions.nbytes + self.owners.nbytes
+
+    def save(self, filename):
+        """ Save the trajectory as an uncompressed .npz archive """
+        np.savez(filename, positions=self.positions, owners=self.owners, rate=self.rate)
+
+    @classmethod
+    def load(cls, filename, mmap_mode=None):
+        archive = np.load(filename, mmap_mode=mmap_mode)
+        return cls(archive['positions'], archive['owners'], float(archive['rate']))
+
+
+class EventTrajectory(object):
+
+    """
+    Trajectory of the event-driven model, stored as the list of the events
+    computed by simulateCollisions and evaluated exactly at any time by at()
+    """
+
+    def __init__(self, events, owners, duration):
+        self.events = events
+        self.owners = np.ascontiguousarray(owners, dtype=np.int8)
+        self.duration = float(duration)
+
+    def at(self, t):
+        """
+        The positions of the balls t seconds after the start of the motion,
+        a (nBalls, 2) array or (len(t), nBalls, 2) if t is an array of times
+        """
+        t = np.clip(np.asarray(t, dtype=float), 0, self.duration)
+        if t.ndim == 0:
+            return sampleEvents(self.events, t[np.newaxis])[0]
+        return sampleEvents(self.events, t)
+
+    def sampled(self, rate):
+        """ The Trajectory sampled every 1/rate seconds """
+        return Trajectory(self.at(np.arange(0, int(round(self.duration * rate)) + 1) / float(rate)), self.owners, rate)
+
+    def columns(self, ballListID):
+        """ Indices of the balls belonging to rectangle ballListID """
+        return np.flatnonzero(self.owners == ballListID)
+
+    @property
+    def nBalls(self):
+        return len(self.owners)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.events) + self.owners.nbytes
+
+
+def neighbourPairs(positions, owners, cutoff):
+    """
+    The pairs (i, j), in both orders, of the balls of the same rectangle that
+    are closer than cutoff. The balls are hashed in a uniform grid of cells
+    of side cutoff and only the 9 cells around every ball are searched.
+    """
+    nBalls = positions.shape[0]
+    cells = np.floor(positions / cutoff).astype(np.int64)
+    cells -= cells.min(axis=0)
+    # Pad the grid by one cell on every side so that neighbouring cells never
+    # wrap around, the rectangle index keeps the rectangles apart
+    nx, ny = cells[:, 0].max() + 3, cells[:, 1].max() + 3
+    keys = (owners.astype(np.int64) * ny + cells[:, 1] + 1) * nx + cells[:, 0] + 1
+    order = np.argsort(keys, kind='mergesort')
+    sortedKeys = keys[order]
+
+    first, second = [], []
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            neighbourKeys = keys + dy * nx + dx
+            start = np.searchsorted(sortedKeys, neighbourKeys, side='left')
+            counts = np.searchsorted(sortedKeys, neighbourKeys, side='right') - start
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            first.append(np.repeat(np.arange(nBalls), counts))
+            second.append(order[np.repeat(start, counts) + offsets])
+    i, j = np.concatenate(first), np.concatenate(second)
+    delta = positions[i] - positions[j]
+    keep = (i != j) & ((delta ** 2).sum(axis=1) < cutoff * cutoff)
+    return i[keep], j[keep]
+
+
+def integrateTrajectories(positions, directions, radii, owners, rectangles, ballSpeed, nFrames,
+                          repulsionStrength, edgerepulsionStrength, centerAttraction, cutoff=None):
+    """
+    Integrate the motion of the balls for nFrames steps.
+    positions, directions are (nBalls, 2) arrays, radii is (nBalls,), owners
+    is the (nBalls,) index of the bounding rectangle of each ball inside
+    rectangles, a (nRectangles, 4) array of [x0, y0, x1, y1].
+    Balls only repel other balls sharing the same rectangle, and if cutoff
+    is given only the ones closer than cutoff, see neighbourPairs.
+    Returns the (nFrames, nBalls, 2) float32 array of positions.
+    """
+    positions = np.array(positions, dtype=float)
+    directions = np.array(directions, dtype=float)
+    radii = np.asarray(radii, dtype=float)
+    owners = np.asarray(owners)
+    bounds = np.asarray(rectangles, dtype=float)[owners]
+    centers = np.column_stack([(bounds[:, 0] + bounds[:, 2]) / 2.0,
+                               (bounds[:, 1] + bounds[:, 3]) / 2.0])
+    nBalls = positions.shape[0]
+
+    if cutoff is None:
+        # Pairwise repulsion coefficients, zero on the diagonal and between
+        # balls of different rectangles
+        pairStrength = repulsionStrength * np.outer(radii, radii) * (owners[:, np.newaxis] == owners[np.newaxis, :])
+        np.fill_diagonal(pairStrength, 0.0)
+
+    frames = np.empty((nFrames, nBalls, 2), dtype=np.float32)
+    for i in range(0, nFrames):
+        # balls collide
+        if cutoff is None:
+            delta = positions[:, np.newaxis, :] - positions[np.newaxis, :, :]
+            dist2 = (delta ** 2).sum(axis=2)
+            np.fill_diagonal(dist2, 1.0)
+            force = ((pairStrength / (dist2 * dist2))[:, :, np.newaxis] * delta).sum(axis=1)
+        else:
+            first, second = neighbourPairs(positions, owners, cutoff)
+            delta = positions[first] - positions[second]
+            dist2 = (delta ** 2).sum(axis=1)
+            pairForce = (repulsionStrength * radii[first] * radii[second] / (dist2 * dist2))[:, np.newaxis] * delta
+            force = np.empty((nBalls, 2))
+            force[:, 0] = np.bincount(first, pairForce[:, 0], minlength=nBalls)
+            force[:, 1] = np.bincount(first, pairForce[:, 1], minlength=nBalls)
+
+        # Repulsion to borders
+        force += edgerepulsionStrength / (bounds[:, 0:2] - positions) ** 2
+        force -= edgerepulsionStrength / (bounds[:, 2:4] - positions) ** 2
+
+        # Add a little attraction to the center of the bounding rectangle
+        force -= positions - centers
+
+        # Renormalize direction with correct speed and move the balls
+        directions += centerAttraction * force
+        directions *= ballSpeed / np.sqrt((directions ** 2).sum(axis=1))[:, np.newaxis]
+        positions += directions
+        frames[i] = positions
+
+    return frames
+
+
+def scheduleEvents(heap, balls, t, positions, velocities, radii, bounds, group, nEvents, duration, walls=True):
+    """
+    Push on heap the next wall collision and the next ball collision before
+    duration of the given balls of the rectangle whose balls are group, at
+    time t, as (time, ball, other ball or -1 for a wall, axis of the wall,
+    event counts of the two balls) tuples. An entry is stale once the event
+    count of one of its balls has changed.
+    """
+    if walls:
+        for b in balls:
+            # The wall is the first edge reached along x or y, computed on scalars
+            x, y = positions[b].tolist()
+            vx, vy = velocities[b].tolist()
+            left, bottom, right, top = bounds[b].tolist()
+            r = radii[b]
+            tx = ((right - r - x) / vx if vx > 0 else (left + r - x) / vx) if vx != 0 else np.inf
+            ty = ((top - r - y) / vy if vy > 0 else (bottom + r - y) / vy) if vy != 0 else np.inf
+            tWall = t + max(min(tx, ty), 0.0)
+            if tWall < duration:
+                heapq.heappush(heap, (tWall, b, -1, 0 if tx <= ty else 1, nEvents[b], 0))
+    if len(group) < 2:
+        return
+    # The times for the balls to touch every ball of group, the smallest root
+    # of |d + w t| = r_first + r_second for the approaching pairs, inf for the
+    # others and a ball with itself
+    d = positions[group] - positions[balls][:, np.newaxis]
+    w = velocities[group] - velocities[balls][:, np.newaxis]
+    dx, dy, wx, wy = d[:, :, 0], d[:, :, 1], w[:, :, 0], w[:, :, 1]
+    dw = dx * wx + dy * wy
+    ww = wx * wx + wy * wy
+    sigma = radii[group] + radii[balls][:, np.newaxis]
+    discriminant = dw * dw - ww * (dx * dx + dy * dy - sigma * sigma)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pairs = np.where((dw < 0) & (discriminant > 0), -(dw + np.sqrt(discriminant)) / ww, np.inf)
+    first = pairs.argmin(axis=1)
+    for b, k, tPair in zip(balls, group[first].tolist(), pairs[np.arange(len(balls)), first].tolist()):
+        tPair = t + max(tPair, 0.0)
+        if tPair < duration:
+            heapq.heappush(heap, (tPair, b, k, 0, nEvents[b], nEvents[k]))
+
+
+def simulateCollisions(positions, velocities, radii, owners, rectangles, duration):
+    """
+    Event-driven motion of the balls during duration seconds, velocities in
+    [cm/s]. Every ball keeps its speed: it is reflected by the edges of its
+    rectangle and, when two balls of the same rectangle touch, each of them
+    bounces off the other as off a wall along the line joining their centers.
+    Returns the events as the arrays (times, balls, positions, velocities)
+    sorted by ball and time, one row every time the velocity of a ball
+    changes, starting at time 0, so that until its next row the position of
+    a ball is positions[k] + velocities[k] * (t - times[k]), see sampleEvents.
+    """
+    positions = np.array(positions, dtype=float)
+    velocities = np.array(velocities, dtype=float)
+    radii = np.asarray(radii, dtype=float)
+    owners = np.asarray(owners)
+    bounds = np.asarray(rectangles, dtype=float)[owners]
+    nBalls = len(owners)
+    # The balls every ball can collide with, the ones of its rectangle
+    groups = dict((owner, np.flatnonzero(owners == owner)) for owner in set(owners.tolist()))
+    owners = owners.tolist()
+
+    # The next collisions are kept in a heap, after an event only the ones
+    # of the balls involved in it are computed again, the older ones of
+    # these balls are discarded when they are popped. Only the first
+    # collision of a ball with another ball is pushed, when the other ball
+    # changed direction before it, the next one is computed then.
+    t = 0.0
+    nEvents = [0] * nBalls
+    heap = []
+    for group in groups.values():
+        scheduleEvents(heap, group.tolist(), t, positions, velocities, radii, bounds, group, nEvents, duration)
+    times, balls = [np.zeros(nBalls)], [np.arange(nBalls)]
+    eventPositions, eventVelocities = [positions.copy()], [velocities.copy()]
+    while heap:
+        tEvent, i, j, axis, iEvents, jEvents = heapq.heappop(heap)
+        if nEvents[i] != iEvents:
+            continue
+        group = groups[owners[i]]
+        if j >= 0 and nEvents[j] != jEvents:
+            scheduleEvents(heap, [i], t, positions, velocities, radii, bounds, group, nEvents, duration, walls=False)
+            continue
+        positions += velocities * (tEvent - t)
+        t = tEvent
+        if j < 0:
+            involved = [i]
+            velocities[i, axis] *= -1
+        else:
+            involved = [i, j]
+            # Each ball bounces off the other if it moves toward it
+            (xi, yi), (xj, yj) = positions[i].tolist(), positions[j].tolist()
+            (vxi, vyi), (vxj, vyj) = velocities[i].tolist(), velocities[j].tolist()
+            norm = np.hypot(xj - xi, yj - yi)
+            nx, ny = (xj - xi) / norm, (yj - yi) / norm
+            vn = vxi * nx + vyi * ny
+            if vn > 0:
+                velocities[i] = vxi - 2 * vn * nx, vyi - 2 * vn * ny
+            vn = vxj * nx + vyj * ny
+            if vn < 0:
+                velocities[j] = vxj - 2 * vn * nx, vyj - 2 * vn * ny
+
+        for b in involved:
+            nEvents[b] += 1
+        scheduleEvents(heap, involved, t, positions, velocities, radii, bounds, group, nEvents, duration)
+        times.append([t] * len(involved))
+        balls.append(involved)
+        eventPositions.append(positions[involved])
+        eventVelocities.append(velocities[involved])
+
+    times, balls = np.concatenate(times), np.concatenate(balls)
+    order = np.lexsort((times, balls))
+    return times[order], balls[order], np.vstack(eventPositions)[order], np.vstack(eventVelocities)[order]
+
+
+def sampleEvents(events, t):
+    """
+    The positions of the balls at the times t, an array of times in seconds,
+    from the events computed by simulateCollisions.
+    Returns the (len(t), nBalls, 2) float32 array of positions.
+    """
+    times, balls, positions, velocities = events
+    t = np.asarray(t, dtype=float)
+    # Search the last event of every ball before every t in a single sorted
+    # array, the rows of a ball being offset by span
+    span = max(times.max(), t.max()) + 1.0
+    k = np.searchsorted(balls * span + times, np.arange(balls.max() + 1) * span + t[:, np.newaxis], side='right') - 1
+    return (positions[k] + velocities[k] * (t[:, np.newaxis] - times[k])[:, :, np.newaxis]).astype(np.float32)
+
+
+def trialRectangles(expInfo):
+    """ The left and right bounding rectangles of the tracking stimulus """
+    rectWidth, rectHeight = expInfo['RectWidth'], expInfo['RectHeight']
+    displacementX = 4  # 1 cm central displacement
+    return [[-rectWidth - displacementX / 2.0, -rectHeight / 2.0, -displacementX / 2.0, rectHeight / 2.0],
+            [displacementX / 2.0, -rectHeight / 2.0, rectWidth + displacementX / 2.0, rectHeight / 2.0]]
+
+
+def initialBallState(nBalls, radius, boundRect, rng):
+    """
+    Draw the starting positions and directions of nBalls balls in boundRect.
+    boundRect is split in a grid of at least nBalls cells, the four quadrants
+    for up to four balls, and every ball is put in a different random cell.
+    Returns positions, directions and the list of the cells of the grid.
+    """
+    width, height = boundRect[2] - boundRect[0], boundRect[3] - boundRect[1]
+    nColumns = max(2, int(np.ceil(np.sqrt(nBalls * width / float(height)))))
+    nRows = max(2, int(np.ceil(nBalls / float(nColumns))))
+    xs = np.linspace(boundRect[0], boundRect[2], nColumns + 1)
+    ys = np.linspace(boundRect[1], boundRect[3], nRows + 1)
+    # The cells that build the main rectangle, row by row from the bottom
+    rectanglesList = [[xs[c], ys[r], xs[c + 1], ys[r + 1]] for r in range(0, nRows) for c in range(0, nColumns)]
+
+    cells = np.array(rectanglesList)[rng.permutation(len(rectanglesList))[0:nBalls]]
+    positions = rng.uniform(cells[:, 0:2] + radius, cells[:, 2:4] - radius)
+    directions = rng.uniform(-1, 1, size=(nBalls, 2))
+    directions /= np.sqrt((directions ** 2).sum(axis=1))[:, np.newaxis]
+    return positions, directions, rectanglesList
+
+
+def trialInitialState(expInfo, seed):
+    """
+    The starting state of all the balls of a tracking trial, fully determined
+    by seed. Returns positions, directions, the index of the bounding
+    rectangle of every ball and the placement cells of the two rectangles.
+    """
+    rng = np.random.RandomState(seed)
+    nBalls = expInfo['NumBalls']
+    positions, directions, owners, quadrants = [], [], [], []
+    for ballListID, boundRect in enumerate(trialRectangles(expInfo)):
+        rectPositions, rectDirections, rectQuadrants = initialBallState(nBalls, expInfo['BallRadius'], boundRect, rng)
+        positions.append(rectPositions)
+        directions.append(rectDirections)
+        owners.append([ballListID] * nBalls)
+        quadrants.append(rectQuadrants)
+
+    return np.vstack(positions), np.vstack(directions), np.concatenate(owners), quadrants
+
+
+def generateTrialTrajectories(expInfo, ballSpeed, seed):
+    """
+    Compute the trajectory of a tracking trial from scratch, with ballSpeed
+    in [cm/s], as a function of the time from the start of the motion, so
+    that it does not depend on the refresh rate of the display.
+    The soft-force model is integrated at PHYSICS_RATE and returned as a
+    Trajectory, with expInfo['PhysicsMode'] set to 'Collisions' the balls
+    follow the event-driven model of simulateCollisions, an EventTrajectory.
+    It only depends on its arguments so that it can be run in a worker process.
+    """
+    positions, directions, owners, quadrants = trialInitialState(expInfo, seed)
+    radii = np.ones(len(owners)) * expInfo['BallRadius']
+    if expInfo.get('PhysicsMode', 'Forces') == 'Collisions':
+        events = simulateCollisions(positions, directions * ballSpeed, radii, owners, trialRectangles(expInfo),
+                                    expInfo['Duration'])
+        return EventTrajectory(events, owners, expInfo['Duration'])
+
+    nSteps = int(np.ceil(expInfo['Duration'] * PHYSICS_RATE))
+    cutoff = None
+    if expInfo['NumBalls'] >= NEIGHBOUR_GRID_MIN_BALLS:
+        cutoff = REPULSION_CUTOFF * expInfo['BallRadius']
+    frames = integrateTrajectories(positions, directions, radii, owners, trialRectangles(expInfo),
+                                   ballSpeed / PHYSICS_RATE, nSteps, repulsionStrength=2000.0 * ballSpeed,
+                                   edgerepulsionStrength=10.0 * ballSpeed, centerAttraction=0.0001, cutoff=cutoff)
+    return Trajectory(np.concatenate([positions[np.newaxis], frames]), owners, PHYSICS_RATE)
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk library of precomputed tracking trajectories.
+
+Trajectories sharing the same stimulus parameters are stacked in .npy shards
+of shape (nTrajectories, nSamples, nBalls, 2), sampled at PHYSICS_RATE, that
+are memory-mapped when read. The event trajectories of the Collisions mode
+are stored exactly, as .npz shards of their concatenated events and of the
+offsets of every trajectory in them. An index.json file maps every
+trajectory key to its shard and row, and every shard to the rectangles of
+its balls.
+A whole session can be generated offline once with buildLibrary, or from
+the command line with buildTrajectoryLibrary.py, and then reused across
+subjects.
+"""
+
+import json
+import os
+import numpy as np
+from Trajectories import Trajectory, EventTrajectory, generateTrialTrajectories, PHYSICS_RATE
+
+# The arrays of the events of simulateCollisions, in the .npz shards
+EVENT_ARRAYS = ['times', 'balls', 'positions', 'velocities']
+
+INDEX_FILE = 'index.json'
+
+
+def trajectoryKey(expInfo, ballSpeed, seed):
+    """
+    The key of a trajectory: seed, speed, NumBalls, RectWidth, RectHeight,
+    BallRadius, Duration and the physics mode
+    """
+    return '%d_%.6g_%d_%.6g_%.6g_%.6g_%.6g_%s' % (
+        seed, ballSpeed, expInfo['NumBalls'], expInfo['RectWidth'], expInfo['RectHeight'],
+        expInfo['BallRadius'], expInfo['Duration'], expInfo.get('PhysicsMode', 'Forces'))
+
+
+class TrajectoryLibrary():
+
+    """
+    Lookup of precomputed trajectories stored in directory
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.shards = {}
+        self.index = {'shards': [], 'trajectories': {}, 'owners': {}}
+        indexFile = os.path.join(directory, INDEX_FILE)
+        if os.path.isfile(indexFile):
+            with open(indexFile, 'r') as f:
+                self.index = json.load(f)
+            # The libraries built before the owners were stored
+            self.index.setdefault('owners', {})
+
+    def __len__(self):
+        return len(self.index['trajectories'])
+
+    def __contains__(self, key):
+        return key in self.index['trajectories']
+
+    def get(self, expInfo, ballSpeed, seed):
+        """
+        The stored Trajectory of a trial, an EventTrajectory for the
+        Collisions mode, None if it is not in the library
+        """
+        entry = self.index['trajectories'].get(trajectoryKey(expInfo, ballSpeed, seed))
+        if entry is None:
+            return None
+        shardName, row = entry
+        if shardName not in self.shards:
+            if shardName.endswith('.npz'):
+                with np.load(os.path.join(self.directory, shardName)) as shard:
+                    self.shards[shardName] = dict((name, shard[name]) for name in shard.files)
+            else:
+                self.shards[shardName] = np.load(os.path.join(self.directory, shardName), mmap_mode='r')
+        shard = self.shards[shardName]
+        if shardName.endswith('.npz'):
+            start, end = shard['offsets'][row], shard['offsets'][row + 1]
+            events = tuple(shard[name][start:end] for name in EVENT_ARRAYS)
+            return EventTrajectory(events, self.index['owners'][shardName], expInfo['Duration'])
+        positions = shard[row]
+        owners = self.index['owners'].get(shardName)
+        if owners is None:
+            owners = np.repeat([0, 1], positions.shape[1] // 2)
+        return Trajectory(positions, owners, PHYSICS_RATE)
+
+    def add(self, expInfo, trials, trajectories):
+        """
+        Store a new shard with the trajectories computed for trials, a list
+        of (ballSpeed, seed) pairs, all of the same kind and with the same
+        balls as they share expInfo
+        """
+        name = 'shard_%04d' % len(self.index['shards'])
+        if isinstance(trajectories[0], EventTrajectory):
+            shardName = name + '.npz'
+            offsets = np.cumsum([0] + [len(t.events[0]) for t in trajectories])
+            arrays = dict((arrayName, np.concatenate([t.events[i] for t in trajectories]))
+                          for i, arrayName in enumerate(EVENT_ARRAYS))
+            np.savez(os.path.join(self.directory, shardName), offsets=offsets, **arrays)
+        else:
+            shardName = name + '.npy'
+            np.save(os.path.join(self.directory, shardName),
+                    np.array([t.sampled(PHYSICS_RATE).positions for t in trajectories], dtype=np.float32))
+        self.index['shards'].append(shardName)
+        self.index['owners'][shardName] = trajectories[0].owners.tolist()
+        for row, (ballSpeed, seed) in enumerate(trials):
+            self.index['trajectories'][trajectoryKey(expInfo, ballSpeed, seed)] = [shardName, row]
+        self.saveIndex()
+
+    def saveIndex(self):
+        indexFile = os.path.join(self.directory, INDEX_FILE)
+        with open(indexFile + '.tmp', 'w') as f:
+            json.dump(self.index, f)
+        if os.path.isfile(indexFile):
+            os.remove(indexFile)
+        os.rename(indexFile + '.tmp', indexFile)
+
+
+def _generate(args):
+    return generateTrialTrajectories(*args)
+
+
+def buildLibrary(directory, expInfo, trials, processes=None):
+    """
+    Generate offline the trajectories of trials, a list of (ballSpeed, seed)
+    pairs, using all the available cores, and store the missing ones in the
+    library in directory
+    """
+    import multiprocessing
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    library = TrajectoryLibrary(directory)
+    trials = [(float(s), int(seed)) for s, seed in trials
+              if trajectoryKey(expInfo, s, seed) not in library]
+    if trials:
+        pool = multiprocessing.Pool(processes=processes)
+        trajectories = pool.map(_generate, [(expInfo, s, seed) for s, seed in trials])
+        pool.close()
+        pool.join()
+        library.add(expInfo, trials, trajectories)
+    return library
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from Trajectories import generateTrialTrajectories
+from TrajectoryLibrary import TrajectoryLibrary, trajectoryKey
+
+# Only the entries of expInfo that determine the trajectories are sent to the worker
+TRAJECTORY_KEYS = ['NumBalls', 'RectWidth', 'RectHeight', 'BallRadius', 'Duration', 'PhysicsMode']
+
+
+class TrajectoryPrefetcher():
+
+    """
+    Compute the trajectories of the next tracking trials in a worker process,
+    so that they are ready when the motion starts. A trial is identified by
+    its ball speed and its seed. If expInfo['TrajectoryLibrary'] is set, the
+    trajectories found in that library are used instead of being computed.
+    """
+
+    def __init__(self, expInfo, processes=1):
+        import multiprocessing
+        self.trajectoryInfo = dict((k, expInfo[k]) for k in TRAJECTORY_KEYS if k in expInfo)
+        self.pool = multiprocessing.Pool(processes=processes)
+        self.pending = {}
+        self.library = None
+        if expInfo.get('TrajectoryLibrary'):
+            self.library = TrajectoryLibrary(expInfo['TrajectoryLibrary'])
+
+    def submit(self, ballSpeed, seed):
+        """ Start computing the trajectories of a trial in background """
+        if self.library is not None and trajectoryKey(self.trajectoryInfo, ballSpeed, seed) in self.library:
+            return
+        if (ballSpeed, seed) not in self.pending:
+            self.pending[(ballSpeed, seed)] = self.pool.apply_async(
+                generateTrialTrajectories, (self.trajectoryInfo, ballSpeed, seed))
+
+    def get(self, ballSpeed, seed):
+        """
+        Collect the trajectories of a trial, waiting for the worker if they
+        are not ready yet. Trials that were never submitted are computed here.
+        """
+        if self.library is not None:
+            trajectory = self.library.get(self.trajectoryInfo, ballSpeed, seed)
+            if trajectory is not None:
+                return trajectory
+        result = self.pending.pop((ballSpeed, seed), None)
+        if result is None:
+            return generateTrialTrajectories(self.trajectoryInfo, ballSpeed, seed)
+        return result.get()
+
+    def close(self):
+        self.pending.clear()
+        self.pool.terminate()
+        self.pool.join()
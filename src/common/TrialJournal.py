@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import csv
+import json
+import os
+
+# The journal is forced to disk every FSYNC_EVERY trials, 0 to leave it to the OS
+FSYNC_EVERY = 1
+
+
+def _jsonValue(value):
+    """ numpy scalars as python numbers """
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(repr(value) + " is not JSON serializable")
+
+
+class TrialJournal():
+
+    """
+    Append-only log of the trials of a session, one row per trial written in
+    constant time, as CSV or as JSON lines when filename ends with .jsonl.
+    The rows are dicts, the CSV columns are the given ones or the keys of the
+    first row. Every row is flushed and the file is fsynced every fsyncEvery
+    rows, so that a crash loses at most the trials after the last fsync. The
+    full staircase exports are only written once at the end of the session.
+    """
+
+    def __init__(self, filename, columns=None, fsyncEvery=FSYNC_EVERY):
+        self.filename = filename
+        self.columns = list(columns) if columns is not None else None
+        self.fsyncEvery = fsyncEvery
+        self.jsonLines = filename.endswith('.jsonl')
+        self.nRows = 0
+        self._dropTornRow()
+        self.file = open(filename, 'ab')
+        self.writer = None
+
+    def _dropTornRow(self):
+        """ Remove the incomplete last row that a crash may have left in an existing journal """
+        if not os.path.isfile(self.filename):
+            return
+        with open(self.filename, 'r+b') as f:
+            content = f.read()
+            if content and not content.endswith('\n'):
+                f.truncate(content.rfind('\n') + 1)
+
+    def __len__(self):
+        return self.nRows
+
+    def write(self, row):
+        """ Append a trial, a dict of column values """
+        if self.jsonLines:
+            self.file.write(json.dumps(row, default=_jsonValue) + '\n')
+        else:
+            if self.writer is None:
+                if self.columns is None:
+                    self.columns = list(row.keys())
+                self.writer = csv.DictWriter(self.file, self.columns, extrasaction='raise')
+                # Not file.tell(), that is 0 in append mode until the first
+                # write on Windows, where a resumed journal would get a header again
+                if os.path.getsize(self.filename) == 0:
+                    self.writer.writeheader()
+            self.writer.writerow(row)
+        self.nRows += 1
+        self.file.flush()
+        if self.fsyncEvery and self.nRows % self.fsyncEvery == 0:
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        if not self.file.closed:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+
+
+def readJournal(filename):
+    """ The rows of a journal, dicts of column values, strings for the CSV ones """
+    with open(filename, 'rb') as f:
+        if filename.endswith('.jsonl'):
+            return [json.loads(line) for line in f if line.strip()]
+        return list(csv.DictReader(f))
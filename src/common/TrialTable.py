@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+# Initial number of rows of a TrialTable, it doubles whenever it is full
+INITIAL_CAPACITY = 256
+
+
+def _missing(dtype):
+    """ The value of a column that a row does not set """
+    if dtype.kind == 'f':
+        return np.nan
+    if dtype.kind == 'O':
+        return None
+    return 0
+
+
+class TrialTable():
+
+    """
+    The trials of a session stored column by column in preallocated typed
+    numpy arrays, dtypes is the list of (column, dtype) pairs, object for
+    the text columns. Appending a trial is O(1) amortized, the arrays double
+    their capacity when full, and the columns are handed to pandas or
+    pyarrow as views without copying them, that are only imported when the
+    table is saved.
+    """
+
+    def __init__(self, dtypes, capacity=INITIAL_CAPACITY):
+        self.names = [name for name, dtype in dtypes]
+        self.arrays = dict((name, np.empty(capacity, dtype=dtype)) for name, dtype in dtypes)
+        self.missing = dict((name, _missing(self.arrays[name].dtype)) for name in self.names)
+        self.nRows = 0
+
+    def __len__(self):
+        return self.nRows
+
+    def __getitem__(self, name):
+        """ The values of column name, a view of its array """
+        return self.arrays[name][0:self.nRows]
+
+    @property
+    def capacity(self):
+        return len(self.arrays[self.names[0]])
+
+    def append(self, row):
+        """ Append a trial, a dict of column values, the missing ones are nan, 0 or None """
+        unknown = set(row) - set(self.names)
+        if unknown:
+            raise ValueError("Unknown trial columns " + str(sorted(unknown)))
+        if self.nRows == self.capacity:
+            capacity = 2 * self.capacity
+            for name in self.names:
+                array = np.empty(capacity, dtype=self.arrays[name].dtype)
+                array[0:self.nRows] = self.arrays[name][0:self.nRows]
+                self.arrays[name] = array
+        for name in self.names:
+            self.arrays[name][self.nRows] = row.get(name, self.missing[name])
+        self.nRows += 1
+
+    def toDataFrame(self):
+        """ A pandas DataFrame of the trials, built on views of the columns """
+        import pandas as pd
+        return pd.DataFrame(dict((name, self[name]) for name in self.names), columns=self.names, copy=False)
+
+    def toExcel(self, filename):
+        self.toDataFrame().to_excel(filename)
+
+    def toParquet(self, filename):
+        """ Write the trials to a Parquet file, the numeric columns are passed to pyarrow without copies """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.Table.from_arrays([pa.array(self[name]) for name in self.names], names=self.names)
+        pq.write_table(table, filename)
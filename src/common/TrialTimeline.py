@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+
+def alternating(nFrames, framesPerState, offset=0):
+    """
+    The 0, 1, 0, 1... state of nFrames frames that switches every
+    framesPerState frames, possibly a fractional number, offset frames
+    after the first frame
+    """
+    return ((np.arange(0, nFrames) + offset) // float(framesPerState) % 2).astype(np.int8)
+
+
+class TrialTimeline():
+
+    """
+    The timed phases of a trial compiled to frames before the trial starts.
+    Phases are appended with their duration, rounded to whole frames at fps,
+    and the stimulus state on every frame (color indices, visibility,
+    position rows) is stored in per-frame channel arrays, so that the render
+    loop only indexes arrays and flips, without reading clocks between flips.
+    A phase is identified by the index returned by addPhase, since the same
+    phase name may appear twice.
+    """
+
+    def __init__(self, fps):
+        self.fps = float(fps)
+        self.phases = []
+        self.nFrames = 0
+        self.channels = {}
+
+    def __len__(self):
+        return self.nFrames
+
+    def __getitem__(self, name):
+        return self.channels[name]
+
+    def addPhase(self, name, duration=None, nFrames=None):
+        """ Append a phase of duration [s] or of nFrames frames, returns its index """
+        if self.channels:
+            raise ValueError("The phases must be added before the channels")
+        if nFrames is None:
+            nFrames = int(round(duration * self.fps))
+        self.phases.append((name, self.nFrames, self.nFrames + nFrames))
+        self.nFrames += nFrames
+        return len(self.phases) - 1
+
+    def addChannel(self, name, default=0, dtype=np.int8, shape=()):
+        """ A new per-frame array of values of shape, set to default on every frame """
+        self.channels[name] = np.empty((self.nFrames,) + tuple(shape), dtype=dtype)
+        self.channels[name][:] = default
+        return self.channels[name]
+
+    def name(self, phase):
+        return self.phases[phase][0]
+
+    def frames(self, phase):
+        """ The frame indices of phase """
+        name, start, stop = self.phases[phase]
+        return xrange(start, stop)
+
+    def phaseSlice(self, phase):
+        name, start, stop = self.phases[phase]
+        return slice(start, stop)
+
+    def phaseFrames(self, phase):
+        """ The number of frames of phase """
+        name, start, stop = self.phases[phase]
+        return stop - start
+
+    def set(self, name, phase, values):
+        """ Set channel name on all the frames of phase """
+        self.channels[name][self.phaseSlice(phase)] = values
+
+    def times(self, phase):
+        """ The time [s] of every frame of phase from the start of the phase """
+        return np.arange(0, self.phaseFrames(phase)) / self.fps
+
+    def elapsedFrames(self, elapsed):
+        """ The number of whole frames in elapsed [s], as measured between two flip timestamps """
+        return int(round(elapsed * self.fps))
+
+    def flipFrames(self, nFrames, flip, start):
+        """
+        The index of the frame to draw before every call of flip(), that
+        returns its timestamp [s], until nFrames frames have elapsed from
+        the flip at time start. The index is counted from the timestamps,
+        so that a dropped frame is skipped instead of delaying the rest.
+        """
+        frame = 0
+        while frame < nFrames:
+            yield frame
+            frame = self.elapsedFrames(flip() - start)
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+import os
+import Queue
+import sys
+import threading
+import numpy as np
+
+# Frames waiting to be encoded, when the queue is full capture() waits up to
+# CAPTURE_TIMEOUT seconds for the writer before dropping the frame
+MAX_QUEUED_FRAMES = 32
+CAPTURE_TIMEOUT = 2.0
+VIDEO_EXTENSIONS = ['.mp4', '.avi', '.mov', '.mkv']
+
+
+class ImageSequenceWriter():
+
+    """
+    Write the frames as numbered images, filename_00001.png... The frames
+    are PIL images or (height, width, 3) uint8 arrays, that are saved as
+    they are in .npy files
+    """
+
+    def __init__(self, filename):
+        self.root, self.extension = os.path.splitext(filename)
+        self.nFrames = 0
+
+    def write(self, frame):
+        self.nFrames += 1
+        filename = '%s_%05d%s' % (self.root, self.nFrames, self.extension)
+        if self.extension == '.npy':
+            np.save(filename, np.asarray(frame))
+            return
+        if isinstance(frame, np.ndarray):
+            from PIL import Image
+            frame = Image.fromarray(frame)
+        frame.save(filename)
+
+    def close(self):
+        pass
+
+
+class VideoFileWriter():
+
+    """ Encode the frames in a video file, requires imageio with ffmpeg """
+
+    def __init__(self, filename, fps):
+        import imageio
+        self.writer = imageio.get_writer(filename, fps=fps)
+
+    def write(self, frame):
+        self.writer.append_data(np.asarray(frame))
+
+    def close(self):
+        self.writer.close()
+
+
+def frameWriter(filename, fps):
+    """ The writer of a video file or of an image sequence, depending on the extension of filename """
+    if os.path.splitext(filename)[1].lower() in VIDEO_EXTENSIONS:
+        return VideoFileWriter(filename, fps)
+    return ImageSequenceWriter(filename)
+
+
+class VideoRecorder():
+
+    """
+    Stream the frames of a window to disk. capture() grabs the frame in the
+    render loop and a background thread encodes it, so that the memory used
+    is bounded by MAX_QUEUED_FRAMES frames instead of growing with the trial.
+    When the encoding is slower than the display capture() waits for it, a
+    frame is only dropped if the writer is stuck for timeout seconds, and
+    the recordings that lost frames are reported as errors.
+    Every recording, usually a trial, goes to its own file, an image sequence
+    or a video file depending on the extension.
+    """
+
+    def __init__(self, win, maxQueued=MAX_QUEUED_FRAMES, timeout=CAPTURE_TIMEOUT):
+        self.win = win
+        self.queue = Queue.Queue(maxsize=maxQueued)
+        self.timeout = timeout
+        self.nRecordings = 0
+        self.filename = None
+        self.nFrames = 0
+        self.nDropped = 0
+        # The (filename, dropped frames, captured frames) of the recordings that lost frames
+        self.losses = []
+        self.thread = threading.Thread(target=self._writeFrames)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def start(self, prefix, extension='.png'):
+        """
+        Start a new recording in prefix_0001.png, prefix_0002.png... numbered
+        by recording, returns its file name
+        """
+        self.nRecordings += 1
+        self.filename = '%s_%04d%s' % (prefix, self.nRecordings, extension)
+        directory = os.path.dirname(self.filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.nFrames, self.nDropped = 0, 0
+        self.queue.put(('start', (self.filename, self.win.measuredFPS)))
+        return self.filename
+
+    def capture(self, buffer='front'):
+        """ Queue the current frame of the window, by default the last flipped one """
+        self.win.getMovieFrame(buffer=buffer)
+        # getMovieFrame keeps every frame in win.movieFrames, take it back
+        frame = self.win.movieFrames.pop()
+        try:
+            self.queue.put(('frame', frame), timeout=self.timeout)
+            self.nFrames += 1
+        except Queue.Full:
+            self.nDropped += 1
+
+    def stop(self):
+        """ End the recording, its last frames are written in background, returns the number of dropped frames """
+        self.queue.put(('stop', None))
+        if self.nDropped:
+            self.losses.append((self.filename, self.nDropped, self.nFrames + self.nDropped))
+            sys.stderr.write("*** ERROR: video recorder dropped %d of %d frames of %s\n" %
+                             (self.nDropped, self.nFrames + self.nDropped, self.filename))
+        return self.nDropped
+
+    def close(self):
+        """ Write all the queued frames and stop the writer thread, once """
+        if not self.thread.is_alive():
+            return
+        self.queue.put(None)
+        self.thread.join()
+        for filename, nDropped, nCaptured in self.losses:
+            sys.stderr.write("*** ERROR: %s is missing %d of %d frames\n" % (filename, nDropped, nCaptured))
+
+    def _writeFrames(self):
+        writer = None
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            kind, value = item
+            if kind == 'start':
+                writer = frameWriter(*value)
+            elif kind == 'frame' and writer is not None:
+                writer.write(value)
+            elif kind == 'stop' and writer is not None:
+                writer.close()
+                writer = None
+        if writer is not None:
+            writer.close()
+
+
+def videoRecorder(win):
+    """ The VideoRecorder of win, created the first time it is needed """
+    if getattr(win, 'videoRecorder', None) is None:
+        win.videoRecorder = VideoRecorder(win)
+    return win.videoRecorder
+
+
+def closeVideoRecorder(win):
+    """
+    Write the frames still queued by the VideoRecorder of win, if it has one,
+    and finalize its file, also when the session crashed in a recording
+    """
+    if getattr(win, 'videoRecorder', None) is not None:
+        win.videoRecorder.close()
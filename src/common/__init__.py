@@ -1,3 +1,4 @@
 from Ball import Ball
+from BallField import BallField
 from Geometry import cartesian2polar, polar2cartesian, normalized, rectangleCenter
 from perfectObserver import perfectObserver
\ No newline at end of file
@@ -1,6 +1,7 @@
-def perfectObserver(obs_mean, obs_std, intensity, guessRate=0, lapseRate=0):
+def perfectObserver(obs_mean, obs_std, intensity, guessRate=0, lapseRate=0, rng=None):
+    """ The simulated response, drawn from rng, a numpy RandomState, or from the global generator """
     import numpy as np
     from scipy.special import erf
-    decision = np.random.rand()
+    decision = (rng if rng is not None else np.random).rand()
     observer  = guessRate+(1-guessRate-lapseRate)*(0.5*(1.0 + erf( (intensity-obs_mean)/( np.sqrt(2.0)*obs_std ))))
     return decision > observer
\ No newline at end of file
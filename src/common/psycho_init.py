@@ -1,8 +1,24 @@
-def open_window(monInfo, measureFPS=True):
+def measure_flip_intervals(win, nFlips, message):
+    """ The intervals [s] between nFlips flips of win, showing message """
+    from psychopy import visual
+    import numpy as np
+    waitText = visual.TextStim(win, message, color='Black')
+    frames = []
+    for i in range(0, nFlips):
+        waitText.draw()
+        frames.append(win.flip())
+    return np.diff(frames)
+
+
+def open_window(monInfo, measureFPS=True, calibrationFile=None):
     """
-    Open a window for the experiment
+    Open a window for the experiment. The flip time is measured the first
+    time a monitor is used and stored in calibrationFile, the following
+    sessions only check it with a few flips and measure it again if the
+    check fails.
     """
     from psychopy import visual, event
+    from RefreshCalibration import RefreshCalibration, calibrationKey, CALIBRATION_FILE, SANITY_FLIPS
     # setup the Window
     sx = int(monInfo['ResolutionX'])
     sy = int(monInfo['ResolutionY'])
@@ -16,31 +32,30 @@ def open_window(monInfo, measureFPS=True):
     print "*** Current distance is set to", win.scrDistCM, " [cm]"
     win.setRecordFrameIntervals(True)
     if measureFPS:
-        # Measure the fps
-        frames = []
-        waitText = visual.TextStim(
-            win, "Measuring flip time for accurate timing...wait", color='Black')
-        for i in range(0, 100):
-            waitText.draw()
-            frames.append(win.flip())
-        import numpy as np
-        frames = np.array(frames)
-        t = np.diff(frames)
-        win.measuredFlipTime = np.average(t)
-        win.measuredFPS = 1.0 / win.measuredFlipTime
-        #win.measuredFPS = 59.95
-        text = "FlipTime= %2.2f +- %2.2f [ms].\nPress any key to continue" % (1000 * win.measuredFlipTime, 1000 * np.std(t))
-        fpsText = visual.TextStim(win, text, color='Black')
-
-        while True:
-            fpsText.draw()
-            keys = event.getKeys()
-            win.flip()
-            if keys:
+        calibration = RefreshCalibration(calibrationFile or CALIBRATION_FILE)
+        key = calibrationKey(monInfo)
+        if calibration.get(key) is not None and \
+                calibration.check(key, measure_flip_intervals(win, SANITY_FLIPS, "Checking flip time...wait")):
+            stored = calibration.get(key)
+            print "*** Using the flip time calibrated on", stored['timestamp'], "for", key
+        else:
+            # Measure the fps
+            t = measure_flip_intervals(win, 100, "Measuring flip time for accurate timing...wait")
+            stored = calibration.set(key, t)
+            text = "FlipTime= %2.2f +- %2.2f [ms].\nPress any key to continue" % (
+                1000 * stored['flipTime'], 1000 * stored['flipTimeStd'])
+            fpsText = visual.TextStim(win, text, color='Black')
+
+            while True:
+                fpsText.draw()
+                keys = event.getKeys()
                 win.flip()
-                break
-        #print "Flip time [ms]=", win.measuredFlipTime * 1E3, "+-", np.std(t) * 1E3
-        #print "FPS=", win.measuredFPS, " [Hz]"
+                if keys:
+                    win.flip()
+                    break
+        win.measuredFlipTime = stored['flipTime']
+        win.measuredFPS = 1.0 / win.measuredFlipTime
+        print "*** Flip time=", win.measuredFlipTime * 1E3, "+-", stored['flipTimeStd'] * 1E3, "[ms]"
     return win
 
 
@@ -72,6 +87,7 @@ def setup_monitor():
 def experiment_finished(win):
     """ Wait til ESCAPE key has been pressed, then close the window """
     from psychopy import visual, event
+    from VideoRecorder import closeVideoRecorder
     closeText = visual.TextStim(win, "Experiment finished, press ESC to close", color='Black')
     while True:
         closeText.draw()
@@ -79,6 +95,8 @@ def experiment_finished(win):
         win.flip()
         if 'escape' in keys:
             break
+    # Write the video frames still queued before closing the window
+    closeVideoRecorder(win)
     win.close()
         
 
@@ -103,6 +121,14 @@ def set_output_file(expInfo, suffix):
     return outputfile
 
 
-def save_experimental_settings(settings_file, expInfo, trialInfo, monitorInfo):
+def _pickleSettings(settings_file, settings):
     import pickle
-    pickle.dump([expInfo, trialInfo, monitorInfo], open(settings_file, 'w'))
+    with open(settings_file, 'w') as f:
+        pickle.dump(settings, f)
+
+
+def save_experimental_settings(settings_file, expInfo, trialInfo, monitorInfo):
+    """ Pickle a copy of the settings in the session writer thread """
+    import copy
+    from SessionWriter import sessionWriter
+    sessionWriter().submit(_pickleSettings, settings_file, copy.deepcopy([expInfo, trialInfo, monitorInfo]))
@@ -1,5 +1,4 @@
 import numpy as np
-from random import randrange
 from common.psycho_init import open_window, setup_monitor
 from common.psycho_init import experiment_finished
 from common.psycho_init import set_output_file, save_experimental_settings
@@ -7,6 +6,20 @@ from common.show_instructions import show_instructions
 
 from psychopy import core
 from common import Ball
+from common.StimulusPool import stimulusPool
+from common.NoiseBank import noiseBank
+from common.VideoRecorder import videoRecorder, closeVideoRecorder
+from common.FrameIntervals import TrialFrameIntervals, phaseColumns
+from common.TrialJournal import TrialJournal
+from common.SessionWriter import sessionWriter
+from common.TrialTimeline import TrialTimeline
+from common.SessionSeeds import SessionSeeds, drawSessionSeed, trialRng, MAX_SEED
+
+
+# The phases of a trial whose flip intervals are written in the trial record
+TRIAL_PHASES = ['cue', 'mask', 'response']
+# The columns of the trial journal, one row per trial
+TRIAL_COLUMNS = ['Trial', 'label', 'Contrast', 'SameStimuli', 'Response', 'Seed'] + phaseColumns(TRIAL_PHASES)
 
 
 def setupExperiment():
@@ -22,7 +35,8 @@ def setupExperiment():
                'BallRadius': 2,
                'TrainingTrials': 0,
                'SaveVideo': False,
-               'ContrastDuration': 2.0
+               'ContrastDuration': 2.0,
+               'SessionSeed': 0
                }
 
     dlg = gui.DlgFromDict(dictionary=expInfo, title='Flicker Experiment',
@@ -38,6 +52,7 @@ def setupExperiment():
                               'SquareEdge': 'Length of the virtual square edge',
                               'BallRadius': 'Radius of the balls in cm',
                               'TrainingTrials': 'Number of preparation training trials',
+                              'SessionSeed': 'Seed of the random stimuli of the session, 0 to draw a new one'
                           })
 
     if dlg.OK is False:
@@ -65,13 +80,14 @@ def setupExperiment():
     if dlgStaircase.OK is False:
         core.quit()
 
+    drawSessionSeed(expInfo)
     outputfile = set_output_file(expInfo, 'contrast_')
     save_experimental_settings(
         outputfile + '_info.pickle', expInfo, staircaseInfo, monitorInfo)
     return expInfo, staircaseInfo, outputfile, monitorInfo
 
 
-def contrastTrial(win, experimentalInfo, contrastValue, side, useSameStimuli):
+def contrastTrial(win, experimentalInfo, contrastValue, side, useSameStimuli, seed=None, frameIntervals=None):
     from psychopy import visual, event
     """
     Start the contrast trial
@@ -83,54 +99,68 @@ def contrastTrial(win, experimentalInfo, contrastValue, side, useSameStimuli):
         [-edge / 2, -edge / 2]), np.array([-edge / 2, edge / 2]),
         np.array([edge / 2, -edge / 2]), np.array([edge / 2, edge / 2])]
 
-    fixationBall = Ball(win, position=np.array([0.0, 0.0]), direction=np.array(
-        [0.0, 0.0]), speed=0.0, radius=0.15, color='White')
-    sameStimuliIndex = randrange(0, 4)
+    # The stimuli are created once per session and reused by all the trials
+    pool = stimulusPool(win)
+    fixationBall = pool.get(('fixation', 0.15), lambda win: Ball(win, position=np.array([0.0, 0.0]), direction=np.array(
+        [0.0, 0.0]), speed=0.0, radius=0.15, color='White'))
+    # The odd stimulus and the noise textures are drawn from the trial seed
+    if seed is None:
+        seed = np.random.randint(0, MAX_SEED)
+    # The flip intervals of every phase are collected in frameIntervals
+    if frameIntervals is None:
+        frameIntervals = TrialFrameIntervals(win, TRIAL_PHASES)
+    # The frames are streamed to disk by a background thread, one file per trial
+    if (saveVideo):
+        import os
+        recorder = videoRecorder(win)
+        outputVideo = recorder.start(os.path.join(os.getcwd(), 'data', 'frames', 'contrast'))
+        print "Saving video to " + outputVideo
+    rng = trialRng(seed)
+    sameStimuliIndex = rng.randint(0, 4)
 
-    noiseMaskStimuli = []
-    for i in range(0, 4):
-        noiseMaskStimuli.append(visual.GratingStim(
+    noiseMaskStimuli = pool.get('noiseMasks', lambda win: [visual.GratingStim(
                                 win, pos=positions[i],
-                                tex=np.random.random_integers(
-                                    0, 1, size=[1024, 1024]) * 2 - 1,
+                                tex=None,
                                 mask='circle',
                                 size=[experimentalInfo['BallRadius'] * 2,
-                                      experimentalInfo['BallRadius'] * 2]))
+                                      experimentalInfo['BallRadius'] * 2]) for i in range(0, 4)])
+    bank = noiseBank(win, 'binary', experimentalInfo['BallRadius'], experimentalInfo['SessionSeed'])
+    textures = bank.draw(rng, 5)
+    for i in range(0, 4):
+        noiseMaskStimuli[i].setTex(bank[textures[i]])
+        noiseMaskStimuli[i].contrast = 1.0
 
     # Generate the ball that has different contrast
-    noiseMaskStimuli[sameStimuliIndex] = visual.GratingStim(win, pos=positions[sameStimuliIndex],
-                                                            tex=np.random.random_integers(
-                                                                0, 1, size=[1024, 1024]) * 2 - 1,
-                                                            mask='circle',
-                                                            size=[experimentalInfo['BallRadius'] * 2,
-                                                                  experimentalInfo['BallRadius'] * 2])
+    noiseMaskStimuli[sameStimuliIndex].setTex(bank[textures[4]])
     noiseMaskStimuli[sameStimuliIndex].contrast = contrastValue
     if useSameStimuli:
         for i in range(0, 4):
             noiseMaskStimuli[i].contrast = contrastValue
 
-    arrows = [visual.TextStim(win, "<--", pos=[0, 0]),
-              visual.TextStim(win, "-->", pos=[0, 0])]
-
-    # Draw the arrow cue
-    trialClock = core.Clock()
-    trialClock.reset()
+    arrows = pool.get('arrows', lambda win: [visual.TextStim(win, "<--", pos=[0, 0]),
+                                             visual.TextStim(win, "-->", pos=[0, 0])])
 
+    # The timed phases are compiled to frames before the first flip, the
+    # arrow cue and then the contrast stimulus for ContrastDuration seconds
     sideIndex = (side == 'Left')
-    while (trialClock.getTime() < 2.0):
+    timeline = TrialTimeline(win.measuredFPS)
+    cuePhase = timeline.addPhase('cue', 2.0)
+    maskPhase = timeline.addPhase('mask', experimentalInfo.get('ContrastDuration', 2.0))
+
+    frameIntervals.phase('cue')
+    for frame in timeline.frames(cuePhase):
         arrows[sideIndex].draw()
         if (saveVideo):
-            win.getMovieFrame()
+            recorder.capture()
         win.flip()
 
     # Mostra lo stimolo di contrasti per due secondi
-    totalMaskTime = experimentalInfo.get('ContrastDuration', 2.0)
-    totalMaskTimeInFrames = int(round(totalMaskTime * win.measuredFPS))
-    for t in range(0, totalMaskTimeInFrames):
+    frameIntervals.phase('mask')
+    for frame in timeline.frames(maskPhase):
         for i in range(0, 4):
             noiseMaskStimuli[i].draw()
         if (saveVideo):
-            win.getMovieFrame()
+            recorder.capture()
         win.flip()
 
      # Get the subject response
@@ -139,6 +169,7 @@ def contrastTrial(win, experimentalInfo, contrastValue, side, useSameStimuli):
     trialClock.reset()
     response = None
 
+    frameIntervals.phase('response')
     while True:
         keys = event.getKeys()
         fixationBall.draw()
@@ -158,17 +189,12 @@ def contrastTrial(win, experimentalInfo, contrastValue, side, useSameStimuli):
             win.close()
             core.quit()
         if (saveVideo):
-            win.getMovieFrame()
+            recorder.capture()
         win.flip()
 
     if (saveVideo):
-        import os
-        currentpath = os.getcwd()
-        savedatapath = currentpath + os.path.sep + 'data'
-        outputVideo = savedatapath + os.path.sep + \
-            "frames" + os.path.sep + 'contrast.png'
-        print "Saving video to " + outputVideo
-        win.saveMovieFrames(outputVideo)
+        recorder.stop()
+    frameIntervals.end()
     return response
 
 
@@ -210,8 +236,14 @@ def analyzeStaircases(stairs, nReversals):
 def startExperiment():
     try:
         expInfo, stairInfo, outputfile, monitorInfo = setupExperiment()
-        win = open_window(monitorInfo, measureFPS=False)
-        win.measuredFPS = 59.95
+        # Every trial is appended to the journal, the staircase files are
+        # only written at the end of the session, all by the writer thread
+        writer = sessionWriter()
+        journal = TrialJournal(outputfile + '_trials.csv', TRIAL_COLUMNS)
+        win = open_window(monitorInfo)
+        seeds = SessionSeeds(expInfo['SessionSeed'])
+        # The noise textures of the whole session are generated before the first trial
+        noiseBank(win, 'binary', expInfo['BallRadius'], expInfo['SessionSeed'])
         show_instructions(win, "Press spacebar to start experiment, doing " +
                           str(expInfo['TrainingTrials']) + " training trials")
 
@@ -258,27 +290,43 @@ def startExperiment():
         # Do some training trials with no variation in speed
         for i in np.linspace(0.0, 2.0, expInfo['TrainingTrials']):
             contrastTrial(
-                win, expInfo, contrastValue=i, side='Left', useSameStimuli=randrange(0, 2))
+                win, expInfo, contrastValue=i, side='Left', useSameStimuli=seeds.rng.randint(0, 2))
 
         show_instructions(
             win, "Finished training trials, press spacebar to begin")
 
+        nTrial = 0
         for contrast, thisCondition in stairs:
-            sameStimuli = randrange(0, 100) < 25  # To present 4 equal stimuli
+            trialSeed = seeds.trialSeed(nTrial)
+            sameStimuli = seeds.rng.randint(0, 100) < 25  # To present 4 equal stimuli
+            frameIntervals = TrialFrameIntervals(win, TRIAL_PHASES)
             thisResp = contrastTrial(win, expInfo, contrastValue=contrast,
-                                     side=thisCondition['label'], useSameStimuli=sameStimuli)
+                                     side=thisCondition['label'], useSameStimuli=sameStimuli, seed=trialSeed,
+                                     frameIntervals=frameIntervals)
             if thisResp is not None:
                 stairs.addData(not thisResp)
+                stairs.addOtherData('Seed', trialSeed)
+                for column, value in frameIntervals.record().iteritems():
+                    stairs.addOtherData(column, value)
+                writer.submit(journal.write, dict({'Trial': nTrial, 'label': thisCondition['label'], 'Contrast': contrast,
+                                                   'SameStimuli': int(sameStimuli), 'Response': int(not thisResp),
+                                                   'Seed': trialSeed}, **frameIntervals.record()))
             else:
                 print "skipped"
-            # save data as multiple formats for every trial
-            stairs.saveAsText(outputfile)
+            nTrial = nTrial + 1
 
-        stairs.saveAsText(outputfile)
-        stairs.saveAsPickle(outputfile)
-        stairs.saveAsExcel(outputfile)
+        # save data as multiple formats at the end of the session
+        writer.submit(journal.close)
+        writer.submit(stairs.saveAsText, outputfile)
+        writer.submit(stairs.saveAsPickle, outputfile)
+        writer.submit(stairs.saveAsExcel, outputfile)
         experiment_finished(win)
+        writer.close()
     except:
+        writer.submit(journal.close)
+        writer.close(False)
+        # The frames of an interrupted recording are written too
+        closeVideoRecorder(win)
         win.close()
         raise
     #analyzeStaircases(stairs, stairInfo['AverageReversals'])
@@ -1,5 +1,4 @@
 import numpy as np
-from random import randrange
 from common.psycho_init import open_window, setup_monitor
 from common.psycho_init import experiment_finished
 from common.psycho_init import set_output_file, save_experimental_settings
@@ -7,6 +6,26 @@ from common.show_instructions import show_instructions
 
 from psychopy import core
 from common import Ball
+from common.StimulusPool import stimulusPool
+from common.NoiseBank import noiseBank
+from common.VideoRecorder import videoRecorder, closeVideoRecorder
+from common.FrameIntervals import TrialFrameIntervals, phaseColumns
+from common.TrialJournal import TrialJournal
+from common.SessionWriter import sessionWriter
+from common.TrialTimeline import TrialTimeline, alternating
+from common.FlickerSchedule import FlickerSchedule
+from common.SessionSeeds import SessionSeeds, drawSessionSeed, trialRng, MAX_SEED
+
+
+# The phases of a trial whose flip intervals are written in the trial record
+TRIAL_PHASES = ['cue', 'mask', 'blink', 'response']
+# The columns of the trial journal, one row per trial
+TRIAL_COLUMNS = ['Trial', 'label', 'Response', 'Seed'] + phaseColumns(TRIAL_PHASES) + \
+    ['FlickerFreqRequested', 'SwitchFrames', 'FlickerFreqAchieved', 'FlickerFreqMeasured', 'SwitchIntervalError']
+# The columns of the switch log, the switch times [s] of every trial
+SWITCH_COLUMNS = ['Trial', 'Side', 'FlickerFreq', 'SwitchFrames', 'SwitchTimes']
+# The colors of the flickering balls, indexed by the ballColor channel
+BALL_COLORS = ['Black', 'White']
 
 
 def setupExperiment():
@@ -22,7 +41,8 @@ def setupExperiment():
                'BallRadius': 0.5,
                'BlinkTime': 3,
                'TrainingTrials': 0,
-               'SaveVideo': False
+               'SaveVideo': False,
+               'SessionSeed': 0
                }
 
     dlg = gui.DlgFromDict(dictionary=expInfo, title='Flicker Experiment',
@@ -40,6 +60,7 @@ def setupExperiment():
                               'BallRadius': 'Radius of the balls in cm',
                               'BlinkTime': 'Time of white/black ball blinking in seconds',
                               'TrainingTrials': 'Number of preparation training trials',
+                              'SessionSeed': 'Seed of the random stimuli of the session, 0 to draw a new one'
                           })
 
     if not dlg.OK:
@@ -67,6 +88,7 @@ def setupExperiment():
     if not dlgStaircase.OK:
         core.quit()
 
+    drawSessionSeed(expInfo)
     outputfile = set_output_file(expInfo, 'flicker_')
     save_experimental_settings(
         outputfile + '_info.pickle', expInfo, staircaseInfo, monitorInfo)
@@ -74,111 +96,112 @@ def setupExperiment():
     return expInfo, staircaseInfo, outputfile, monitorInfo
 
 
-def flickerTrial(win, experimentalInfo, flickerFreq, side, useOddBall):
+def flickerTrial(win, experimentalInfo, flickerFreq, side, useOddBall, seed=None, frameIntervals=None, switchTimes=None):
     from psychopy import visual, event
     """
-    Start the tracking trial
+    Start the flicker trial, flickerFreq is shown at the closest frequency
+    achievable at the refresh rate, see FlickerSchedule. The flip timestamps
+    of the color switches, from the start of the blink, are appended to the
+    switchTimes list if given.
     """
-    # Generate the 4 balls as list
-    balls = []
+    # Generate the 4 balls as list, the stimuli are created once per session
+    # and reused by all the trials
+    pool = stimulusPool(win)
     edge = experimentalInfo['SquareEdge']
-    # First two balls are left, second two balls are right
-    positions = [np.array(
-        [-edge / 2, -edge / 2]), np.array([-edge / 2, edge / 2]),
-        np.array([edge / 2, -edge / 2]), np.array([edge / 2, edge / 2])]
+    # First two balls are left, second two balls are right, every ball holds
+    # a row of positions
+    positions = np.array([[-edge / 2, -edge / 2], [-edge / 2, edge / 2],
+                          [edge / 2, -edge / 2], [edge / 2, edge / 2]], dtype=float)
+    balls = pool.get('balls', lambda win: [Ball(win, position=positions[i], direction=np.array(
+        [0, 0]), speed=0, radius=experimentalInfo['BallRadius'], color='Black') for i in range(0, 4)])
     for i in range(0, 4):
-        balls.append(Ball(win, position=positions[i], direction=np.array(
-            [0, 0]), speed=0, radius=experimentalInfo['BallRadius'], color='Black'))
-
-    fixationBall = Ball(win, position=np.array([0.0, 0.0]), direction=np.array(
-        [0.0, 0.0]), speed=0.0, radius=0.15, color='White')
-    oddBallIndex = randrange(0, 4)
-    oddBalls = [balls[oddBallIndex]]
+        balls[i].setPos(positions[i])
+
+    fixationBall = pool.get(('fixation', 0.15), lambda win: Ball(win, position=np.array([0.0, 0.0]), direction=np.array(
+        [0.0, 0.0]), speed=0.0, radius=0.15, color='White'))
+    # The odd ball and the noise masks are drawn from the trial seed
+    if seed is None:
+        seed = np.random.randint(0, MAX_SEED)
+    # The flip intervals of every phase are collected in frameIntervals
+    if frameIntervals is None:
+        frameIntervals = TrialFrameIntervals(win, TRIAL_PHASES)
+    # The frames are streamed to disk by a background thread, one file per trial
+    if (experimentalInfo['SaveVideo']):
+        import os
+        recorder = videoRecorder(win)
+        outputVideo = recorder.start(os.path.join(os.getcwd(), 'data', 'frames', 'Flicker'))
+        print "Saving video to " + outputVideo
+    rng = trialRng(seed)
+    oddBallIndex = rng.randint(0, 4)
 
-    noiseMaskStimuli = []
+    noiseMaskStimuli = pool.get('noiseMasks', lambda win: [visual.GratingStim(win, pos=positions[i], units='cm', tex=None,
+        mask='circle', size=[experimentalInfo['BallRadius'] * 2, experimentalInfo['BallRadius'] * 2]) for i in range(0, 4)])
+    bank = noiseBank(win, 'uniform', experimentalInfo['BallRadius'], experimentalInfo['SessionSeed'])
+    textures = bank.draw(rng, 4)
     for i in range(0, 4):
-        noiseMaskStimuli.append(visual.GratingStim(win, pos=positions[i], units='cm',tex=np.random.rand(
-            256, 256) * 2.0 - 1.0, mask='circle', size=[experimentalInfo['BallRadius'] * 2, experimentalInfo['BallRadius'] * 2]))
-
-    arrows = [visual.TextStim(win, "-->", pos=[0, 0]),
-              visual.TextStim(win, "<--", pos=[0, 0])]
-    # Initialize a color for the balls
-    for ball in balls:
-        ball.setColor('Black')
-        if useOddBall:
-            for oddBall in oddBalls:
-                oddBall.setColor('White')
-
-    # Draw the arrow cue
-    trialClock = core.Clock()
-    trialClock.reset()
+        noiseMaskStimuli[i].setTex(bank[textures[i]])
 
+    arrows = pool.get('arrows', lambda win: [visual.TextStim(win, "-->", pos=[0, 0]),
+                                             visual.TextStim(win, "<--", pos=[0, 0])])
+    # The timed phases are compiled to frames before the first flip. During
+    # the blink all the balls switch color every totBlinkFrames frames, the
+    # odd ball having the opposite color of the others
     sideIndex = (side == 'Left')
-    while (trialClock.getTime() < 2.0):
+    totalMaskTime = 0.350  # seconds
+    timeline = TrialTimeline(win.measuredFPS)
+    cuePhase = timeline.addPhase('cue', 2.0)
+    firstMaskPhase = timeline.addPhase('mask', totalMaskTime)
+    blinkPhase = timeline.addPhase('blink', experimentalInfo['BlinkTime'])
+    secondMaskPhase = timeline.addPhase('mask', totalMaskTime)
+    totBlinkFrames = FlickerSchedule(win.measuredFPS).switchFrames(flickerFreq)
+    blinkState = alternating(timeline.phaseFrames(blinkPhase), totBlinkFrames, offset=1)
+    ballColors = timeline.addChannel('ballColor', shape=(4,))
+    timeline.set('ballColor', blinkPhase, blinkState[:, np.newaxis])
+    if useOddBall:
+        ballColors[timeline.phaseSlice(blinkPhase), oddBallIndex] = 1 - blinkState
+    # The colors are only sent to the balls on the frames where they change
+    switchIndices = np.flatnonzero(blinkState[1:] != blinkState[:-1]) + 1
+    colorSwitch = timeline.addChannel('colorSwitch', default=False, dtype=bool)
+    colorSwitch[timeline.phaseSlice(blinkPhase).start + np.r_[0, switchIndices]] = True
+
+    frameIntervals.phase('cue')
+    for frame in timeline.frames(cuePhase):
         arrows[sideIndex].draw()
         if (experimentalInfo['SaveVideo']):
-            win.getMovieFrame()
+            recorder.capture()
         win.flip()
 
-    totalMaskTime = 0.350  # seconds
-    totalMaskTimeInFrames = int(round(totalMaskTime * win.measuredFPS))
-    for t in range(0, totalMaskTimeInFrames):
+    frameIntervals.phase('mask')
+    for frame in timeline.frames(firstMaskPhase):
         for i in range(0, 4):
             noiseMaskStimuli[i].draw()
         if (experimentalInfo['SaveVideo']):
-            win.getMovieFrame()
+            recorder.capture()
         win.flip()
 
-    # Here instead of using timers we precompute the number of frames to display for the stimuli, so
-    # that the calls to timers are avoided and the program is faster between
-    # two flips
-    totStimFrames = int(round(experimentalInfo['BlinkTime'] * win.measuredFPS))
-    totBlinkFrames = int(round(1.0 / flickerFreq * win.measuredFPS))
-
-    blinkFrame, totBlinks = 0, 0
-    times = [None] * totStimFrames
-    switchIndices = []
-    for t in range(0, totStimFrames):
+    times = np.zeros(timeline.phaseFrames(blinkPhase))
+    frameIntervals.phase('blink')
+    for t, frame in enumerate(timeline.frames(blinkPhase)):
         fixationBall.draw()
-        blinkFrame = blinkFrame + 1
-        oldTotBlinks = totBlinks
-        if (blinkFrame >= totBlinkFrames):
-            blinkFrame = 0
-            totBlinks = totBlinks + 1
-            if (oldTotBlinks < totBlinks):
-                switchIndices.append(t)
-                if (totBlinks % 2):
-                    for ball in balls:
-                        ball.setColor('White')
-                    if useOddBall:
-                        for oddBall in oddBalls:
-                            oddBall.setColor('Black')
-                else:
-                    for ball in balls:
-                        ball.setColor('Black')
-                    if useOddBall:
-                        for oddBall in oddBalls:
-                            oddBall.setColor('White')
+        if colorSwitch[frame]:
+            for i in range(0, 4):
+                balls[i].setColor(BALL_COLORS[ballColors[frame, i]])
         for ball in balls:
             ball.draw()
         if (experimentalInfo['SaveVideo']):
-            win.getMovieFrame()
+            recorder.capture()
         times[t] = win.flip()
 
-    totalMaskTimeInFrames = int(round(totalMaskTime * win.measuredFPS))
-    for t in range(0, totalMaskTimeInFrames):
+    frameIntervals.phase('mask')
+    for frame in timeline.frames(secondMaskPhase):
         for i in range(0, 4):
             noiseMaskStimuli[i].draw()
         if (experimentalInfo['SaveVideo']):
-            win.getMovieFrame()
+            recorder.capture()
         win.flip()
 
-    times = np.array(times)
-    # switchIndices=np.array(switchIndices)
-    # switchTimes=np.diff(times[switchIndices])
-    # print "Average switch times",np.average(switchTimes),"corresponding to ",1.0/np.average(switchTimes)," [Hz]"
-    # print "Average inversion times
-    # error=",np.average(switchTimes-1.0/flickerFreq)*1000,"[ms]"
+    if switchTimes is not None:
+        switchTimes.extend(times[switchIndices] - times[0])
 
     # Get the subject response
     event.getKeys()
@@ -186,6 +209,7 @@ def flickerTrial(win, experimentalInfo, flickerFreq, side, useOddBall):
     trialClock.reset()
     response = None
 
+    frameIntervals.phase('response')
     while True:
         keys = event.getKeys()
         fixationBall.draw()
@@ -201,19 +225,14 @@ def flickerTrial(win, experimentalInfo, flickerFreq, side, useOddBall):
             win.close()
             core.quit()
         if (experimentalInfo['SaveVideo']):
-            win.getMovieFrame()
+            recorder.capture()
         win.flip()
     
     print sideIndex,side,oddBallIndex,response
 
     if (experimentalInfo['SaveVideo']):
-        import os
-        currentpath = os.getcwd()
-        savedatapath = currentpath + os.path.sep + 'data'
-        outputVideo = savedatapath + os.path.sep + \
-            "frames" + os.path.sep + 'Flicker.png'
-        print "Saving video to " + outputVideo
-        win.saveMovieFrames(outputVideo)
+        recorder.stop()
+    frameIntervals.end()
     return response
 
 
@@ -230,8 +249,17 @@ def startExperiment():
         expInfo, stairInfo, outputfile, monitorInfo = setupExperiment()
     except:
         raise
+    # Opened during the session, the error handler closes it if it was
+    switchLog = None
     try:
+        # Every trial is appended to the journal, the staircase files are
+        # only written at the end of the session, all by the writer thread
+        writer = sessionWriter()
+        journal = TrialJournal(outputfile + '_trials.csv', TRIAL_COLUMNS)
         win = open_window(monitorInfo)
+        seeds = SessionSeeds(expInfo['SessionSeed'])
+        # The noise textures of the whole session are generated before the first trial
+        noiseBank(win, 'uniform', expInfo['BallRadius'], expInfo['SessionSeed'])
         show_instructions(win, "Press spacebar to start experiment, doing " +
                           str(expInfo['TrainingTrials']) + " training trials")
 
@@ -278,21 +306,53 @@ def startExperiment():
 
         show_instructions(
             win, "Finished training trials, press spacebar to begin")
+        # The staircase values are shown at the closest achievable frequency,
+        # that is the one given back to the staircase, and the switch times
+        # measured on every trial are logged, as the trials in a journal
+        schedule = FlickerSchedule(win.measuredFPS)
+        switchLog = TrialJournal(outputfile + '_switchTimes.csv', SWITCH_COLUMNS)
+        nTrial = 0
         for flickerFreq, thisCondition in stairs:
-            thisResp = flickerTrial(win, expInfo, flickerFreq,
-                                    side=thisCondition['label'], useOddBall=True)
+            trialSeed = seeds.trialSeed(nTrial)
+            frameIntervals = TrialFrameIntervals(win, TRIAL_PHASES)
+            switchTimes = []
+            thisResp = flickerTrial(win, expInfo, schedule.snap(flickerFreq),
+                                    side=thisCondition['label'], useOddBall=True, seed=trialSeed,
+                                    frameIntervals=frameIntervals, switchTimes=switchTimes)
             if thisResp is not None:
-                stairs.addData(not thisResp)
-            stairs.saveAsText(outputfile)
-
-        stairs.saveAsText(outputfile)
-        stairs.saveAsPickle(outputfile)
-        stairs.saveAsExcel(outputfile)
+                stairs.addResponse(not thisResp, intensity=schedule.snap(flickerFreq))
+                stairs.addOtherData('Seed', trialSeed)
+                for column, value in frameIntervals.record().iteritems():
+                    stairs.addOtherData(column, value)
+                flickerRecord = schedule.record(flickerFreq, switchTimes)
+                for column, value in flickerRecord.iteritems():
+                    stairs.addOtherData(column, value)
+                writer.submit(journal.write, dict(frameIntervals.record().items() + flickerRecord.items(),
+                                                  Trial=nTrial, label=thisCondition['label'], Response=int(not thisResp),
+                                                  Seed=trialSeed))
+            writer.submit(switchLog.write, {'Trial': nTrial, 'Side': thisCondition['label'],
+                                            'FlickerFreq': '%g' % schedule.snap(flickerFreq),
+                                            'SwitchFrames': schedule.switchFrames(flickerFreq),
+                                            'SwitchTimes': ' '.join('%.5f' % t for t in switchTimes)})
+            nTrial = nTrial + 1
+
+        writer.submit(switchLog.close)
+        writer.submit(journal.close)
+        writer.submit(stairs.saveAsText, outputfile)
+        writer.submit(stairs.saveAsPickle, outputfile)
+        writer.submit(stairs.saveAsExcel, outputfile)
         experiment_finished(win)
+        writer.close()
     except:
-        stairs.saveAsText(outputfile)
-        stairs.saveAsPickle(outputfile)
-        stairs.saveAsExcel(outputfile)
+        writer.submit(journal.close)
+        if switchLog is not None:
+            writer.submit(switchLog.close)
+        writer.submit(stairs.saveAsText, outputfile)
+        writer.submit(stairs.saveAsPickle, outputfile)
+        writer.submit(stairs.saveAsExcel, outputfile)
+        writer.close(False)
+        # The frames of an interrupted recording are written too
+        closeVideoRecorder(win)
         win.close()
         raise
     #analyzeStaircases(stairs, stairInfo['AverageReversals'])
@@ -12,34 +12,37 @@ def show_run(exp_text):
         core.quit()
 
 
-experiments = ['TrackingStaircase', 'TrackingFixed', 'TrackingfMRI',
-               'Tracking', 'Flicker', 'FlickerFixed']
-
-exp = {'Experiment': experiments}
-
-dlg = gui.DlgFromDict(dictionary=exp, title='SELECT EXPERIMENT')
-
-if exp['Experiment'] == 'TrackingStaircase':
-    show_run('Starting trackingExperiment2Staircase')
-    import trackingExperiment2Staircase
-    trackingExperiment2Staircase.startExperiment()
-elif exp['Experiment'] == 'TrackingfmRI':
-    show_run('Starting trackingfMRI')
-    import trackingfMRI
-    trackingfMRI.startExperiment()
-elif exp['Experiment'] == 'TrackingFixed':
-    show_run('Starting trackingFixedVelocity')
-    import trackingFixedVelocity
-    trackingFixedVelocity.startExperiment()
-elif exp['Experiment'] == 'Tracking':
-    show_run('Starting trackingExperiment')
-    import trackingExperiment
-    trackingExperiment.startExperiment()
-elif exp['Experiment'] == 'Flicker':
-    show_run('Starting flickerExperiment')
-    import flickerExperiment
-    flickerExperiment.startExperiment()
-elif exp['Experiment'] == 'FlickerFixed':
-    show_run('Starting flickerExperimentFixedVelocity')
-    import flickerExperimentFixedVelocity
-    flickerExperimentFixedVelocity.startExperiment()
+if __name__ == "__main__":
+    # The guard is needed by the trajectory worker processes, that import this
+    # module again on platforms without fork
+    experiments = ['TrackingStaircase', 'TrackingFixed', 'TrackingfMRI',
+                   'Tracking', 'Flicker', 'FlickerFixed']
+
+    exp = {'Experiment': experiments}
+
+    dlg = gui.DlgFromDict(dictionary=exp, title='SELECT EXPERIMENT')
+
+    if exp['Experiment'] == 'TrackingStaircase':
+        show_run('Starting trackingExperiment2Staircase')
+        import trackingExperiment2Staircase
+        trackingExperiment2Staircase.startExperiment()
+    elif exp['Experiment'] == 'TrackingfmRI':
+        show_run('Starting trackingfMRI')
+        import trackingfMRI
+        trackingfMRI.startExperiment()
+    elif exp['Experiment'] == 'TrackingFixed':
+        show_run('Starting trackingFixedVelocity')
+        import trackingFixedVelocity
+        trackingFixedVelocity.startExperiment()
+    elif exp['Experiment'] == 'Tracking':
+        show_run('Starting trackingExperiment')
+        import trackingExperiment
+        trackingExperiment.startExperiment()
+    elif exp['Experiment'] == 'Flicker':
+        show_run('Starting flickerExperiment')
+        import flickerExperiment
+        flickerExperiment.startExperiment()
+    elif exp['Experiment'] == 'FlickerFixed':
+        show_run('Starting flickerExperimentFixedVelocity')
+        import flickerExperimentFixedVelocity
+        flickerExperimentFixedVelocity.startExperiment()
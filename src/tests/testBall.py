@@ -1,2 +1,55 @@
 # -*- coding: utf-8 -*-
+import unittest
+import numpy as np
+from common.Ball import Ball, circleEdges, discTextureRes
 
+
+class TestBall(unittest.TestCase):
+
+    def test_moves_without_a_window(self):
+        ball = Ball(None, position=[1.0, 2.0], direction=[0, 0], speed=0, radius=0.25, color='Black')
+        ball.move([0.5, -1.0])
+        np.testing.assert_array_equal(ball.pos(), [1.5, 1.0])
+        ball.setPos([3.0, 4.0])
+        np.testing.assert_array_equal(ball.pos(), [3.0, 4.0])
+        ball.setColor('White')
+        self.assertTrue(ball.shape is None)
+        self.assertRaises(AttributeError, setattr, ball, 'velocity', 1.0)
+
+    def test_shares_a_row_of_positions(self):
+        positions = np.zeros((3, 2))
+        balls = [Ball(None, positions[i], [0, 0], 0, 0.25, 'Black') for i in range(0, 3)]
+        balls[1].move([1.0, 1.0])
+        positions[2] = [5.0, 5.0]
+        np.testing.assert_array_equal(positions[1], [1.0, 1.0])
+        np.testing.assert_array_equal(balls[2].pos(), [5.0, 5.0])
+        self.assertTrue(balls[2].position.base is positions)
+
+    def test_pos_is_a_copy(self):
+        ball = Ball(None, position=[1.0, 2.0], direction=[0, 0], speed=0, radius=0.25, color='Black')
+        frames = [ball.pos()]
+        ball.move([1.0, 1.0])
+        frames.append(ball.pos())
+        np.testing.assert_array_equal(frames, [[1.0, 2.0], [2.0, 3.0]])
+
+
+class Window():
+    scrWidthCM = 34.0
+    scrWidthPIX = 1280
+
+
+class TestTessellation(unittest.TestCase):
+
+    def test_edges_follow_the_pixel_radius(self):
+        edges = [circleEdges(Window(), r) for r in (0.1, 0.25, 1.0, 10.0)]
+        self.assertEqual(edges, sorted(edges))
+        self.assertTrue(edges[1] < 32 and edges[-1] == 128)
+        # The polygon of a 0.25 cm ball is within a tenth of pixel of the circle
+        r = 0.25 * 1280 / 34.0
+        self.assertTrue(r * (1 - np.cos(np.pi / edges[1])) <= 0.1)
+        self.assertEqual(circleEdges(None, 0.25), 128)
+        self.assertEqual(discTextureRes(Window(), 0.25), 64)
+
+
+if __name__ == '__main__':
+    unittest.main()
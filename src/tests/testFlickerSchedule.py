@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+import unittest
+import numpy as np
+from common.FlickerSchedule import FlickerSchedule
+
+
+class TestFlickerSchedule(unittest.TestCase):
+
+    def test_frequencies_are_snapped_to_whole_frames(self):
+        schedule = FlickerSchedule(59.95)
+        np.testing.assert_allclose(schedule.frequencies[0:3], [59.95, 29.975, 59.95 / 3])
+        self.assertEqual(len(schedule), 120)
+        self.assertEqual(schedule.switchFrames(10.0), 6)
+        self.assertAlmostEqual(schedule.snap(10.0), 59.95 / 6)
+        # 11 Hz is closer to 59.95 / 5 than to 59.95 / 6
+        self.assertEqual(schedule.switchFrames(11.0), 5)
+        self.assertEqual(schedule.switchFrames(100.0), 1)
+        self.assertEqual(schedule.switchFrames(0.1), 120)
+        self.assertEqual(schedule.snap(schedule.snap(7.3)), schedule.snap(7.3))
+
+    def test_record_measures_the_switch_times(self):
+        schedule = FlickerSchedule(60.0)
+        switchTimes = np.arange(1, 10) * 6 / 60.0
+        switchTimes[4] += 1 / 60.0
+        record = schedule.record(10.2, switchTimes)
+        self.assertEqual(list(record.keys()), ['FlickerFreqRequested', 'SwitchFrames', 'FlickerFreqAchieved',
+                                               'FlickerFreqMeasured', 'SwitchIntervalError'])
+        self.assertEqual(record['SwitchFrames'], 6)
+        self.assertAlmostEqual(record['FlickerFreqAchieved'], 10.0)
+        self.assertAlmostEqual(record['FlickerFreqMeasured'], 10.0)
+        self.assertAlmostEqual(record['SwitchIntervalError'], 1000.0 / 60.0)
+        self.assertTrue(np.isnan(schedule.record(10.0, [0.1])['FlickerFreqMeasured']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import unittest
+from common.FrameIntervals import TrialFrameIntervals, frameIntervalStats, phaseColumns
+
+
+class Window():
+    measuredFPS = 100.0
+
+    def __init__(self):
+        self.frameIntervals = []
+
+
+class TestFrameIntervals(unittest.TestCase):
+
+    def test_dropped_frames(self):
+        nDropped, maxInterval, jitter = frameIntervalStats([0.01, 0.01, 0.02, 0.031, 0.014], 0.01)
+        self.assertEqual(nDropped, 3)
+        self.assertAlmostEqual(maxInterval, 0.031)
+        self.assertEqual(frameIntervalStats([], 0.01), (0, 0.0, 0.0))
+
+    def test_intervals_are_split_among_phases(self):
+        win = Window()
+        win.frameIntervals.extend([0.5, 0.5])
+        frameIntervals = TrialFrameIntervals(win, ['cue', 'mask', 'response'])
+        frameIntervals.phase('cue')
+        win.frameIntervals.extend([0.01, 0.01])
+        frameIntervals.phase('mask')
+        win.frameIntervals.extend([0.02])
+        frameIntervals.phase('cue')
+        win.frameIntervals.extend([0.01])
+        record = frameIntervals.record()
+        self.assertEqual(list(record.keys()), phaseColumns(['cue', 'mask', 'response']))
+        self.assertEqual((record['cueDropped'], record['maskDropped'], record['responseDropped']), (0, 1, 0))
+        self.assertAlmostEqual(record['maskMaxInterval'], 20.0)
+        self.assertEqual(record['cueJitter'], 0.0)
+
+    def test_the_pause_between_trials_is_not_recorded(self):
+        win = Window()
+        for trial in range(0, 2):
+            frameIntervals = TrialFrameIntervals(win, ['blink', 'motion'])
+            frameIntervals.phase('blink')
+            # The first flip of the trial ends the pause since the previous one
+            win.frameIntervals.extend([2.5 if trial else 0.01, 0.01, 0.01])
+            frameIntervals.phase('motion')
+            win.frameIntervals.extend([0.01, 0.01])
+            record = frameIntervals.record()
+            self.assertEqual((record['blinkDropped'], record['motionDropped']), (0, 0))
+            self.assertAlmostEqual(record['blinkMaxInterval'], 10.0)
+            self.assertEqual(len(frameIntervals.intervals['blink']), 2)
+
+    def test_the_pause_is_not_recorded_when_the_first_phase_is_empty(self):
+        win = Window()
+        frameIntervals = TrialFrameIntervals(win, ['cue', 'motion'])
+        frameIntervals.phase('cue')
+        frameIntervals.phase('motion')
+        win.frameIntervals.extend([2.5, 0.01])
+        record = frameIntervals.record()
+        self.assertEqual(record['motionDropped'], 0)
+        self.assertEqual(frameIntervals.intervals['motion'], [0.01])
+
+
+if __name__ == '__main__':
+    unittest.main()
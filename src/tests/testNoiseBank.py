@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import unittest
+import numpy as np
+from common.NoiseBank import NoiseBank, noiseBank, noiseResolution, MAX_NOISE_RES
+
+
+class Window():
+    pass
+
+
+class TestNoiseBank(unittest.TestCase):
+
+    def test_textures_are_compact_and_seeded(self):
+        uniform = NoiseBank('uniform', 32, seed=7, nTextures=8)
+        binary = NoiseBank('binary', 32, seed=7, nTextures=8)
+        self.assertEqual(uniform[0].shape, (32, 32))
+        self.assertEqual(uniform.textures.dtype, np.float32)
+        self.assertEqual(binary.textures.dtype, np.int8)
+        self.assertEqual(binary.nbytes, 8 * 32 * 32)
+        self.assertTrue(np.abs(uniform.textures).max() <= 1.0)
+        self.assertEqual(sorted(np.unique(binary.textures)), [-1, 1])
+        np.testing.assert_array_equal(NoiseBank('binary', 32, seed=7, nTextures=8).textures, binary.textures)
+        self.assertFalse(np.array_equal(NoiseBank('binary', 32, seed=8, nTextures=8).textures, binary.textures))
+        indices = binary.draw(np.random.RandomState(1), 5)
+        self.assertEqual(len(set(indices)), 5)
+        self.assertRaises(ValueError, NoiseBank, 'gaussian', 32, 7)
+
+    def test_resolution_follows_the_screen(self):
+        win = Window()
+        self.assertEqual(noiseResolution(win, 1.0), MAX_NOISE_RES)
+        win.scrWidthCM, win.scrWidthPIX = 40.0, 1600
+        # A disc of radius 1 cm is 80 pixels wide
+        self.assertEqual(noiseResolution(win, 1.0), 128)
+        self.assertTrue(noiseBank(win, 'binary', 1.0, 3) is noiseBank(win, 'binary', 1.0, 3))
+        self.assertEqual(noiseBank(win, 'binary', 1.0, 3)[0].shape, (128, 128))
+
+
+if __name__ == '__main__':
+    unittest.main()
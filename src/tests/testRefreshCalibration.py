@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from common.RefreshCalibration import RefreshCalibration, calibrationKey
+
+
+class TestRefreshCalibration(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'data', 'refreshCalibration.json')
+        self.monInfo = {'MonitorName': 'lab', 'ResolutionX': 1280, 'ResolutionY': 800, 'RunFullScreen': True}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_calibration_is_stored_per_monitor(self):
+        key = calibrationKey(self.monInfo)
+        self.assertEqual(key, 'lab_1280x800_fullscreen')
+        self.assertNotEqual(calibrationKey(dict(self.monInfo, RunFullScreen=False)), key)
+        calibration = RefreshCalibration(self.filename)
+        self.assertTrue(calibration.get(key) is None)
+        intervals = np.random.RandomState(0).normal(1 / 59.95, 0.0002, size=99)
+        calibration.set(key, intervals)
+
+        stored = RefreshCalibration(self.filename).get(key)
+        self.assertAlmostEqual(stored['flipTime'], intervals.mean())
+        self.assertAlmostEqual(stored['flipTimeStd'], intervals.std())
+        self.assertEqual(stored['nFlips'], 100)
+        self.assertTrue('timestamp' in stored)
+
+    def test_sanity_check_detects_a_new_refresh_rate(self):
+        key = calibrationKey(self.monInfo)
+        calibration = RefreshCalibration(self.filename)
+        self.assertFalse(calibration.check(key, [1 / 60.0] * 9))
+        calibration.set(key, [1 / 59.95] * 99)
+        # A dropped frame does not fail the check, a 75 Hz display does
+        self.assertTrue(calibration.check(key, [1 / 60.0] * 8 + [2 / 60.0]))
+        self.assertFalse(calibration.check(key, [1 / 75.0] * 9))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from common.SessionCheckpoint import SessionCheckpoint
+from common.SessionWriter import SessionWriter
+
+
+class TestSessionCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.checkpoint = SessionCheckpoint(os.path.join(self.directory, 'results_checkpoint.pickle'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_state_is_pickled_when_saved(self):
+        writer = SessionWriter()
+        rng = np.random.RandomState(7)
+        self.checkpoint.save(writer, settings={'SessionSeed': 7}, nTrial=0, rng=rng.get_state())
+        rng.rand(5)
+        self.checkpoint.save(writer, nTrial=1, rng=rng.get_state())
+        rng.rand(5)
+        writer.close()
+        records = self.checkpoint.load()
+        self.assertEqual([record['nTrial'] for record in records], [0, 1])
+        self.assertEqual(records[0]['settings'], {'SessionSeed': 7})
+        restored = np.random.RandomState()
+        restored.set_state(records[-1]['rng'])
+        np.testing.assert_array_equal(restored.rand(5), np.random.RandomState(7).rand(10)[5:])
+
+    def test_a_torn_record_is_dropped(self):
+        writer = SessionWriter()
+        self.checkpoint.save(writer, nTrial=0)
+        self.checkpoint.save(writer, nTrial=1)
+        writer.flush()
+        size = os.path.getsize(self.checkpoint.filename)
+        with open(self.checkpoint.filename, 'ab') as f:
+            f.write(pickle.dumps({'nTrial': 2}, pickle.HIGHEST_PROTOCOL)[:-3])
+        self.assertEqual(self.checkpoint.load(), [{'nTrial': 0}, {'nTrial': 1}])
+        self.assertEqual(os.path.getsize(self.checkpoint.filename), size)
+        self.checkpoint.save(writer, nTrial=2)
+        writer.close()
+        self.assertEqual([record['nTrial'] for record in self.checkpoint.load()], [0, 1, 2])
+
+    def test_remove(self):
+        writer = SessionWriter()
+        self.checkpoint.save(writer, nTrial=0)
+        writer.submit(self.checkpoint.remove)
+        writer.close()
+        self.assertFalse(self.checkpoint.exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
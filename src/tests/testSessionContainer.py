@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from common.SessionContainer import SessionContainer
+from common.TrialTable import TrialTable
+
+
+class TestSessionContainer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.container = SessionContainer(os.path.join(self.directory, 'results_session.zip'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_trials_are_loaded_one_by_one(self):
+        self.container.saveSettings(expInfo={'SessionSeed': np.int64(5), 'Block': 'Uni+Bi'})
+        trajectories = [np.random.RandomState(i).rand(30, 8, 2) for i in range(3)]
+        for nTrial, trajectory in enumerate(trajectories):
+            self.container.saveTrial(nTrial, trajectory, {'blink': [0.016, 0.017], 'motion': []})
+        self.assertEqual(self.container.trials(), [0, 1, 2])
+        trial = self.container.trial(1)
+        self.assertEqual(sorted(trial.keys()), ['frameIntervals/blink', 'frameIntervals/motion', 'trajectory'])
+        np.testing.assert_array_equal(trial['trajectory'], trajectories[1])
+        np.testing.assert_array_equal(trial['frameIntervals/blink'], [0.016, 0.017])
+        self.assertEqual(len(trial['frameIntervals/motion']), 0)
+        self.assertEqual(self.container.settings(), {'expInfo': {'SessionSeed': 5, 'Block': 'Uni+Bi'}})
+
+    def test_trials_presented_again_are_removed(self):
+        self.container.saveSettings(expInfo={'Block': 'Uni+Bi'})
+        for nTrial in range(4):
+            self.container.saveTrial(nTrial, np.full((2, 3, 2), nTrial), {'motion': [0.016]})
+        self.container.keepTrials(2)
+        self.assertEqual(self.container.trials(), [0, 1])
+        self.container.saveTrial(2, np.zeros((2, 3, 2)))
+        self.assertEqual(self.container.trials(), [0, 1, 2])
+        self.assertEqual(self.container.trial(2)['trajectory'].max(), 0)
+        self.assertEqual(self.container.settings(), {'expInfo': {'Block': 'Uni+Bi'}})
+
+    def test_trial_table(self):
+        table = TrialTable([('Trial', np.int32), ('Side', object), ('Speed', np.float64)])
+        table.append({'Trial': 0, 'Side': 'Left', 'Speed': 2.5})
+        table.append({'Trial': 1, 'Side': 'Right', 'Speed': 3.0})
+        self.container.saveTable(table)
+        trials = self.container.table()
+        self.assertEqual(trials.dtype.names, ('Trial', 'Side', 'Speed'))
+        self.assertEqual(list(trials['Side']), ['Left', 'Right'])
+        np.testing.assert_array_equal(trials['Speed'], [2.5, 3.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
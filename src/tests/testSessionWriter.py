@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import threading
+import unittest
+from common.SessionWriter import SessionWriter, sessionWriter
+
+
+class TestSessionWriter(unittest.TestCase):
+
+    def test_writes_run_in_order_in_another_thread(self):
+        writer = SessionWriter()
+        written = []
+        for i in range(100):
+            writer.submit(lambda i: written.append((i, threading.current_thread())), i)
+        writer.close()
+        self.assertEqual([i for i, thread in written], range(100))
+        self.assertTrue(all(thread is writer.thread for i, thread in written))
+
+    def test_writes_after_close_run_right_away(self):
+        writer = SessionWriter()
+        writer.submit(int, 'not a number')
+        self.assertRaises(ValueError, writer.close)
+        written = []
+        writer.submit(written.append, 0)
+        writer.submit(int, 'not a number')
+        self.assertEqual(written, [0])
+        self.assertRaises(ValueError, writer.close)
+        writer.close()
+
+    def test_errors_are_raised_by_flush(self):
+        writer = SessionWriter()
+        written = []
+        writer.submit(int, 'not a number')
+        writer.submit(written.append, 1)
+        self.assertRaises(ValueError, writer.flush)
+        self.assertEqual(written, [1])
+        writer.flush()
+        writer.close()
+
+    def test_session_writer_is_shared_until_closed(self):
+        writer = sessionWriter()
+        self.assertTrue(sessionWriter() is writer)
+        writer.close()
+        self.assertFalse(sessionWriter() is writer)
+        sessionWriter().close()
+
+
+if __name__ == '__main__':
+    unittest.main()
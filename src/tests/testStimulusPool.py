@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+import unittest
+from common.StimulusPool import stimulusPool
+
+
+class Window():
+    pass
+
+
+class TestStimulusPool(unittest.TestCase):
+
+    def test_stimuli_are_created_once_per_window(self):
+        win, created = Window(), []
+        first = stimulusPool(win).get('arrows', lambda w: created.append(w) or ['<--', '-->'])
+        second = stimulusPool(win).get('arrows', lambda w: created.append(w) or ['<--', '-->'])
+        self.assertTrue(first is second)
+        self.assertEqual(created, [win])
+        self.assertEqual(len(stimulusPool(win)), 1)
+        self.assertTrue(stimulusPool(Window()) is not stimulusPool(win))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from common.StimulusRenderer import FrameRasterizer, rgb255, trialFrames, trackingSchedule, renderTrials
+from common.Trajectories import Trajectory
+
+
+class TestFrameRasterizer(unittest.TestCase):
+
+    def test_discs_are_drawn_where_the_window_would(self):
+        rasterizer = FrameRasterizer((200, 100), 10.0)
+        frame = rasterizer.render([[5.0, 2.0]], 0.5, [rgb255('Black')], fixationRadius=0.3)
+        self.assertEqual(frame.shape, (100, 200, 3))
+        self.assertEqual(frame.dtype, np.uint8)
+        # x to the right and y upwards from the center of the frame
+        np.testing.assert_array_equal(frame[30, 150], [0, 0, 0])
+        np.testing.assert_array_equal(frame[50, 100], [255, 255, 255])
+        np.testing.assert_array_equal(frame[0, 0], [128, 128, 128])
+        # The disc covers its area with anti-aliased edges
+        dark = (128 - frame[..., 0].astype(float)) / 128
+        self.assertAlmostEqual(dark[0:45].sum(), np.pi * 5.0 ** 2, delta=1.0)
+
+
+class TestTrialFrames(unittest.TestCase):
+
+    def test_blink_motion_and_probe(self):
+        samples = np.cumsum(np.ones((61, 4, 2)), axis=0)
+        trajectory = Trajectory(samples, [0, 0, 1, 1], 60.0)
+        blinking, probe = trackingSchedule(trajectory.owners, {'Side': 'Right', 'label': 'Unilateral-Right'}, 3, 2)
+        self.assertEqual(blinking, [2, 3])
+        self.assertTrue(probe in [2, 3])
+
+        frames = list(trialFrames(trajectory, 1.0, blinking, probe, 0.5, 60.0, probeTime=0.25))
+        self.assertEqual(len(frames), 30 + 1 + 60 + 15)
+        white, red = rgb255('White'), rgb255('Red')
+        blinks = [(colors[2] == white).all() for positions, colors in frames[0:30]]
+        self.assertFalse(any(blinks[0:7]))
+        self.assertTrue(all(blinks[8:15]))
+        np.testing.assert_array_equal(frames[30][0], samples[0])
+        np.testing.assert_array_equal(frames[31][0], samples[1])
+        np.testing.assert_array_equal(frames[90][0], samples[60])
+        np.testing.assert_array_equal(frames[-1][1][probe], red)
+        self.assertEqual(sum((colors == red).all(axis=1).sum() for positions, colors in frames[0:91]), 0)
+
+
+class TestRenderTrials(unittest.TestCase):
+
+    def test_every_trial_is_a_frame_sequence(self):
+        directory = tempfile.mkdtemp()
+        expInfo = {'NumBalls': 2, 'RectWidth': 6, 'RectHeight': 6, 'BallRadius': 0.25,
+                   'Duration': 0.5, 'BlinkTime': 0.25}
+        condition = {'Side': 'Left', 'label': 'Bilateral-Left'}
+        try:
+            filenames = renderTrials(directory, expInfo, [(condition, 5.0, 1), (condition, 5.0, 2)],
+                                     size=(90, 52), fps=20.0, extension='.npy', processes=1)
+            self.assertEqual([os.path.basename(f) for f in filenames], ['Trial_0001.npy', 'Trial_0002.npy'])
+            nFrames = 5 + 1 + 10 + 20
+            self.assertEqual(len(os.listdir(directory)), 2 * nFrames)
+            frame = np.load(os.path.join(directory, 'Trial_0002_%05d.npy' % nFrames))
+            self.assertEqual(frame.shape, (52, 90, 3))
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
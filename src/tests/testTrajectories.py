@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from common import Geometry
+from common.Trajectories import Trajectory, integrateTrajectories, generateTrialTrajectories, \
+    neighbourPairs, initialBallState, simulateCollisions, sampleEvents, trialInitialState
+from common.TrajectoryLibrary import TrajectoryLibrary, buildLibrary
+
+
+class TestIntegrateTrajectories(unittest.TestCase):
+
+    def setUp(self):
+        self.rectangles = [[-8.0, -3.0, -2.0, 3.0], [2.0, -3.0, 8.0, 3.0]]
+        self.speed = 5.0 / 60.0
+
+    def test_single_ball_matches_reference_loop(self):
+        positions = np.array([[-5.0, 1.0], [4.0, -1.0]])
+        directions = np.array([[0.6, 0.8], [-1.0, 0.0]])
+        frames = integrateTrajectories(positions, directions, [0.25, 0.25], [0, 1], self.rectangles,
+                                       self.speed, 60, 2000.0, 50.0, 0.0001)
+        self.assertEqual(frames.shape, (60, 2, 2))
+
+        # One ball per rectangle, no ball-ball repulsion: compare with the
+        # original per-ball update
+        for b in range(0, 2):
+            pos, direction, rect = positions[b].copy(), directions[b].copy(), self.rectangles[b]
+            for i in range(0, 60):
+                force = np.array([50.0 / (rect[0] - pos[0]) ** 2 - 50.0 / (rect[2] - pos[0]) ** 2,
+                                  50.0 / (rect[1] - pos[1]) ** 2 - 50.0 / (rect[3] - pos[1]) ** 2])
+                force = force - (pos - Geometry.rectangleCenter(rect))
+                direction = Geometry.normalized(direction + 0.0001 * force) * self.speed
+                pos = pos + direction
+                np.testing.assert_allclose(frames[i, b], pos, rtol=1e-5)
+
+    def test_balls_stay_inside_their_rectangle(self):
+        rng = np.random.RandomState(0)
+        positions = np.vstack([rng.uniform([-7, -2], [-3, 2], (4, 2)), rng.uniform([3, -2], [7, 2], (4, 2))])
+        frames = integrateTrajectories(positions, rng.randn(8, 2), [0.25] * 8, [0] * 4 + [1] * 4,
+                                       self.rectangles, self.speed, 240, 10000.0, 50.0, 0.0001)
+        self.assertTrue((frames[:, 0:4, 0] < -2.0).all())
+        self.assertTrue((frames[:, 4:8, 0] > 2.0).all())
+        self.assertTrue((np.abs(frames[:, :, 1]) < 3.0).all())
+
+    def test_neighbour_pairs_match_brute_force(self):
+        rng = np.random.RandomState(1)
+        positions = rng.uniform(-8, 8, (300, 2))
+        owners = (positions[:, 0] > 0).astype(int)
+        first, second = neighbourPairs(positions, owners, 1.5)
+        dist = np.sqrt(((positions[:, np.newaxis] - positions[np.newaxis]) ** 2).sum(axis=2))
+        expected = np.argwhere((dist < 1.5) & (owners[:, np.newaxis] == owners[np.newaxis]) & (dist > 0))
+        self.assertEqual(sorted(zip(first, second)), sorted(map(tuple, expected)))
+
+    def test_many_balls_are_placed_apart(self):
+        rng = np.random.RandomState(2)
+        positions, directions, cells = initialBallState(100, 0.2, [2.0, -3.0, 8.0, 3.0], rng)
+        self.assertTrue(len(cells) >= 100)
+        self.assertTrue((positions[:, 0] > 2.2).all() and (positions[:, 0] < 7.8).all())
+        dist = np.sqrt(((positions[:, np.newaxis] - positions[np.newaxis]) ** 2).sum(axis=2))
+        np.fill_diagonal(dist, np.inf)
+        self.assertTrue(dist.min() > 0.0)
+        expInfo = {'NumBalls': 60, 'RectWidth': 6, 'RectHeight': 6, 'BallRadius': 0.2, 'Duration': 1}
+        frames = generateTrialTrajectories(expInfo, 5.0, 3).positions
+        self.assertTrue(np.isfinite(frames).all())
+        self.assertTrue((frames[:, 0:60, 0] < -2.0).all() and (frames[:, 60:, 0] > 2.0).all())
+
+
+class TestTrajectory(unittest.TestCase):
+
+    def test_slicing_and_roundtrip(self):
+        positions = np.arange(5 * 4 * 2, dtype=float).reshape(5, 4, 2)
+        trajectory = Trajectory(positions, [0, 0, 1, 1], 2.0)
+        self.assertEqual(len(trajectory), 5)
+        self.assertEqual(trajectory[1:3].shape, (2, 4, 2))
+        self.assertEqual(trajectory.positions.dtype, np.float32)
+        np.testing.assert_array_equal(trajectory.columns(1), [2, 3])
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        filename = os.path.join(directory, 'trajectory.npz')
+        trajectory.save(filename)
+        loaded = Trajectory.load(filename)
+        np.testing.assert_array_equal(loaded.positions, trajectory.positions)
+        np.testing.assert_array_equal(loaded.owners, trajectory.owners)
+        self.assertEqual(loaded.rate, 2.0)
+
+    def test_positions_are_interpolated_in_time(self):
+        positions = np.arange(0, 5, dtype=float)[:, np.newaxis, np.newaxis] * np.ones((5, 1, 2))
+        trajectory = Trajectory(positions, [0], 2.0)
+        self.assertEqual(trajectory.duration, 2.0)
+        np.testing.assert_allclose(trajectory.at(0.75), [[1.5, 1.5]])
+        np.testing.assert_allclose(trajectory.at([0.0, 0.25, 2.0, 3.0])[:, 0, 0], [0, 0.5, 4, 4])
+        np.testing.assert_allclose(trajectory.sampled(4.0)[:, 0, 0], np.arange(0, 4.5, 0.5))
+
+
+class TestGenerateTrialTrajectories(unittest.TestCase):
+
+    def test_trajectories_only_depend_on_the_seed(self):
+        expInfo = {'NumBalls': 4, 'RectWidth': 6, 'RectHeight': 6, 'BallRadius': 0.25, 'Duration': 1}
+        first = generateTrialTrajectories(expInfo, 5.0, 42)
+        second = generateTrialTrajectories(expInfo, 5.0, 42)
+        other = generateTrialTrajectories(expInfo, 5.0, 43)
+        np.testing.assert_array_equal(first.positions, second.positions)
+        self.assertFalse(np.array_equal(first.positions, other.positions))
+        np.testing.assert_array_equal(first.owners, [0, 0, 0, 0, 1, 1, 1, 1])
+
+    def test_trajectory_starts_at_the_initial_positions(self):
+        expInfo = {'NumBalls': 4, 'RectWidth': 6, 'RectHeight': 6, 'BallRadius': 0.25, 'Duration': 2}
+        trajectory = generateTrialTrajectories(expInfo, 5.0, 7)
+        self.assertEqual(len(trajectory), 121)
+        self.assertEqual(trajectory.duration, 2.0)
+        np.testing.assert_allclose(trajectory.at(0.0), trialInitialState(expInfo, 7)[0], rtol=1e-6)
+        # Half a step is halfway between two integration steps
+        np.testing.assert_allclose(trajectory.at(1.5 / 60.0), (trajectory[1] + trajectory[2]) / 2, rtol=1e-6)
+
+
+class TestCollisions(unittest.TestCase):
+
+    def test_bounces_on_edges_and_balls(self):
+        # Two balls heading at each other and toward the left edge
+        events = simulateCollisions([[-1.0, 0.0], [1.0, 0.0]], [[1.0, 0.0], [-1.0, 0.0]], [0.5, 0.5], [0, 0],
+                                    [[-3.0, -3.0, 3.0, 3.0]], 4.0)
+        positions = sampleEvents(events, [0.5, 1.0, 2.5, 3.5])
+        np.testing.assert_allclose(positions[:, 0, 0], [-0.5, -1.0, -2.5, -1.5], atol=1e-6)
+        np.testing.assert_allclose(positions[:, 1, 0], [0.5, 1.0, 2.5, 1.5], atol=1e-6)
+
+    def test_event_trajectory_is_exact_at_any_time(self):
+        expInfo = {'NumBalls': 20, 'RectWidth': 6, 'RectHeight': 6, 'BallRadius': 0.25, 'Duration': 3,
+                   'PhysicsMode': 'Collisions'}
+        trajectory = generateTrialTrajectories(expInfo, 5.0, 11)
+        at60 = trajectory.sampled(60.0)
+        at120 = trajectory.sampled(120.0)
+        self.assertEqual(len(at60), 181)
+        np.testing.assert_array_equal(at120[0::2], at60[:])
+        np.testing.assert_array_equal(trajectory.at(1.0 / 60.0), at60[1])
+        left = at120[:, 0:20]
+        dist = np.sqrt(((left[:, :, np.newaxis] - left[:, np.newaxis]) ** 2).sum(axis=3))
+        dist[:, range(20), range(20)] = np.inf
+        self.assertTrue(dist.min() > 0.5 - 1e-4)
+        self.assertTrue((left[:, :, 0] > -8.0 + 0.25 - 1e-4).all() and (left[:, :, 0] < -2.0 - 0.25 + 1e-4).all())
+
+
+class TestTrajectoryLibrary(unittest.TestCase):
+
+    def test_build_and_lookup(self):
+        expInfo = {'NumBalls': 4, 'RectWidth': 6, 'RectHeight': 6, 'BallRadius': 0.25, 'Duration': 1}
+        temporary = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temporary)
+        directory = os.path.join(temporary, 'library')
+        buildLibrary(directory, expInfo, [(5.0, 1), (2.5, 2)], processes=1)
+
+        library = TrajectoryLibrary(directory)
+        self.assertEqual(len(library), 2)
+        stored = library.get(expInfo, 2.5, 2)
+        np.testing.assert_array_equal(stored.positions, generateTrialTrajectories(expInfo, 2.5, 2).positions)
+        np.testing.assert_array_equal(stored.owners, [0, 0, 0, 0, 1, 1, 1, 1])
+        self.assertEqual(stored.rate, 60.0)
+        self.assertTrue(library.get(expInfo, 2.5, 3) is None)
+
+    def test_event_trajectories_are_stored_exactly(self):
+        expInfo = {'NumBalls': 4, 'RectWidth': 6, 'RectHeight': 6, 'BallRadius': 0.25, 'Duration': 1,
+                   'PhysicsMode': 'Collisions'}
+        temporary = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temporary)
+        directory = os.path.join(temporary, 'library')
+        buildLibrary(directory, expInfo, [(5.0, 1), (2.5, 2)], processes=1)
+
+        stored = TrajectoryLibrary(directory).get(expInfo, 2.5, 2)
+        computed = generateTrialTrajectories(expInfo, 2.5, 2)
+        for storedArray, computedArray in zip(stored.events, computed.events):
+            np.testing.assert_array_equal(storedArray, computedArray)
+        np.testing.assert_array_equal(stored.owners, computed.owners)
+        t = np.linspace(0, 1, 7)
+        np.testing.assert_array_equal(stored.at(t), computed.at(t))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import csv
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from common.TrialJournal import TrialJournal, readJournal
+
+
+class TestTrialJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_csv_rows_are_appended(self):
+        filename = os.path.join(self.directory, 'results_trials.csv')
+        journal = TrialJournal(filename, ['Trial', 'Speed', 'Response'])
+        journal.write({'Trial': 0, 'Speed': 5.0, 'Response': 1})
+        journal.write({'Trial': 1, 'Response': 0})
+        self.assertRaises(ValueError, journal.write, {'Trial': 2, 'Contrast': 0.5})
+        journal.close()
+        # A resumed session appends to the same journal without a new header
+        journal = TrialJournal(filename, ['Trial', 'Speed', 'Response'], fsyncEvery=0)
+        journal.write({'Trial': 2, 'Speed': 4.5, 'Response': 1})
+        journal.close()
+        with open(filename, 'rb') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual([row['Trial'] for row in rows], ['0', '1', '2'])
+        self.assertEqual(rows[1]['Speed'], '')
+        self.assertEqual(rows[2]['Speed'], '4.5')
+
+    def test_a_torn_row_is_dropped_before_appending(self):
+        filename = os.path.join(self.directory, 'results_trials.csv')
+        journal = TrialJournal(filename, ['Trial', 'Response'])
+        journal.write({'Trial': 0, 'Response': 1})
+        journal.close()
+        with open(filename, 'ab') as f:
+            f.write('1,')
+        journal = TrialJournal(filename, ['Trial', 'Response'])
+        journal.write({'Trial': 1, 'Response': 0})
+        journal.close()
+        self.assertEqual(readJournal(filename), [{'Trial': '0', 'Response': '1'}, {'Trial': '1', 'Response': '0'}])
+
+    def test_json_lines_accept_numpy_values(self):
+        filename = os.path.join(self.directory, 'results_trials.jsonl')
+        journal = TrialJournal(filename)
+        journal.write({'Trial': 0, 'Seed': np.int64(12), 'Jitter': np.float32(0.5)})
+        self.assertEqual(len(journal), 1)
+        journal.close()
+        with open(filename, 'r') as f:
+            self.assertEqual(json.loads(f.readline()), {'Trial': 0, 'Seed': 12, 'Jitter': 0.5})
+
+
+if __name__ == '__main__':
+    unittest.main()
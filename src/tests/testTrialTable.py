@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import unittest
+import numpy as np
+from common.TrialTable import TrialTable
+
+DTYPES = [('Trial', np.int32), ('Side', object), ('Speed', np.float64), ('Response', np.int8)]
+
+
+class TestTrialTable(unittest.TestCase):
+
+    def test_rows_are_stored_in_typed_columns(self):
+        table = TrialTable(DTYPES, capacity=2)
+        for trial in range(5):
+            table.append({'Trial': trial, 'Side': 'Left', 'Speed': 0.5 * trial, 'Response': trial % 2})
+        self.assertEqual(len(table), 5)
+        self.assertEqual(table.capacity, 8)
+        self.assertEqual(table['Trial'].dtype, np.int32)
+        self.assertEqual(list(table['Trial']), range(5))
+        self.assertEqual(list(table['Side']), ['Left'] * 5)
+        np.testing.assert_array_equal(table['Speed'], 0.5 * np.arange(5))
+
+    def test_missing_and_unknown_columns(self):
+        table = TrialTable(DTYPES)
+        table.append({'Trial': 1})
+        self.assertTrue(np.isnan(table['Speed'][0]))
+        self.assertEqual(table['Response'][0], 0)
+        self.assertEqual(table['Side'][0], None)
+        self.assertRaises(ValueError, table.append, {'Trial': 2, 'Seed': 3})
+        self.assertEqual(len(table), 1)
+
+    def test_columns_are_views(self):
+        table = TrialTable(DTYPES)
+        table.append({'Trial': 1, 'Speed': 2.0})
+        self.assertTrue(np.shares_memory(table['Speed'], table.arrays['Speed']))
+
+
+if __name__ == '__main__':
+    unittest.main()
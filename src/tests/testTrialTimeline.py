@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import unittest
+import numpy as np
+from common.TrialTimeline import TrialTimeline, alternating
+
+
+class TestTrialTimeline(unittest.TestCase):
+
+    def test_phases_are_rounded_to_whole_frames(self):
+        timeline = TrialTimeline(59.95)
+        cue = timeline.addPhase('cue', 2.0)
+        mask = timeline.addPhase('mask', 0.35)
+        still = timeline.addPhase('mask', nFrames=1)
+        self.assertEqual(len(timeline), 120 + 21 + 1)
+        self.assertEqual(list(timeline.frames(mask)), range(120, 141))
+        self.assertEqual(timeline.name(still), 'mask')
+        np.testing.assert_allclose(timeline.times(cue)[[0, -1]], [0.0, 119 / 59.95])
+        self.assertEqual(timeline.elapsedFrames(3.02 / 59.95), 3)
+
+    def test_channels_hold_the_state_of_every_frame(self):
+        timeline = TrialTimeline(60.0)
+        cue = timeline.addPhase('cue', 0.5)
+        blink = timeline.addPhase('blink', 1.0)
+        colors = timeline.addChannel('ballColor', shape=(4,))
+        self.assertRaises(ValueError, timeline.addPhase, 'motion', 1.0)
+        colors[timeline.phaseSlice(blink), [1, 3]] = alternating(timeline.phaseFrames(blink), 7.5)[:, np.newaxis]
+        self.assertTrue(timeline['ballColor'] is colors)
+        self.assertEqual(colors.shape, (90, 4))
+        self.assertEqual(colors[timeline.phaseSlice(cue)].sum(), 0)
+        # A blink period of 0.125 s at 60 Hz is 7.5 frames
+        np.testing.assert_array_equal(colors[30:53, 1], [0] * 8 + [1] * 7 + [0] * 8)
+        np.testing.assert_array_equal(colors[:, 0], 0)
+        timeline.set('ballColor', cue, 1)
+        self.assertEqual(colors[0:30].min(), 1)
+
+    def test_a_slow_wait_before_the_start_flip_skips_no_frames(self):
+        timeline = TrialTimeline(60.0)
+        clock = [0.0]
+
+        def flip():
+            clock[0] += 1 / 60.0
+            return clock[0]
+        flip()
+        # The trajectories take one second to be ready
+        clock[0] += 1.0
+        start = flip()
+        self.assertEqual(list(timeline.flipFrames(5, flip, start)), [0, 1, 2, 3, 4])
+
+    def test_dropped_frames_are_skipped(self):
+        timeline = TrialTimeline(60.0)
+        times = iter([1, 2, 4, 5, 6])
+
+        def flip():
+            return next(times) / 60.0
+        self.assertEqual(list(timeline.flipFrames(6, flip, 0.0)), [0, 1, 2, 4, 5])
+
+    def test_alternating_switches_every_period(self):
+        np.testing.assert_array_equal(alternating(7, 2), [0, 0, 1, 1, 0, 0, 1])
+        np.testing.assert_array_equal(alternating(4, 1, offset=1), [1, 0, 1, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
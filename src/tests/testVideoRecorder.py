@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from common.VideoRecorder import VideoRecorder, videoRecorder, closeVideoRecorder
+
+
+class Frame():
+
+    def __init__(self, written):
+        self.written = written
+
+    def save(self, filename):
+        self.written.wait()
+        open(filename, 'w').close()
+
+
+class Window():
+
+    measuredFPS = 60.0
+
+    def __init__(self):
+        self.movieFrames = []
+        self.written = threading.Event()
+        self.written.set()
+
+    def getMovieFrame(self, buffer='front'):
+        self.movieFrames.append(Frame(self.written))
+
+
+class TestVideoRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_every_recording_is_an_image_sequence(self):
+        win = Window()
+        recorder = videoRecorder(win)
+        self.assertTrue(videoRecorder(win) is recorder)
+        for nFrames in [3, 2]:
+            recorder.start(os.path.join(self.directory, 'frames', 'Tracking'))
+            for i in range(nFrames):
+                recorder.capture()
+            recorder.stop()
+        recorder.close()
+        self.assertEqual(win.movieFrames, [])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.directory, 'frames'))),
+                         ['Tracking_0001_00001.png', 'Tracking_0001_00002.png', 'Tracking_0001_00003.png',
+                          'Tracking_0002_00001.png', 'Tracking_0002_00002.png'])
+
+    def test_an_interrupted_recording_is_written_on_close(self):
+        win = Window()
+        closeVideoRecorder(win)
+        recorder = videoRecorder(win)
+        recorder.start(os.path.join(self.directory, 'Tracking'))
+        for i in range(3):
+            recorder.capture()
+        # The session crashes before stop(), the handler closes the recorder
+        closeVideoRecorder(win)
+        closeVideoRecorder(win)
+        self.assertFalse(recorder.thread.is_alive())
+        self.assertEqual(len(os.listdir(self.directory)), 3)
+
+    def test_capture_waits_for_a_slow_writer(self):
+        win = Window()
+        win.written.clear()
+        recorder = VideoRecorder(win, maxQueued=4)
+        recorder.start(os.path.join(self.directory, 'Flicker'))
+        threading.Timer(0.2, win.written.set).start()
+        for i in range(20):
+            recorder.capture()
+        self.assertEqual(recorder.stop(), 0)
+        recorder.close()
+        self.assertEqual(len(os.listdir(self.directory)), 20)
+        self.assertEqual(recorder.losses, [])
+
+    def test_frames_are_dropped_when_the_writer_is_stuck(self):
+        win = Window()
+        win.written.clear()
+        recorder = VideoRecorder(win, maxQueued=4, timeout=0.01)
+        filename = recorder.start(os.path.join(self.directory, 'Flicker'))
+        for i in range(20):
+            recorder.capture()
+        self.assertTrue(recorder.nDropped >= 20 - 4 - 1)
+        self.assertEqual(recorder.nFrames + recorder.nDropped, 20)
+        win.written.set()
+        self.assertEqual(recorder.stop(), recorder.nDropped)
+        recorder.close()
+        self.assertEqual(len(os.listdir(self.directory)), recorder.nFrames)
+        self.assertEqual(recorder.losses, [(filename, recorder.nDropped, 20)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,31 @@
 import numpy as np
-from random import randrange
 from common.psycho_init import open_window, setup_monitor
 from common.psycho_init import experiment_finished
 from common.psycho_init import set_output_file, save_experimental_settings
 from common.show_instructions import show_instructions
 
 from psychopy import core
-from common import Ball
+from common import Ball, BallField
+from common.BallField import rgbColor
+from common.Trajectories import trialInitialState, generateTrialTrajectories, PHYSICS_MODES
+from common.TrajectoryPrefetcher import TrajectoryPrefetcher
+from common.StimulusPool import stimulusPool
+from common.VideoRecorder import videoRecorder, closeVideoRecorder
+from common.FrameIntervals import TrialFrameIntervals, phaseColumns
+from common.TrialJournal import TrialJournal
+from common.SessionWriter import sessionWriter
+from common.TrialTimeline import TrialTimeline, alternating
+from common.SessionSeeds import SessionSeeds, drawSessionSeed, trialRng, MAX_SEED
+
+
+# The phases of a trial whose flip intervals are written in the trial record
+TRIAL_PHASES = ['blink', 'motion', 'response']
+# The columns of the trial journal, one row per staircase trial
+TRIAL_COLUMNS = ['Trial', 'label', 'Side', 'Speed', 'Response', 'Seed'] + phaseColumns(TRIAL_PHASES)
+# The blinking balls switch color every BLINK_PERIOD seconds, the feedback
+# dot is shown for FEEDBACK_TIME seconds after the response
+BLINK_PERIOD = 0.125
+FEEDBACK_TIME = 0.4
 
 
 def setupExperiment():
@@ -28,6 +47,9 @@ def setupExperiment():
                'TrainingTrials': 0,
                'SimulationMode': False,
                'DrawRectangles': False,
+               'TrajectoryLibrary': '',
+               'SessionSeed': 0,
+               'PhysicsMode': PHYSICS_MODES,
                'SaveVideo': False
                }
 
@@ -52,7 +74,10 @@ def setupExperiment():
                               'Duration': 'Duration of the stimulus in seconds',
                               'BlinkTime': 'Time of white/black ball blinking in seconds',
                               'TrainingTrials': 'Number of preparation training trials',
-                              'SimulationMode': 'Run the experiment with a perfect cumulative normal observer'
+                              'SimulationMode': 'Run the experiment with a perfect cumulative normal observer',
+                              'TrajectoryLibrary': 'Folder of precomputed trajectories, leave empty to compute them online',
+                              'SessionSeed': 'Seed of the random stimuli of the session, 0 to draw a new one',
+                              'PhysicsMode': 'Soft repulsive forces or straight motion with elastic bounces'
                           })
 
     if not dlg.OK:
@@ -86,6 +111,7 @@ def setupExperiment():
     if not dlgStaircase.OK:
         core.quit()
 
+    drawSessionSeed(expInfo)
     outputfile = set_output_file(expInfo, 'tracking_')
     save_experimental_settings(
         outputfile + '_info.pickle', expInfo, staircaseInfo, monitorInfo)
@@ -93,95 +119,7 @@ def setupExperiment():
     return expInfo, staircaseInfo, outputfile, monitorInfo
 
 
-def createBalls(win, nBalls, radius, boundRect, speed):
-    """
-    Create the balls to be put in the area
-    """
-    from numpy.random import uniform
-    halfX = (boundRect[0] + boundRect[2]) / 2.0
-    halfY = (boundRect[1] + boundRect[3]) / 2.0
-    # The four rectangles that build the main rectangle
-    rectanglesList = []
-    rectanglesList.append([boundRect[0], boundRect[1], halfX, halfY])
-    rectanglesList.append([halfX, boundRect[1], boundRect[2], halfY])
-    rectanglesList.append([boundRect[0], halfY, halfX, boundRect[3]])
-    rectanglesList.append([halfX, halfY, boundRect[2], boundRect[3]])
-
-    # Generate the balls in the
-    balls = []
-    from random import shuffle
-    from common import Geometry
-    for i in range(0, nBalls):
-        startPos = np.array(
-            [uniform(
-                rectanglesList[
-                    i % 4][0] + radius, rectanglesList[i % 4][2] - radius),
-             uniform(rectanglesList[i % 4][1] + radius, rectanglesList[i % 4][3] - radius)])
-        direction = Geometry.normalized(
-            np.array([uniform(-1, 1), uniform(-1, 1)]))
-        ball = Ball(win, position=startPos, direction=direction,
-                    speed=speed, radius=radius, color='Black')
-        balls.append(ball)
-
-    shuffle(balls)
-    return balls, rectanglesList
-
-
-def preGenerateTrajectories(ballSpeed, expInfo, allBallsList, rectangles, repulsionStrength, edgerepulsionStrength, centerAttraction):
-    """
-    Precompute the trajectories of points
-    """
-    from common import Geometry
-    trajClock = core.Clock()
-    trajClock.reset()
-    nFrames = int(expInfo['Duration'] / (1.0 / 60.0))
-    fullFrame = [None] * nFrames  # preallocate space for the list
-    for i in range(0, nFrames):
-        fullFrame[i] = dict()
-        for ballListID, ballList in allBallsList.iteritems():
-            boundingRectangle = rectangles[ballListID]
-            for ball1 in ballList:
-                force = np.array([0, 0])
-                for ball2 in ballList:
-                    if (ball1 == ball2):
-                        continue
-                    # balls collide
-                    delta = ((ball1.pos() - ball2.pos()))
-                    dist2 = ((delta ** 2).sum())
-                    force = force + repulsionStrength * \
-                        (ball1.radius * ball2.radius) * delta / (dist2 * dist2)
-
-                # Repulsion to borders
-                force[0] = force[0] + edgerepulsionStrength / \
-                    ((boundingRectangle[0] - ball1.pos()[0]) ** 2)
-                force[0] = force[0] - edgerepulsionStrength / \
-                    ((boundingRectangle[2] - ball1.pos()[0]) ** 2)
-
-                force[1] = force[1] + edgerepulsionStrength / \
-                    ((boundingRectangle[1] - ball1.pos()[1]) ** 2)
-                force[1] = force[1] - edgerepulsionStrength / \
-                    ((boundingRectangle[3] - ball1.pos()[1]) ** 2)
-
-                # Add a little attraction to the center of boundingRectangle
-                dispFromCenter = Geometry.rectangleCenter(boundingRectangle)
-                force = force - (ball1.pos() - dispFromCenter)
-
-                ball1.direction = ball1.direction + centerAttraction * force
-
-                # Renormalize direction with correct speed
-                ball1.direction = Geometry.normalized(
-                    ball1.direction) * ballSpeed
-
-                # Move the ball in the computed direction and finally draw it
-                ball1.move(ball1.direction)
-                # if (i==1): #print displacement for debug purpose
-                #    print np.sqrt(np.dot(ball1.direction,ball1.direction))*60
-                fullFrame[i][ball1] = ball1.pos()
-
-    return fullFrame
-
-
-def trackingTrial(win, experimentalInfo, ballSpeed, thisCondition, simulation=False, isCatchTrial=0):
+def trackingTrial(win, experimentalInfo, ballSpeed, thisCondition, simulation=False, isCatchTrial=0, seed=None, trajectories=None, frameIntervals=None):
     from psychopy import visual, event
     """
     Start the tracking trial
@@ -193,27 +131,43 @@ def trackingTrial(win, experimentalInfo, ballSpeed, thisCondition, simulation=Fa
     # Generate a list of 4 balls on left side for unilateral condition
     trialClock = core.Clock()
 
-    rectWidth, rectHeight = experimentalInfo[
-        'RectWidth'], experimentalInfo['RectHeight']
-    displacementX = 4  # 1 cm central displacement
     nBallsPerRectangle = experimentalInfo['NumBalls']
     ballRadius = experimentalInfo['BallRadius']
 
-    leftRightRectangles = [
-        [-rectWidth - displacementX / 2.0, -rectHeight / 2.0,
-            -displacementX / 2.0, rectHeight / 2.0],
-        [displacementX / 2.0, -rectHeight / 2.0, rectWidth + displacementX / 2.0, rectHeight / 2.0]]
+    # The flip intervals of every phase are collected in frameIntervals
+    if frameIntervals is None:
+        frameIntervals = TrialFrameIntervals(win, TRIAL_PHASES)
+    # The frames are streamed to disk by a background thread, one file per trial
+    if (experimentalInfo['SaveVideo']):
+        import os
+        recorder = videoRecorder(win)
+        outputVideo = recorder.start(os.path.join(os.getcwd(), 'data', 'frames', 'Tracking'))
+        print "Saving video to " + outputVideo
 
-    ballsLeft, rectanglesLeft = createBalls(
-        win, nBallsPerRectangle, radius=ballRadius, boundRect=leftRightRectangles[0], speed=ballSpeed)
-    ballsRight, rectanglesRight = createBalls(
-        win, nBallsPerRectangle, radius=ballRadius, boundRect=leftRightRectangles[1], speed=ballSpeed)
+    # The starting state of the balls only depends on the seed, so that the
+    # trajectories can be computed in a worker process
+    if seed is None:
+        seed = np.random.randint(0, MAX_SEED)
+    positions, directions, owners, quadrants = trialInitialState(experimentalInfo, seed)
+    if trajectories is not None:
+        trajectories.submit(ballSpeed, seed)
+    # The stimuli are reused across trials, only their state is reset here.
+    # All the balls are drawn at once, ballsLeft and ballsRight are their indices
+    pool = stimulusPool(win)
+    balls = pool.get(('balls', len(positions), ballRadius),
+                     lambda win: BallField(win, positions, radius=ballRadius, color='Black'))
+    balls.setPositions(positions)
+    balls.setColor('Black')
+    ballsLeft = list(np.flatnonzero(owners == 0))
+    ballsRight = list(np.flatnonzero(owners == 1))
+    rectanglesLeft, rectanglesRight = quadrants
 
     #allBallsList = { 0:ballsLowerLeft, 1:ballsLowerRight, 2:ballsUpperLeft,3:ballsUpperRight }
     allBallsList = {0: ballsLeft, 1: ballsRight}
 
-    fixationBall = Ball(win, position=np.array([0.0, 0.0]), direction=np.array(
-        [0.0, 0.0]), speed=0.0, radius=0.10, color='White')
+    fixationBall = pool.get(('fixation', 0.10), lambda win: Ball(win, position=np.array([0.0, 0.0]), direction=np.array(
+        [0.0, 0.0]), speed=0.0, radius=0.10, color='White'))
+    fixationBall.setColor('White')
     trialClock.reset()
     blinkingBalls = list()
 
@@ -246,94 +200,99 @@ def trackingTrial(win, experimentalInfo, ballSpeed, thisCondition, simulation=Fa
     if runModes[runMode] != 'Unilateral' and runModes[runMode] != 'Bilateral':
         raise Exception("Run mode must be \"Unilateral\" or \"Bilateral\"")
 
-    blinkTimer = core.Clock()
-    blinkInteger = 0
     rectanglesVisual = []
     for r in rectanglesLeft + rectanglesRight:
-        rectanglesVisual.append(visual.Rect(win, width=(
-            r[2] - r[0]), height=(r[3] - r[1]), fillColor=None, lineColor='Red', units='cm',pos=[(r[0] + r[2]) / 2.0, (r[1] + r[3]) / 2.0]))
+        rectanglesVisual.append(pool.get(('rect',) + tuple(r), lambda win, r=r: visual.Rect(win, width=(
+            r[2] - r[0]), height=(r[3] - r[1]), fillColor=None, lineColor='Red', units='cm',pos=[(r[0] + r[2]) / 2.0, (r[1] + r[3]) / 2.0])))
+
+    # The timed phases are compiled to frames before the first flip, the
+    # blinking balls switch between the colors of palette every BLINK_PERIOD
+    timeline = TrialTimeline(win.measuredFPS)
+    blinkPhase = timeline.addPhase('blink', experimentalInfo['BlinkTime'])
+    motionPhase = timeline.addPhase('motion', experimentalInfo['Duration'])
+    feedbackPhase = timeline.addPhase('response', FEEDBACK_TIME)
+    palette = np.array([rgbColor('Black'), rgbColor('White')])
+    ballColors = timeline.addChannel('ballColor', shape=(len(balls),))
+    ballColors[timeline.phaseSlice(blinkPhase), blinkingBalls] = alternating(
+        timeline.phaseFrames(blinkPhase), BLINK_PERIOD * timeline.fps)[:, np.newaxis]
 
     # Start first part of the experiment, 2 balls blink for a certain amount
     # of time controlled by experimentalInfo['BlinkTime']
-    while trialClock.getTime() < experimentalInfo['BlinkTime']:
+    frameIntervals.phase('blink')
+    for frame in timeline.frames(blinkPhase):
+        balls.update(colors=palette[ballColors[frame]])
         fixationBall.draw()
         # speedText.draw()
         if experimentalInfo['DrawRectangles']:
             for r in rectanglesVisual:
                 r.draw()
-        for ballListID, ballList in allBallsList.iteritems():
-            for ball1 in ballList:
-                ball1.draw()
-
-        if (blinkTimer.getTime() > 0.125):
-            blinkInteger = blinkInteger + 1
-            blinkTimer.reset()
-        if (blinkInteger % 2):
-            for blinkBall in blinkingBalls:
-                blinkBall.setColor('White')
-        else:
-            for blinkBall in blinkingBalls:
-                blinkBall.setColor('Black')
+        balls.draw()
         if (experimentalInfo['SaveVideo']):
-            win.getMovieFrame()
+            recorder.capture()
         win.flip()
 
     # Reset all colors of the balls to black and move each ball in its right
     # part of space
-    for ballListID, ballList in allBallsList.iteritems():
-        for ball1 in ballList:
-            ball1.setColor('Black')
-            if (isCatchTrial == 1):
-                ball1.setColor('Yellow')
-            if (isCatchTrial == 2):
-                ball1.setColor('Magenta')
-            ball1.draw()
+    balls.setColor('Black')
+    if (isCatchTrial == 1):
+        balls.setColor('Yellow')
+    if (isCatchTrial == 2):
+        balls.setColor('Magenta')
+    balls.draw()
 
     fixationBall.draw()
     if (experimentalInfo['SaveVideo']):
-        win.getMovieFrame()
+        recorder.capture()
 
     win.flip()
+    # The wait for the trajectories belongs to no phase of the trial
+    frameIntervals.end()
     trialClock.reset()
-    # This function pregenerates all the trajectories so that in displaying
-    # them we have no slowing
-    allFrames = preGenerateTrajectories(
-        ballSpeed /
-        win.fps(), experimentalInfo, allBallsList, leftRightRectangles,
-        repulsionStrength=2000.0 * ballSpeed, edgerepulsionStrength=10.0 * ballSpeed, centerAttraction=0.0001)
+    # The trajectories are computed by the background worker while the balls
+    # blink, otherwise they are computed here
+    if trajectories is None:
+        motion = generateTrialTrajectories(experimentalInfo, ballSpeed, seed)
+    else:
+        motion = trajectories.get(ballSpeed, seed)
 
     trialClock.reset()
-    for balls in allFrames:
-        for ball, pos in balls.iteritems():
-            ball.setPos(pos)
-            ball.draw()
+    # The motion starts at the first flip after the trajectories are ready,
+    # that shows the balls still, so that the wait for them does not skip
+    # the start of the motion. Row k of motionPositions is where the balls
+    # are at the k+1-th flip after it, the row drawn is counted from the
+    # flip timestamps, so that a dropped frame neither slows down nor
+    # stretches the motion
+    motionPositions = motion.at(timeline.times(motionPhase) + 1.0 / timeline.fps)
+    balls.draw()
+    fixationBall.draw()
+    motionStart = win.flip()
+    frameIntervals.phase('motion')
+    for frame in timeline.flipFrames(len(motionPositions), win.flip, motionStart):
+        balls.setPositions(motionPositions[frame])
+        balls.draw()
         # speedText.draw()
         if experimentalInfo['DrawRectangles']:
             for r in rectanglesVisual:
                 r.draw()
         fixationBall.draw()
         if (experimentalInfo['SaveVideo']):
-            win.getMovieFrame()
-
-        win.flip()
+            recorder.capture()
     event.clearEvents(eventType='keyboard')
 
     trialClock.reset()
-    randomBall = allBallsList[whichSide][randrange(0, nBallsPerRectangle)]
+    randomBall = allBallsList[whichSide][trialRng(seed, 1).randint(0, nBallsPerRectangle)]
 
-    randomBall.setColor('Red')
+    balls.setColor('Red', [randomBall])
     event.clearEvents(eventType='keyboard')
 
     trialClock.reset()
     responseKey = None
+    frameIntervals.phase('response')
     response = None
     while True:
         keys = event.getKeys()
         fixationBall.draw()
-        for ballListID, ballList in allBallsList.iteritems():
-            for ball1 in ballList:
-                ball1.draw()
-        randomBall.draw()
+        balls.draw()
 
         if 's' in keys:
             responseKey = True
@@ -353,7 +312,7 @@ def trackingTrial(win, experimentalInfo, ballSpeed, thisCondition, simulation=Fa
             win.close()
             core.quit()
         if (experimentalInfo['SaveVideo']):
-            win.getMovieFrame()
+            recorder.capture()
         win.flip()
 
     if response is True:
@@ -361,34 +320,30 @@ def trackingTrial(win, experimentalInfo, ballSpeed, thisCondition, simulation=Fa
     if response is False:
         fixationBall.setColor('Red')
 
-    trialClock.reset()
-    while trialClock.getTime() < 0.4:
+    for frame in timeline.frames(feedbackPhase):
         keys = event.getKeys()
         fixationBall.draw()
-        for ballListID, ballList in allBallsList.iteritems():
-            for ball1 in ballList:
-                ball1.draw()
-        randomBall.draw()
+        balls.draw()
         if (experimentalInfo['SaveVideo']):
-            win.getMovieFrame()
+            recorder.capture()
         win.flip()
 
     if (experimentalInfo['SaveVideo']):
-        import os
-        currentpath = os.getcwd()
-        savedatapath = currentpath + os.path.sep + 'data'
-        outputVideo = savedatapath + os.path.sep + \
-            "frames" + os.path.sep + 'Tracking.png'
-        print "Saving video to " + outputVideo
-        win.saveMovieFrames(outputVideo)
+        recorder.stop()
 
+    frameIntervals.end()
     return response
 
 
 def startExperiment():
     try:
         expInfo, stairInfo, outputfile, monitorInfo = setupExperiment()
+        # Every trial is appended to the journal, the staircase files are
+        # only written at the end of the session, all by the writer thread
+        writer = sessionWriter()
+        journal = TrialJournal(outputfile + '_trials.csv', TRIAL_COLUMNS)
         win = open_window(monitorInfo)
+        seeds = SessionSeeds(expInfo['SessionSeed'])
         show_instructions(win, "Press spacebar to start experiment, doing " +
                           str(expInfo['TrainingTrials']) + " training trials")
 
@@ -474,7 +429,7 @@ def startExperiment():
         for i in range(0, int(expInfo['TrainingTrials'])):
             speedValue = 1.25 * (i + 1)
             trackingTrial(
-                win, expInfo, speedValue, conditions[randrange(0, 2)])
+                win, expInfo, speedValue, conditions[seeds.rng.randint(0, 2)])
 
         show_instructions(
             win, "Finished training trials, press spacebar to begin")
@@ -485,11 +440,14 @@ def startExperiment():
         # We save the last speed used for every side of stimulus presentation
         nTrial = 0
         import copy
+        # The trajectories are computed by a worker process during the blink phase
+        trajectories = TrajectoryPrefetcher(expInfo)
         for speedValue, thisCondition in stairs:
+            trialSeed = seeds.trialSeed(nTrial)
             velocityConditions[thisCondition['Side']].append(speedValue)
             # print thisCondition['Side'], speedValue
             # Catch trial presentato al 25% di probabilita
-            if np.random.rand() < 0.25 and nTrial > 2:
+            if seeds.rng.rand() < 0.25 and nTrial > 2:
                 catchCondition = copy.deepcopy(thisCondition)
                 if thisCondition['Side'] == 'Left':
                     catchCondition['Side'] = 'Left'
@@ -504,10 +462,10 @@ def startExperiment():
                 # print "0.25 catch trial, showing ", catchCondition['Side'], "
                 # instead of ", thisCondition['Side']
                 trackingTrial(
-                    win, expInfo, speedValue, catchCondition, expInfo['SimulationMode'])
+                    win, expInfo, speedValue, catchCondition, expInfo['SimulationMode'], seed=trialSeed, trajectories=trajectories)
             # Catch trial lanciato quando una delle due staircase finita
             # e che randomizza il lato di presentazione
-            elif np.random.rand() < 0.5:
+            elif seeds.rng.rand() < 0.5:
                 catchCondition = copy.deepcopy(thisCondition)
                 if thisCondition['Side'] == 'Left':
                     catchCondition['Side'] = 'Right'
@@ -516,23 +474,38 @@ def startExperiment():
                 # print "0.5 catch trial, showing ", catchCondition['Side'], "
                 # instead of ", thisCondition['Side']
                 trackingTrial(
-                    win, expInfo, speedValue, catchCondition, expInfo['SimulationMode'])
+                    win, expInfo, speedValue, catchCondition, expInfo['SimulationMode'], seed=trialSeed, trajectories=trajectories)
             else:
+                frameIntervals = TrialFrameIntervals(win, TRIAL_PHASES)
                 thisResp = trackingTrial(
-                    win, expInfo, speedValue, thisCondition, expInfo['SimulationMode'])
+                    win, expInfo, speedValue, thisCondition, expInfo['SimulationMode'], seed=trialSeed, trajectories=trajectories,
+                    frameIntervals=frameIntervals)
                 if thisResp is not None:
                     stairs.addData(not thisResp)
+                    stairs.addOtherData('Seed', trialSeed)
+                    for column, value in frameIntervals.record().iteritems():
+                        stairs.addOtherData(column, value)
+                    writer.submit(journal.write, dict({'Trial': nTrial, 'label': thisCondition['label'],
+                                                       'Side': thisCondition['Side'], 'Speed': speedValue,
+                                                       'Response': int(not thisResp), 'Seed': trialSeed},
+                                                      **frameIntervals.record()))
             nTrial = nTrial + 1
-            stairs.saveAsText(outputfile)
+        trajectories.close()
+        writer.submit(journal.close)
         # Finally save the results of the experiment
-        stairs.saveAsText(outputfile)
-        # stairs.saveAsExcel(outputfile)
-        stairs.saveAsPickle(outputfile)
+        writer.submit(stairs.saveAsText, outputfile)
+        # writer.submit(stairs.saveAsExcel, outputfile)
+        writer.submit(stairs.saveAsPickle, outputfile)
         experiment_finished(win)
+        writer.close()
     except:
-        stairs.saveAsText(outputfile)
-        # stairs.saveAsExcel(outputfile)
-        stairs.saveAsPickle(outputfile)
+        writer.submit(journal.close)
+        writer.submit(stairs.saveAsText, outputfile)
+        # writer.submit(stairs.saveAsExcel, outputfile)
+        writer.submit(stairs.saveAsPickle, outputfile)
+        writer.close(False)
+        # The frames of an interrupted recording are written too
+        closeVideoRecorder(win)
         win.close()
         raise
     #analyzeStaircases(stairs, stairInfo['AverageReversals'])
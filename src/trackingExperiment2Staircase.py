@@ -1,14 +1,45 @@
 import numpy as np
-from random import randrange
 from common.psycho_init import open_window, setup_monitor
 from common.psycho_init import experiment_finished
 from common.psycho_init import set_output_file, save_experimental_settings
 from common.show_instructions import show_instructions
-import pandas as pd
 from psychopy import core
-from common import Ball
+from common import Ball, BallField
+from common.BallField import rgbColor
+from common.Trajectories import trialInitialState, generateTrialTrajectories, PHYSICS_MODES
+from common.TrajectoryPrefetcher import TrajectoryPrefetcher
+from common.StimulusPool import stimulusPool
+from common.VideoRecorder import videoRecorder, closeVideoRecorder
+from common.FrameIntervals import TrialFrameIntervals, phaseDtypes
+from common.TrialJournal import TrialJournal, readJournal
+from common.SessionWriter import sessionWriter
+from common.SessionCheckpoint import SessionCheckpoint
+from common.SessionContainer import SessionContainer
+from common.TrialTable import TrialTable
+from common.TrialTimeline import TrialTimeline, alternating
+from common.SessionSeeds import SessionSeeds, drawSessionSeed, trialRng, MAX_SEED
 from common import perfectObserver
 
+# The phases of a trial whose flip intervals are written in the trial record
+TRIAL_PHASES = ['blink', 'motion', 'response']
+# The typed columns of the trial table and journal, one row per trial including
+# catch trials, Time is the psychopy clock [s] when the response key is read,
+# at the end of the trial in simulation mode
+TRIAL_DTYPES = [('Trial', np.int32), ('label', object), ('Side', object), ('CatchCondition', np.int8),
+                ('Speed', np.float64), ('Response', np.int8), ('Time', np.float64), ('Seed', np.int64)] + phaseDtypes(TRIAL_PHASES)
+TRIAL_COLUMNS = [name for name, dtype in TRIAL_DTYPES]
+# The random stream of the global numpy generator, that MultiStairHandler
+# uses to shuffle the staircases
+STAIRCASE_STREAM = MAX_SEED
+# The random stream of a trial of the simulated observer, apart from the
+# global generator so that it does not change the order of the staircases
+OBSERVER_STREAM = 2
+# The blinking balls switch color every BLINK_PERIOD seconds, the feedback
+# dot is shown for FEEDBACK_TIME seconds after the response
+BLINK_PERIOD = 0.125
+FEEDBACK_TIME = 0.4
+
+
 def setupExperiment():
     from psychopy import gui
     """
@@ -28,6 +59,9 @@ def setupExperiment():
                'TrainingTrials': 0,
                'SimulationMode': False,
                'DrawRectangles': False,
+               'TrajectoryLibrary': '',
+               'SessionSeed': 0,
+               'PhysicsMode': PHYSICS_MODES,
                'SaveVideo': False
                }
 
@@ -52,7 +86,10 @@ def setupExperiment():
                               'Duration': 'Duration of the stimulus in seconds',
                               'BlinkTime': 'Time of white/black ball blinking in seconds',
                               'TrainingTrials': 'Number of preparation training trials',
-                              'SimulationMode': 'Run the experiment with a perfect cumulative normal observer'
+                              'SimulationMode': 'Run the experiment with a perfect cumulative normal observer',
+                              'TrajectoryLibrary': 'Folder of precomputed trajectories, leave empty to compute them online',
+                              'SessionSeed': 'Seed of the random stimuli of the session, 0 to draw a new one',
+                              'PhysicsMode': 'Soft repulsive forces or straight motion with elastic bounces'
                           })
 
     if not dlg.OK:
@@ -86,101 +123,17 @@ def setupExperiment():
     if not dlgStaircase.OK:
         core.quit()
 
+    drawSessionSeed(expInfo)
     outputfile = set_output_file(expInfo, 'trackingStaircase_')
     save_experimental_settings(
         outputfile + '_info.pickle', expInfo, staircaseInfo, monitorInfo)
     return expInfo, staircaseInfo, outputfile, monitorInfo
 
 
-def createBalls(win, nBalls, radius, boundRect, speed):
-    """ Create the balls to be put in the area """
-    halfX = (boundRect[0] + boundRect[2]) / 2.0
-    halfY = (boundRect[1] + boundRect[3]) / 2.0
-    # The four rectangles that build the main rectangle
-    rectanglesList = []
-    rectanglesList.append([boundRect[0], boundRect[1], halfX, halfY])
-    rectanglesList.append([halfX, boundRect[1], boundRect[2], halfY])
-    rectanglesList.append([boundRect[0], halfY, halfX, boundRect[3]])
-    rectanglesList.append([halfX, halfY, boundRect[2], boundRect[3]])
-
-    # Generate the balls in the
-    balls = []
-    from random import shuffle
-    from numpy.random import uniform
-    from common import Geometry
-    for i in range(0, nBalls):
-        startPos = np.array(
-            [uniform(
-                rectanglesList[
-                    i % 4][0] + radius, rectanglesList[i % 4][2] - radius),
-             uniform(rectanglesList[i % 4][1] + radius, rectanglesList[i % 4][3] - radius)])
-        direction = Geometry.normalized(
-            np.array([uniform(-1, 1), uniform(-1, 1)]))
-        ball = Ball(win, position=startPos, direction=direction,
-                    speed=speed, radius=radius, color='Black')
-        balls.append(ball)
-
-    shuffle(balls)
-    return balls, rectanglesList
-
-
-def preGenerateTrajectories(ballSpeed, expInfo, allBallsList, rectangles, repulsionStrength, edgerepulsionStrength, centerAttraction):
-    """
-    Precompute the trajectories of points
-    """
-    trajClock = core.Clock()
-    trajClock.reset()
-    nFrames = int(expInfo['Duration'] / (1.0 / 60.0))
-    fullFrame = [None] * nFrames  # preallocate space for the list
-    from common import Geometry
-    for i in range(0, nFrames):
-        fullFrame[i] = dict()
-        for ballListID, ballList in allBallsList.iteritems():
-            boundingRectangle = rectangles[ballListID]
-            for ball1 in ballList:
-                force = np.array([0, 0])
-                for ball2 in ballList:
-                    if (ball1 == ball2):
-                        continue
-                    # balls collide
-                    delta = ((ball1.pos() - ball2.pos()))
-                    dist2 = ((delta ** 2).sum())
-                    force = force + repulsionStrength * \
-                        (ball1.radius * ball2.radius) * delta / (dist2 * dist2)
-
-                # Repulsion to borders
-                force[0] = force[0] + edgerepulsionStrength / \
-                    ((boundingRectangle[0] - ball1.pos()[0]) ** 2)
-                force[0] = force[0] - edgerepulsionStrength / \
-                    ((boundingRectangle[2] - ball1.pos()[0]) ** 2)
-
-                force[1] = force[1] + edgerepulsionStrength / \
-                    ((boundingRectangle[1] - ball1.pos()[1]) ** 2)
-                force[1] = force[1] - edgerepulsionStrength / \
-                    ((boundingRectangle[3] - ball1.pos()[1]) ** 2)
-
-                # Add a little attraction to the center of boundingRectangle
-                dispFromCenter = Geometry.rectangleCenter(boundingRectangle)
-                force = force - (ball1.pos() - dispFromCenter)
-
-                ball1.direction = ball1.direction + centerAttraction * force
-
-                # Renormalize direction with correct speed
-                ball1.direction = Geometry.normalized(
-                    ball1.direction) * ballSpeed
-
-                # Move the ball in the computed direction and finally draw it
-                ball1.move(ball1.direction)
-                # if (i==1): #print displacement for debug purpose
-                #    print np.sqrt(np.dot(ball1.direction,ball1.direction))*60
-                fullFrame[i][ball1] = ball1.pos()
-
-    return fullFrame
-
-
-def trackingTrial(win, experimentalInfo, ballSpeed, thisCondition, simulation=False, isCatchTrial=0):
+def trackingTrial(win, experimentalInfo, ballSpeed, thisCondition, simulation=False, isCatchTrial=0, seed=None, trajectories=None, frameIntervals=None, trialArrays=None):
     if simulation:
-        return perfectObserver(obs_mean=3, obs_std=0.1, intensity=ballSpeed)
+        rng = trialRng(seed, OBSERVER_STREAM) if seed is not None else np.random.RandomState()
+        return perfectObserver(obs_mean=3, obs_std=0.1, intensity=ballSpeed, rng=rng)
     from psychopy import visual, event
     """
     Start the tracking trial
@@ -192,27 +145,43 @@ def trackingTrial(win, experimentalInfo, ballSpeed, thisCondition, simulation=Fa
     # Generate a list of 4 balls on left side for unilateral condition
     trialClock = core.Clock()
 
-    rectWidth, rectHeight = experimentalInfo[
-        'RectWidth'], experimentalInfo['RectHeight']
-    displacementX = 4  # 1 cm central displacement
     nBallsPerRectangle = experimentalInfo['NumBalls']
     ballRadius = experimentalInfo['BallRadius']
 
-    leftRightRectangles = [
-        [-rectWidth - displacementX / 2.0, -rectHeight / 2.0,
-            -displacementX / 2.0, rectHeight / 2.0],
-        [displacementX / 2.0, -rectHeight / 2.0, rectWidth + displacementX / 2.0, rectHeight / 2.0]]
+    # The flip intervals of every phase are collected in frameIntervals
+    if frameIntervals is None:
+        frameIntervals = TrialFrameIntervals(win, TRIAL_PHASES)
+    # The frames are streamed to disk by a background thread, one file per trial
+    if (experimentalInfo['SaveVideo']):
+        import os
+        recorder = videoRecorder(win)
+        outputVideo = recorder.start(os.path.join(os.getcwd(), 'data', 'frames', 'Tracking'))
+        print "Saving video to " + outputVideo
 
-    ballsLeft, rectanglesLeft = createBalls(
-        win, nBallsPerRectangle, radius=ballRadius, boundRect=leftRightRectangles[0], speed=ballSpeed)
-    ballsRight, rectanglesRight = createBalls(
-        win, nBallsPerRectangle, radius=ballRadius, boundRect=leftRightRectangles[1], speed=ballSpeed)
+    # The starting state of the balls only depends on the seed, so that the
+    # trajectories can be computed in a worker process
+    if seed is None:
+        seed = np.random.randint(0, MAX_SEED)
+    positions, directions, owners, quadrants = trialInitialState(experimentalInfo, seed)
+    if trajectories is not None:
+        trajectories.submit(ballSpeed, seed)
+    # The stimuli are reused across trials, only their state is reset here.
+    # All the balls are drawn at once, ballsLeft and ballsRight are their indices
+    pool = stimulusPool(win)
+    balls = pool.get(('balls', len(positions), ballRadius),
+                     lambda win: BallField(win, positions, radius=ballRadius, color='Black'))
+    balls.setPositions(positions)
+    balls.setColor('Black')
+    ballsLeft = list(np.flatnonzero(owners == 0))
+    ballsRight = list(np.flatnonzero(owners == 1))
+    rectanglesLeft, rectanglesRight = quadrants
 
     #allBallsList = { 0:ballsLowerLeft, 1:ballsLowerRight, 2:ballsUpperLeft,3:ballsUpperRight }
     allBallsList = {0: ballsLeft, 1: ballsRight}
 
-    fixationBall = Ball(win, position=np.array([0.0, 0.0]), direction=np.array(
-        [0.0, 0.0]), speed=0.0, radius=0.10, color='White')
+    fixationBall = pool.get(('fixation', 0.10), lambda win: Ball(win, position=np.array([0.0, 0.0]), direction=np.array(
+        [0.0, 0.0]), speed=0.0, radius=0.10, color='White'))
+    fixationBall.setColor('White')
     trialClock.reset()
     blinkingBalls = list()
 
@@ -245,20 +214,34 @@ def trackingTrial(win, experimentalInfo, ballSpeed, thisCondition, simulation=Fa
     if runModes[runMode] != 'Unilateral' and runModes[runMode] != 'Bilateral':
         raise Exception("Run mode must be \"Unilateral\" or \"Bilateral\"")
 
-    blinkTimer = core.Clock()
-    blinkInteger = 0
     rectanglesVisual = []
     for r in rectanglesLeft + rectanglesRight:
-        rectanglesVisual.append(visual.Rect(win, width=(
-            r[2] - r[0]), height=(r[3] - r[1]), fillColor=None, lineColor='Red', units='cm',pos=[(r[0] + r[2]) / 2.0, (r[1] + r[3]) / 2.0]))
+        rectanglesVisual.append(pool.get(('rect',) + tuple(r), lambda win, r=r: visual.Rect(win, width=(
+            r[2] - r[0]), height=(r[3] - r[1]), fillColor=None, lineColor='Red', units='cm',pos=[(r[0] + r[2]) / 2.0, (r[1] + r[3]) / 2.0])))
 
     # Start first part of the experiment, 2 balls blink for a certain amount
     # of time controlled by experimentalInfo['BlinkTime']
     if isCatchTrial==1:
-        catchText = visual.TextStim(win, "Catch 25% trial speed=" + str(ballSpeed), color='Red', pos=[0,0])
+        catchText = pool.get('catchText', lambda win: visual.TextStim(win, "", pos=[0,0]))
+        catchText.setText("Catch 25% trial speed=" + str(ballSpeed))
+        catchText.setColor('Red')
     elif isCatchTrial==2:
-        catchText = visual.TextStim(win, "Catch 50% trial speed=" + str(ballSpeed), color='Blue', pos=[0,0])
-    while trialClock.getTime() < experimentalInfo['BlinkTime']:
+        catchText = pool.get('catchText', lambda win: visual.TextStim(win, "", pos=[0,0]))
+        catchText.setText("Catch 50% trial speed=" + str(ballSpeed))
+        catchText.setColor('Blue')
+    # The timed phases are compiled to frames before the first flip, the
+    # blinking balls switch between the colors of palette every BLINK_PERIOD
+    timeline = TrialTimeline(win.measuredFPS)
+    blinkPhase = timeline.addPhase('blink', experimentalInfo['BlinkTime'])
+    motionPhase = timeline.addPhase('motion', experimentalInfo['Duration'])
+    feedbackPhase = timeline.addPhase('response', FEEDBACK_TIME)
+    palette = np.array([rgbColor('Black'), rgbColor('White')])
+    ballColors = timeline.addChannel('ballColor', shape=(len(balls),))
+    ballColors[timeline.phaseSlice(blinkPhase), blinkingBalls] = alternating(
+        timeline.phaseFrames(blinkPhase), BLINK_PERIOD * timeline.fps)[:, np.newaxis]
+    frameIntervals.phase('blink')
+    for frame in timeline.frames(blinkPhase):
+        balls.update(colors=palette[ballColors[frame]])
         fixationBall.draw()
         if isCatchTrial:
             catchText.draw()
@@ -266,75 +249,74 @@ def trackingTrial(win, experimentalInfo, ballSpeed, thisCondition, simulation=Fa
         if experimentalInfo['DrawRectangles']:
             for r in rectanglesVisual:
                 r.draw()
-        for ballListID, ballList in allBallsList.iteritems():
-            for ball1 in ballList:
-                ball1.draw()
-
-        if (blinkTimer.getTime() > 0.125):
-            blinkInteger = blinkInteger + 1
-            blinkTimer.reset()
-        if (blinkInteger % 2):
-            for blinkBall in blinkingBalls:
-                blinkBall.setColor('White')
-        else:
-            for blinkBall in blinkingBalls:
-                blinkBall.setColor('Black')
+        balls.draw()
         if (experimentalInfo['SaveVideo']):
-            win.getMovieFrame()
+            recorder.capture()
         win.flip()
 
     # Reset all colors of the balls to black and move each ball in its right
     # part of space
-    for ballListID, ballList in allBallsList.iteritems():
-        for ball1 in ballList:
-            ball1.setColor('Black')
-            ball1.draw()
+    balls.setColor('Black')
+    balls.draw()
 
     fixationBall.draw()
     if (experimentalInfo['SaveVideo']):
-        win.getMovieFrame()
+        recorder.capture()
 
     win.flip()
+    # The wait for the trajectories belongs to no phase of the trial
+    frameIntervals.end()
     trialClock.reset()
-    # This function pregenerates all the trajectories so that in displaying
-    # them we have no slowing
-    allFrames = preGenerateTrajectories(
-        ballSpeed /
-        win.fps(), experimentalInfo, allBallsList, leftRightRectangles,
-        repulsionStrength=2000.0 * ballSpeed, edgerepulsionStrength=10.0 * ballSpeed, centerAttraction=0.0001)
+    # The trajectories are computed by the background worker while the balls
+    # blink, otherwise they are computed here
+    if trajectories is None:
+        motion = generateTrialTrajectories(experimentalInfo, ballSpeed, seed)
+    else:
+        motion = trajectories.get(ballSpeed, seed)
 
     trialClock.reset()
-    for balls in allFrames:
-        for ball, pos in balls.iteritems():
-            ball.setPos(pos)
-            ball.draw()
+    # The motion starts at the first flip after the trajectories are ready,
+    # that shows the balls still, so that the wait for them does not skip
+    # the start of the motion. Row k of motionPositions is where the balls
+    # are at the k+1-th flip after it, the row drawn is counted from the
+    # flip timestamps, so that a dropped frame neither slows down nor
+    # stretches the motion
+    motionPositions = motion.at(timeline.times(motionPhase) + 1.0 / timeline.fps)
+    if trialArrays is not None:
+        trialArrays['trajectory'] = motionPositions
+    balls.draw()
+    fixationBall.draw()
+    motionStart = win.flip()
+    frameIntervals.phase('motion')
+    for frame in timeline.flipFrames(len(motionPositions), win.flip, motionStart):
+        balls.setPositions(motionPositions[frame])
+        balls.draw()
         # speedText.draw()
         if experimentalInfo['DrawRectangles']:
             for r in rectanglesVisual:
                 r.draw()
         fixationBall.draw()
         if (experimentalInfo['SaveVideo']):
-            win.getMovieFrame()
-
-        win.flip()
+            recorder.capture()
     event.clearEvents(eventType='keyboard')
 
     trialClock.reset()
-    randomBall = allBallsList[whichSide][randrange(0, nBallsPerRectangle)]
+    randomBall = allBallsList[whichSide][trialRng(seed, 1).randint(0, nBallsPerRectangle)]
 
-    randomBall.setColor('Red')
+    balls.setColor('Red', [randomBall])
     event.clearEvents(eventType='keyboard')
 
     trialClock.reset()
     responseKey = None
+    frameIntervals.phase('response')
     response = None
     while True:
         keys = event.getKeys()
+        # The time of the response is the one of the key, not the end of the feedback
+        if trialArrays is not None and ('s' in keys or 'd' in keys):
+            trialArrays['responseTime'] = core.getTime()
         fixationBall.draw()
-        for ballListID, ballList in allBallsList.iteritems():
-            for ball1 in ballList:
-                ball1.draw()
-        randomBall.draw()
+        balls.draw()
 
         if 's' in keys:
             responseKey = True
@@ -354,7 +336,7 @@ def trackingTrial(win, experimentalInfo, ballSpeed, thisCondition, simulation=Fa
             win.close()
             core.quit()
         if (experimentalInfo['SaveVideo']):
-            win.getMovieFrame()
+            recorder.capture()
         win.flip()
 
     if response is True:
@@ -362,36 +344,68 @@ def trackingTrial(win, experimentalInfo, ballSpeed, thisCondition, simulation=Fa
     if response is False:
         fixationBall.setColor('Red')
 
-    trialClock.reset()
-    while trialClock.getTime() < 0.4:
+    for frame in timeline.frames(feedbackPhase):
         keys = event.getKeys()
         fixationBall.draw()
-        for ballListID, ballList in allBallsList.iteritems():
-            for ball1 in ballList:
-                ball1.draw()
-        randomBall.draw()
+        balls.draw()
         if (experimentalInfo['SaveVideo']):
-            win.getMovieFrame()
+            recorder.capture()
         win.flip()
 
     if (experimentalInfo['SaveVideo']):
-        import os
-        currentpath = os.getcwd()
-        savedatapath = currentpath + os.path.sep + 'data'
-        outputVideo = savedatapath + os.path.sep + \
-            "frames" + os.path.sep + 'Tracking.png'
-        print "Saving video to " + outputVideo
-        win.saveMovieFrames(outputVideo)
+        recorder.stop()
 
+    frameIntervals.end()
     return response
 
 
-def startExperiment():
+def drawCatchTrial(seeds, nTrial, speedValue, thisCondition, velocityConditions):
+    """
+    Draw whether the nTrial-th trial is a catch trial, shown at the last
+    speed of the other side, returns the flag and the speed of the trial
+    """
+    # Catch trial presentato al 25% di probabilita
+    isCatchTrial = seeds.rng.rand() < 0.25 and nTrial > 2
+    trialSpeed = speedValue
+    if isCatchTrial:
+        if thisCondition['Side'] == 'Left':
+            trialSpeed = velocityConditions['Right'][-1]
+        else:
+            trialSpeed = velocityConditions['Left'][-1]
+    return isCatchTrial, trialSpeed
+
+
+def startExperiment(resume=None):
+    """
+    Run a new session, or continue the interrupted one whose checkpoint
+    file is resume, from the trial that was interrupted
+    """
+    # Unset until they are opened, for the error handler
+    writer = journal = checkpoint = win = None
     try:
-        expInfo, stairInfo, outputfile, monitorInfo = setupExperiment()
+        records = None
+        if resume is None:
+            expInfo, stairInfo, outputfile, monitorInfo = setupExperiment()
+        else:
+            records = SessionCheckpoint(resume).load()
+            expInfo, stairInfo, outputfile, monitorInfo = records[0]['settings']
+        # Every trial is appended to the journal, the staircase files are
+        # only written at the end of the session, all by the writer thread.
+        # The checkpoint is written after every response.
+        writer = sessionWriter()
+        journal = TrialJournal(outputfile + '_trials.csv', TRIAL_COLUMNS)
+        checkpoint = SessionCheckpoint(outputfile + '_checkpoint.pickle')
+        # The settings, the trial table and the arrays of every trial are
+        # also stored together in the session container
+        container = SessionContainer(outputfile + '_session.zip')
         win = open_window(monitorInfo)
-        show_instructions(win, "Press spacebar to start experiment, doing " +
-                          str(expInfo['TrainingTrials']) + " training trials")
+        seeds = SessionSeeds(expInfo['SessionSeed'])
+        if records is None:
+            writer.submit(container.saveSettings, expInfo=expInfo, stairInfo=stairInfo, monitorInfo=monitorInfo)
+            show_instructions(win, "Press spacebar to start experiment, doing " +
+                              str(expInfo['TrainingTrials']) + " training trials")
+        else:
+            show_instructions(win, "Press spacebar to resume experiment")
 
         # We instanciate 4 staircases, we must decide the starting values for each of them
         # The speed value is the speedValue in the for loop of staircases and is measured in [cm/s]
@@ -529,51 +543,102 @@ def startExperiment():
             conditions = conditionsBilateral
         if expInfo['Block'] == 'Uni+Bi':
             conditions = conditionsUnilateral + conditionsBilateral
+        import copy
+        if records is None:
+            if (monitorInfo['RunSpeedTest']):
+                from common.draw_test_square import draw_test_square
+                draw_test_square(win)
+            # Do some training trials with no variation in speed
+            for i in range(0, int(expInfo['TrainingTrials'])):
+                speedValue = 1.25 * (i + 1)
+                trackingTrial(win, expInfo, speedValue, conditions[seeds.rng.randint(0, 2)])
+
+            show_instructions(
+                win, "Finished training trials, press spacebar to begin")
+        # The staircases are shuffled with the global generator seeded from
+        # the session, so that a resumed session replays them from the journal.
+        # Nothing else draws from it during the session, the simulated
+        # observer has its own generator
+        np.random.seed([seeds.sessionSeed, STAIRCASE_STREAM])
         from psychopy import data
         stairs = data.MultiStairHandler(
             conditions=conditions, nTrials=2, method=stairInfo['Selection'])
-
-        if (monitorInfo['RunSpeedTest']):
-            from common.draw_test_square import draw_test_square
-            draw_test_square(win)
-        # Do some training trials with no variation in speed
-        for i in range(0, int(expInfo['TrainingTrials'])):
-            speedValue = 1.25 * (i + 1)
-            trackingTrial(win, expInfo, speedValue, conditions[randrange(0, 2)])
-
-        show_instructions(
-            win, "Finished training trials, press spacebar to begin")
         velocityConditions = {}
         velocityConditions['Left'] = []
         velocityConditions['Right'] = []
         # Start of the trial loop
         # We save the last speed used for every side of stimulus presentation
         nTrial = 0
-        import copy
         # Has to initialize the first trial
         speedValue, thisCondition = stairs.next()
         nCatchTrials = 0
         nValidTrials = 0
-        dfrows = [] # Collects all trials included catch trials
+        trials = TrialTable(TRIAL_DTYPES) # Collects all trials included catch trials
+        isCatchTrial, trialSpeed = False, speedValue
+        velocityConditions[thisCondition['Side']].append(speedValue)
+        finished = False
+        if records is None:
+            checkpoint.save(writer, settings=(expInfo, stairInfo, outputfile, monitorInfo), nTrial=nTrial,
+                            sessionRng=seeds.rng.get_state())
+        else:
+            # The journaled trials are replayed on the staircases, the catch
+            # trials are drawn again from the session generator of the last
+            # checkpoint, that may precede the last journaled trials
+            for row in readJournal(journal.filename):
+                trials.append(row)
+            lastCheckpoint = records[-1]
+            if lastCheckpoint['nTrial'] > len(trials):
+                raise ValueError("The checkpoint is ahead of the journal " + journal.filename)
+            seeds.rng.set_state(lastCheckpoint['sessionRng'])
+            for row in range(0, len(trials)):
+                if trials['label'][row] != thisCondition['label'] or trials['CatchCondition'][row] != isCatchTrial:
+                    raise ValueError("The journal does not match the staircases at trial " + str(row))
+                if isCatchTrial:
+                    nCatchTrials += 1
+                else:
+                    stairs.addResponse(int(trials['Response'][row]))
+                    nValidTrials += 1
+                    try:
+                        speedValue, thisCondition = stairs.next()
+                    except StopIteration:
+                        finished = True
+                        break
+                nTrial = row + 1
+                velocityConditions[thisCondition['Side']].append(speedValue)
+                if nTrial >= lastCheckpoint['nTrial']:
+                    isCatchTrial, trialSpeed = drawCatchTrial(seeds, nTrial, speedValue, thisCondition, velocityConditions)
+                else:
+                    isCatchTrial = bool(trials['CatchCondition'][nTrial])
+            # The arrays of a trial that was not journaled are stored again
+            container.keepTrials(len(trials))
         print thisCondition
-        while True: # Using while True is the correct way to insert catch trials
-            velocityConditions[thisCondition['Side']].append(speedValue)
-            # print thisCondition['Side'], speedValue
-            # Catch trial presentato al 25% di probabilita
-            if np.random.rand() < 0.25 and nTrial > 2:
+        # The trajectories of every trial are computed by a worker process as
+        # soon as its speed is known, that is right after the previous response
+        trajectories = TrajectoryPrefetcher(expInfo)
+        trialSeed = seeds.trialSeed(nTrial)
+        if not expInfo['SimulationMode'] and not finished:
+            trajectories.submit(trialSpeed, trialSeed)
+        while not finished: # Using while True is the correct way to insert catch trials
+            frameIntervals = TrialFrameIntervals(win, TRIAL_PHASES)
+            trialArrays = {}
+            if isCatchTrial:
                 nCatchTrials += 1
                 catchCondition = copy.deepcopy(thisCondition)
                 if thisCondition['Side'] == 'Left':
                     catchCondition['Side'] = 'Left'
-                    catchSpeedValue = velocityConditions['Right'][-1]
                 else:
                     catchCondition['Side'] = 'Right'
-                    catchSpeedValue = velocityConditions['Left'][-1]
-                catchResp = trackingTrial(win, expInfo, catchSpeedValue, catchCondition, simulation=expInfo['SimulationMode'], isCatchTrial=0) #doesn't print message
-                dfrows.append({'label':catchCondition['label'], 'Side':catchCondition['Side'], 'CatchCondition':1, 'Speed':speedValue, 'Response':int(not catchResp)})
+                catchResp = trackingTrial(win, expInfo, trialSpeed, catchCondition, simulation=expInfo['SimulationMode'], isCatchTrial=0, seed=trialSeed, trajectories=trajectories, frameIntervals=frameIntervals, trialArrays=trialArrays) #doesn't print message
+                row = dict({'Trial':nTrial, 'label':catchCondition['label'], 'Side':catchCondition['Side'], 'CatchCondition':1, 'Speed':speedValue, 'Response':int(not catchResp), 'Time':trialArrays.get('responseTime', core.getTime()), 'Seed':trialSeed}, **frameIntervals.record())
+                trials.append(row)
+                writer.submit(journal.write, row)
+                writer.submit(container.saveTrial, nTrial, trialArrays.get('trajectory'), frameIntervals.intervals)
             else:
-                thisResp = trackingTrial(win, expInfo, speedValue, thisCondition, simulation=expInfo['SimulationMode'],isCatchTrial=0)
-                dfrows.append({'label':thisCondition['label'], 'Side':thisCondition['Side'], 'CatchCondition':0, 'Speed':speedValue, 'Response':int(not thisResp)})
+                thisResp = trackingTrial(win, expInfo, trialSpeed, thisCondition, simulation=expInfo['SimulationMode'],isCatchTrial=0, seed=trialSeed, trajectories=trajectories, frameIntervals=frameIntervals, trialArrays=trialArrays)
+                row = dict({'Trial':nTrial, 'label':thisCondition['label'], 'Side':thisCondition['Side'], 'CatchCondition':0, 'Speed':speedValue, 'Response':int(not thisResp), 'Time':trialArrays.get('responseTime', core.getTime()), 'Seed':trialSeed}, **frameIntervals.record())
+                trials.append(row)
+                writer.submit(journal.write, row)
+                writer.submit(container.saveTrial, nTrial, trialArrays.get('trajectory'), frameIntervals.intervals)
                 if thisResp is not None:
                     stairs.addResponse(int(not thisResp))
                     nValidTrials += 1
@@ -583,20 +648,41 @@ def startExperiment():
                         break
                 else:
                     raise
-            # Increase the trial counter and save the temporary results
+            # Increase the trial counter
             nTrial = nTrial + 1
-            stairs.saveAsText(outputfile)
-            stairs.saveAsPickle(outputfile)
-            df = pd.DataFrame(dfrows) # this holds all trials in raw mode
-        stairs.saveAsExcel(outputfile)
+            velocityConditions[thisCondition['Side']].append(speedValue)
+            # print thisCondition['Side'], speedValue
+            # The session can be resumed from here, the next trial is
+            # decided here so that its trajectories are computed in background
+            checkpoint.save(writer, nTrial=nTrial, sessionRng=seeds.rng.get_state())
+            isCatchTrial, trialSpeed = drawCatchTrial(seeds, nTrial, speedValue, thisCondition, velocityConditions)
+            trialSeed = seeds.trialSeed(nTrial)
+            if not expInfo['SimulationMode']:
+                trajectories.submit(trialSpeed, trialSeed)
+        trajectories.close()
+        writer.submit(journal.close)
+        writer.submit(stairs.saveAsText, outputfile)
+        writer.submit(stairs.saveAsPickle, outputfile)
+        writer.submit(stairs.saveAsExcel, outputfile)
+        writer.submit(trials.toExcel, outputfile+'_trials_summary.xlsx') # this holds all trials in raw mode
+        writer.submit(container.saveTable, trials)
         experiment_finished(win)
-        df.to_excel(outputfile+'_trials_summary.xlsx')
+        writer.close()
+        # The session can no longer be resumed once all its files are written
+        checkpoint.remove()
     except:
-        # If the experiments stops before a default response is inserted
-        stairs.addResponse(0)
-        stairs.saveAsExcel(outputfile)
-        df.to_excel(outputfile+'_trials_summary.xlsx')
-        win.close()
+        # The staircases are left as they were before the interrupted trial,
+        # the session continues from the last checkpoint with --resume
+        if writer is not None:
+            if journal is not None:
+                writer.submit(journal.close)
+            writer.close(False)
+        if checkpoint is not None and checkpoint.exists():
+            print "*** Session interrupted, continue it with --resume", checkpoint.filename
+        if win is not None:
+            # The frames of an interrupted recording are written too
+            closeVideoRecorder(win)
+            win.close()
         raise
 
     #analyzeStaircases(stairs, stairInfo['AverageReversals'])
@@ -605,4 +691,8 @@ def startExperiment():
 # The experiment starts here  #
 ###############################
 if __name__ == "__main__":
-    startExperiment()
+    import argparse
+    parser = argparse.ArgumentParser(description='Staircase tracking experiment')
+    parser.add_argument('--resume', metavar='CHECKPOINT',
+                        help='Continue the interrupted session of a _checkpoint.pickle file')
+    startExperiment(parser.parse_args().resume)
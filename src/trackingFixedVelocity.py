@@ -1,13 +1,32 @@
 import numpy as np
-from random import randrange
 from common.psycho_init import open_window, setup_monitor
 from common.psycho_init import experiment_finished
 from common.psycho_init import set_output_file, save_experimental_settings
 from common.show_instructions import show_instructions
 from psychopy import core
-from common import Ball
+from common import Ball, BallField
+from common.BallField import rgbColor
+from common.Trajectories import trialInitialState, generateTrialTrajectories, PHYSICS_MODES
+from common.TrajectoryPrefetcher import TrajectoryPrefetcher
+from common.StimulusPool import stimulusPool
+from common.FrameIntervals import TrialFrameIntervals, phaseColumns, phaseDtypes
+from common.SessionWriter import sessionWriter
+from common.SessionContainer import SessionContainer
+from common.TrialTable import TrialTable
+from common.TrialTimeline import TrialTimeline, alternating
+from common.SessionSeeds import SessionSeeds, drawSessionSeed, trialRng, MAX_SEED
 from psychopy import visual, event
 
+# The phases of a trial whose flip intervals are written in the trial record
+TRIAL_PHASES = ['blink', 'motion', 'response']
+# The typed columns of the trial table of the session container, the same
+# as the lines of the results file
+TRIAL_DTYPES = [('Trial', np.int32), ('NTrial', np.int32), ('label', object), ('Response', np.int8),
+                ('StartTime', np.float64), ('Seed', np.int64)] + phaseDtypes(TRIAL_PHASES)
+# The blinking balls switch color every BLINK_PERIOD seconds
+BLINK_PERIOD = 0.125
+
+
 def setupExperiment():
     from psychopy import gui
     """
@@ -26,7 +45,10 @@ def setupExperiment():
                'BlinkTime': 1,
                'SimulationMode': False,
                'MaxAnswerTime' : 2,
-               'DrawRectangles': False
+               'DrawRectangles': False,
+               'TrajectoryLibrary': '',
+               'SessionSeed': 0,
+               'PhysicsMode': PHYSICS_MODES
                }
 
     dlg = gui.DlgFromDict(dictionary=expInfo, title='Tracking Experiment',
@@ -49,7 +71,10 @@ def setupExperiment():
                               'BallRadius': 'Radius of the balls in cm',
                               'Duration': 'Duration of the stimulus in seconds',
                               'BlinkTime': 'Time of white/black ball blinking in seconds',
-                              'SimulationMode': 'Run the experiment with a perfect cumulative normal observer'
+                              'SimulationMode': 'Run the experiment with a perfect cumulative normal observer',
+                              'TrajectoryLibrary': 'Folder of precomputed trajectories, leave empty to compute them online',
+                              'SessionSeed': 'Seed of the random stimuli of the session, 0 to draw a new one',
+                              'PhysicsMode': 'Soft repulsive forces or straight motion with elastic bounces'
                           })
 
     if not dlg.OK:
@@ -78,98 +103,14 @@ def setupExperiment():
     if not dlgStaircase.OK:
         core.quit()
 
+    drawSessionSeed(expInfo)
     outputfile = set_output_file(expInfo, 'trackingFixed_')
     save_experimental_settings(
         outputfile + '_info.pickle', expInfo, staircaseInfo, monitorInfo)
     return expInfo, staircaseInfo, outputfile, monitorInfo
 
 
-def createBalls(win, nBalls, radius, boundRect, speed):
-    """ Create the balls to be put in the area """
-    from numpy import array
-    from numpy.random import uniform
-    from random import shuffle
-    from common import Geometry
-    halfX = (boundRect[0] + boundRect[2]) / 2.0
-    halfY = (boundRect[1] + boundRect[3]) / 2.0
-    # The four rectangles that build the main rectangle
-    rectanglesList = []
-    rectanglesList.append([boundRect[0], boundRect[1], halfX, halfY])
-    rectanglesList.append([halfX, boundRect[1], boundRect[2], halfY])
-    rectanglesList.append([boundRect[0], halfY, halfX, boundRect[3]])
-    rectanglesList.append([halfX, halfY, boundRect[2], boundRect[3]])
-
-    # Generate the balls in the
-    balls = []
-    for i in range(0, nBalls):
-        startPos = array([uniform(rectanglesList[i % 4][0] + radius, rectanglesList[i % 4][2] -
-                                  radius), uniform(rectanglesList[i % 4][1] + radius, rectanglesList[i % 4][3] - radius)])
-        direction = Geometry.normalized(
-            array([uniform(-1, 1), uniform(-1, 1)]))
-        ball = Ball(win, position=startPos, direction=direction,
-                    speed=speed, radius=radius, color='Black')
-        balls.append(ball)
-
-    shuffle(balls)
-    return balls, rectanglesList
-
-
-def preGenerateTrajectories(ballSpeed, expInfo, allBallsList, rectangles, repulsionStrength, edgerepulsionStrength, centerAttraction):
-    """
-    Precompute the trajectories of points
-    """
-    trajClock = core.Clock()
-    trajClock.reset()
-    nFrames = int(expInfo['Duration'] / (1.0 / 60.0))
-    fullFrame = [None] * nFrames  # preallocate space for the list
-    from common import Geometry
-    from numpy import array
-    for i in range(0, nFrames):
-        fullFrame[i] = dict()
-        for ballListID, ballList in allBallsList.iteritems():
-            boundingRectangle = rectangles[ballListID]
-            for ball1 in ballList:
-                force = array([0, 0])
-                for ball2 in ballList:
-                    if (ball1 == ball2):
-                        continue
-                    # balls collide
-                    delta = ((ball1.pos() - ball2.pos()))
-                    dist2 = ((delta ** 2).sum())
-                    force = force + repulsionStrength * \
-                        (ball1.radius * ball2.radius) * delta / (dist2 * dist2)
-
-                # Repulsion to borders
-                force[0] = force[0] + edgerepulsionStrength / \
-                    ((boundingRectangle[0] - ball1.pos()[0]) ** 2)
-                force[0] = force[0] - edgerepulsionStrength / \
-                    ((boundingRectangle[2] - ball1.pos()[0]) ** 2)
-
-                force[1] = force[1] + edgerepulsionStrength / \
-                    ((boundingRectangle[1] - ball1.pos()[1]) ** 2)
-                force[1] = force[1] - edgerepulsionStrength / \
-                    ((boundingRectangle[3] - ball1.pos()[1]) ** 2)
-
-                # Add a little attraction to the center of boundingRectangle
-                dispFromCenter = Geometry.rectangleCenter(boundingRectangle)
-                force = force - (ball1.pos() - dispFromCenter)
-
-                ball1.direction = ball1.direction + centerAttraction * force
-
-                # Renormalize direction with correct speed
-                ball1.direction = Geometry.normalized(
-                    ball1.direction) * ballSpeed
-
-                # Move the ball in the computed direction and finally draw it
-                ball1.move(ball1.direction)
-                # if (i==1): #print displacement for debug purpose
-                # print np.np.sqrt(np.dot(ball1.direction,ball1.direction))*60
-                fullFrame[i][ball1] = ball1.pos()
-
-    return fullFrame
-
-
-def trackingTrial(win, experimentalInfo, ballSpeed, thisCondition, simulation=False):
+def trackingTrial(win, experimentalInfo, ballSpeed, thisCondition, simulation=False, seed=None, trajectories=None, frameIntervals=None, trialArrays=None):
     """
     Start the tracking trial
     1) Generate random balls
@@ -180,25 +121,37 @@ def trackingTrial(win, experimentalInfo, ballSpeed, thisCondition, simulation=Fa
     
     # Generate a list of 4 balls on left side for unilateral condition
     trialClock = core.Clock()
-    rectWidth, rectHeight = experimentalInfo[
-        'RectWidth'], experimentalInfo['RectHeight']
-    displacementX = 4  # 1 cm central displacement
     nBallsPerRectangle = experimentalInfo['NumBalls']
     ballRadius = experimentalInfo['BallRadius']
 
-    leftRightRectangles = [[-rectWidth - displacementX / 2.0, -rectHeight / 2.0, -displacementX / 2.0,
-                            rectHeight / 2.0], [displacementX / 2.0, -rectHeight / 2.0, rectWidth + displacementX / 2.0, rectHeight / 2.0]]
-
-    ballsLeft, rectanglesLeft = createBalls(
-        win, nBallsPerRectangle, radius=ballRadius, boundRect=leftRightRectangles[0], speed=ballSpeed)
-    ballsRight, rectanglesRight = createBalls(
-        win, nBallsPerRectangle, radius=ballRadius, boundRect=leftRightRectangles[1], speed=ballSpeed)
+    # The flip intervals of every phase are collected in frameIntervals
+    if frameIntervals is None:
+        frameIntervals = TrialFrameIntervals(win, TRIAL_PHASES)
+
+    # The starting state of the balls only depends on the seed, so that the
+    # trajectories can be computed in a worker process
+    if seed is None:
+        seed = np.random.randint(0, MAX_SEED)
+    positions, directions, owners, quadrants = trialInitialState(experimentalInfo, seed)
+    if trajectories is not None:
+        trajectories.submit(ballSpeed, seed)
+    # The stimuli are reused across trials, only their state is reset here.
+    # All the balls are drawn at once, ballsLeft and ballsRight are their indices
+    pool = stimulusPool(win)
+    balls = pool.get(('balls', len(positions), ballRadius),
+                     lambda win: BallField(win, positions, radius=ballRadius, color='Black'))
+    balls.setPositions(positions)
+    balls.setColor('Black')
+    ballsLeft = list(np.flatnonzero(owners == 0))
+    ballsRight = list(np.flatnonzero(owners == 1))
+    rectanglesLeft, rectanglesRight = quadrants
 
     #allBallsList = { 0:ballsLowerLeft, 1:ballsLowerRight, 2:ballsUpperLeft,3:ballsUpperRight }
     allBallsList = {0: ballsLeft, 1: ballsRight}
     from numpy import array
-    fixationBall = Ball(win, position=array([0.0, 0.0]), direction=array(
-        [0.0, 0.0]), speed=0.0, radius=0.10, color='White')
+    fixationBall = pool.get(('fixation', 0.10), lambda win: Ball(win, position=array([0.0, 0.0]), direction=array(
+        [0.0, 0.0]), speed=0.0, radius=0.10, color='White'))
+    fixationBall.setColor('White')
     trialClock.reset()
     blinkingBalls = list()
 
@@ -231,72 +184,84 @@ def trackingTrial(win, experimentalInfo, ballSpeed, thisCondition, simulation=Fa
     if runModes[runMode] != 'Unilateral' and runModes[runMode] != 'Bilateral':
         raise Exception("Run mode must be \"Unilateral\" or \"Bilateral\"")
 
-    blinkTimer = core.Clock()
-    blinkInteger = 0
     rectanglesVisual = []
     for r in rectanglesLeft + rectanglesRight:
-        rectanglesVisual.append(visual.Rect(win, width=(r[2] - r[0]), height=(r[3] - r[
-                                1]), fillColor=None, lineColor='Red', units='cm', pos=[(r[0] + r[2]) / 2.0, (r[1] + r[3]) / 2.0]))
+        rectanglesVisual.append(pool.get(('rect',) + tuple(r), lambda win, r=r: visual.Rect(win, width=(r[2] - r[0]), height=(r[3] - r[
+                                1]), fillColor=None, lineColor='Red', units='cm', pos=[(r[0] + r[2]) / 2.0, (r[1] + r[3]) / 2.0])))
+
+    # The timed phases are compiled to frames before the first flip, the
+    # blinking balls switch between the colors of palette every BLINK_PERIOD
+    timeline = TrialTimeline(win.measuredFPS)
+    blinkPhase = timeline.addPhase('blink', experimentalInfo['BlinkTime'])
+    motionPhase = timeline.addPhase('motion', experimentalInfo['Duration'])
+    palette = np.array([rgbColor('Black'), rgbColor('White')])
+    ballColors = timeline.addChannel('ballColor', shape=(len(balls),))
+    ballColors[timeline.phaseSlice(blinkPhase), blinkingBalls] = alternating(
+        timeline.phaseFrames(blinkPhase), BLINK_PERIOD * timeline.fps)[:, np.newaxis]
 
     # Start first part of the experiment, 2 balls blink for a certain amount
     # of time controlled by experimentalInfo['BlinkTime']
-    while trialClock.getTime() < experimentalInfo['BlinkTime']:
+    frameIntervals.phase('blink')
+    for frame in timeline.frames(blinkPhase):
+        balls.update(colors=palette[ballColors[frame]])
         fixationBall.draw()
         # speedText.draw()
         if experimentalInfo['DrawRectangles']:
             for r in rectanglesVisual:
                 r.draw()
-        for ballListID, ballList in allBallsList.iteritems():
-            for ball1 in ballList:
-                ball1.draw()
-
-        if (blinkTimer.getTime() > 0.125):
-            blinkInteger = blinkInteger + 1
-            blinkTimer.reset()
-        if (blinkInteger % 2):
-            for blinkBall in blinkingBalls:
-                blinkBall.setColor('White')
-        else:
-            for blinkBall in blinkingBalls:
-                blinkBall.setColor('Black')
+        balls.draw()
         win.flip()
 
     # Reset all colors of the balls to black and move each ball in its right
     # part of space
-    for ballListID, ballList in allBallsList.iteritems():
-        for ball1 in ballList:
-            ball1.setColor('Black')
-            ball1.draw()
+    balls.setColor('Black')
+    balls.draw()
 
     fixationBall.draw()
 
     win.flip()
+    # The wait for the trajectories belongs to no phase of the trial
+    frameIntervals.end()
     trialClock.reset()
-    # This function pregenerates all the trajectories so that in displaying
-    # them we have no slowing
-    allFrames = preGenerateTrajectories(ballSpeed / win.fps(), experimentalInfo, allBallsList, leftRightRectangles,
-                                        repulsionStrength=2000.0 * ballSpeed, edgerepulsionStrength=10.0 * ballSpeed, centerAttraction=0.0001)
+    # The trajectories are computed by the background worker while the balls
+    # blink, otherwise they are computed here
+    if trajectories is None:
+        motion = generateTrialTrajectories(experimentalInfo, ballSpeed, seed)
+    else:
+        motion = trajectories.get(ballSpeed, seed)
 
     trialClock.reset()
-    for balls in allFrames:
-        for ball, pos in balls.iteritems():
-            ball.setPos(pos)
-            ball.draw()
+    # The motion starts at the first flip after the trajectories are ready,
+    # that shows the balls still, so that the wait for them does not skip
+    # the start of the motion. Row k of motionPositions is where the balls
+    # are at the k+1-th flip after it, the row drawn is counted from the
+    # flip timestamps, so that a dropped frame neither slows down nor
+    # stretches the motion
+    motionPositions = motion.at(timeline.times(motionPhase) + 1.0 / timeline.fps)
+    if trialArrays is not None:
+        trialArrays['trajectory'] = motionPositions
+    balls.draw()
+    fixationBall.draw()
+    motionStart = win.flip()
+    frameIntervals.phase('motion')
+    for frame in timeline.flipFrames(len(motionPositions), win.flip, motionStart):
+        balls.setPositions(motionPositions[frame])
+        balls.draw()
         # speedText.draw()
         if experimentalInfo['DrawRectangles']:
             for r in rectanglesVisual:
                 r.draw()
         fixationBall.draw()
-        win.flip()
     event.clearEvents(eventType='keyboard')
 
     trialClock.reset()
-    randomBall = allBallsList[whichSide][randrange(0, nBallsPerRectangle)]
+    randomBall = allBallsList[whichSide][trialRng(seed, 1).randint(0, nBallsPerRectangle)]
 
-    randomBall.setColor('Red')
+    balls.setColor('Red', [randomBall])
     event.clearEvents(eventType='keyboard')
 
     responseKey = None
+    frameIntervals.phase('response')
     response = None
     time_exceeded = False
 
@@ -308,10 +273,7 @@ def trackingTrial(win, experimentalInfo, ballSpeed, thisCondition, simulation=Fa
     # Wait 'MaxAnswerTime' seconds if both the answer is given by the subject or not.
     while answerclock.getTime() < experimentalInfo['MaxAnswerTime']:
         fixationBall.draw()
-        for ballListID, ballList in allBallsList.iteritems():
-            for ball1 in ballList:
-                ball1.draw()
-        randomBall.draw()
+        balls.draw()
         keys = event.getKeys()
         if not has_answered:
             if '1' in keys:
@@ -336,10 +298,7 @@ def trackingTrial(win, experimentalInfo, ballSpeed, thisCondition, simulation=Fa
         win.flip()
         
         fixationBall.draw()
-        for ballListID, ballList in allBallsList.iteritems():
-             for ball1 in ballList:
-                 ball1.draw()
-             randomBall.draw()
+        balls.draw()
         win.flip()
 
 
@@ -391,6 +350,7 @@ def trackingTrial(win, experimentalInfo, ballSpeed, thisCondition, simulation=Fa
 
     #     win.flip()
 
+    frameIntervals.end()
     return response
 
 
@@ -398,6 +358,7 @@ def startExperiment():
     try:
         expInfo, trialInfo, outputfile, monitorInfo = setupExperiment()
         win = open_window(monitorInfo)
+        seeds = SessionSeeds(expInfo['SessionSeed'])
         show_instructions(win, "Press spacebar to start experiment")
 
         # We instanciate 4 staircases, we must decide the starting values for each of them
@@ -436,8 +397,15 @@ def startExperiment():
         if (expInfo['Block'] == 'Uni+Bi'):
             maxTrials *= 2
 
+        # The results are written by the writer thread, one line per trial
+        writer = sessionWriter()
         output = open(outputfile + "_fixed_tracking.txt", 'w')
-        output.write('Trial\tNTrial\tTrial Condition\tResponse\tStartTime\n')
+        # The settings, the trial table and the arrays of every trial are
+        # also stored together in the session container
+        container = SessionContainer(outputfile + '_session.zip')
+        writer.submit(container.saveSettings, expInfo=expInfo, trialInfo=trialInfo, monitorInfo=monitorInfo)
+        trials = TrialTable(TRIAL_DTYPES)
+        writer.submit(output.write, 'Trial\tNTrial\tTrial Condition\tResponse\tStartTime\tSeed\t' + '\t'.join(phaseColumns(TRIAL_PHASES)) + '\n')
 
         # Generate a list of balanced random conditions
         allConditions = []
@@ -469,18 +437,22 @@ def startExperiment():
         import copy
         for i in range(0, len(allConditions)):
             thisCondition = allConditions[i]
-            if np.random.rand() < 0.5 and (thisCondition['label'].split('-')[0] == 'Bilateral'):
+            if seeds.rng.rand() < 0.5 and (thisCondition['label'].split('-')[0] == 'Bilateral'):
                 thisCondition = copy.deepcopy(allConditions[i])
                 thisCondition['isCatchTrial'] = True
                 allConditions.append(thisCondition)
 
         if (trialInfo['Selection'] == 'random'):
-            from random import shuffle
-            shuffle(allConditions)
+            seeds.rng.shuffle(allConditions)
 
         for thisCondition in allConditions:
             print thisCondition
 
+        # Every trial has its own seed, the trajectories of the next trial are
+        # computed by a worker process while the current one is running
+        trialSeeds = seeds.trialSeeds(len(allConditions))
+        trajectories = TrajectoryPrefetcher(expInfo)
+
         n = 0
         expClock = core.Clock()
         trigger_received = False # Indicates whether it received the '=' symbol from the fMRI (or from the keyboard)
@@ -509,6 +481,11 @@ def startExperiment():
             # Extract the speed value from the input dialog for staircase for the
             # current condition
             speedValue = trialInfo[thisCondition['label'] + ' speed']
+            # Start computing the trajectories of this trial and of the next one
+            trajectories.submit(speedValue, trialSeeds[n])
+            if n + 1 < len(allConditions):
+                nextCondition = allConditions[n + 1]
+                trajectories.submit(trialInfo[nextCondition['label'] + ' speed'], trialSeeds[n + 1])
             if 'isCatchTrial' in thisCondition:
                 # print "Catch trial, sarebbe ", thisCondition['Side'], "invece
                 # fa dall'altra"
@@ -517,28 +494,41 @@ def startExperiment():
                 else:
                     thisCondition['Side'] = 'Left'
                 trackingTrial(
-                    win, expInfo, speedValue, thisCondition, expInfo['SimulationMode'])
+                    win, expInfo, speedValue, thisCondition, expInfo['SimulationMode'], seed=trialSeeds[n], trajectories=trajectories)
             else:
                 # print thisCondition, speedValue
+                frameIntervals = TrialFrameIntervals(win, TRIAL_PHASES)
+                trialArrays = {}
                 thisResp = trackingTrial(
-                    win, expInfo, speedValue, thisCondition, expInfo['SimulationMode'])
+                    win, expInfo, speedValue, thisCondition, expInfo['SimulationMode'], seed=trialSeeds[n], trajectories=trajectories,
+                    frameIntervals=frameIntervals, trialArrays=trialArrays)
                 responses[thisCondition['label']].append(thisResp)
 
-                output.write(str(n) + "\t" + str(nTrialCounter[thisCondition['label']]) + "\t" + thisCondition['label'] + "\t" + str(int(thisResp)) + "\t" + str(t0) + "\n")
+                writer.submit(output.write, str(n) + "\t" + str(nTrialCounter[thisCondition['label']]) + "\t" + thisCondition['label'] + "\t" + str(int(thisResp)) + "\t" + str(t0) + "\t" + str(trialSeeds[n]) + "\t" + "\t".join(str(v) for v in frameIntervals.record().values()) + "\n")
+                writer.submit(output.flush)
+                trials.append(dict({'Trial': n, 'NTrial': nTrialCounter[thisCondition['label']], 'label': thisCondition['label'],
+                                    'Response': int(thisResp), 'StartTime': t0, 'Seed': trialSeeds[n]},
+                                   **frameIntervals.record()))
+                writer.submit(container.saveTrial, n, trialArrays.get('trajectory'), frameIntervals.intervals)
             nTrialCounter[thisCondition['label']] += 1
             n += 1
+        trajectories.close()
         experiment_finished(win)
     except:
+        sessionWriter().close(False)
         raise
         win.close()
     else:
-        output.write('\n')
+        writer.submit(output.write, '\n')
         # Compute accuracy, we keep just the trials from 0 to maxTrials
         accuracies = {}
         for k in responses.keys():
             accuracies[k] = float(
                 sum(responses[k][0:maxTrials])) / len(responses[k][0:maxTrials])
-            output.write('Accuracy ' + k + ' = ' + str(accuracies[k]) + "\n")
+            writer.submit(output.write, 'Accuracy ' + k + ' = ' + str(accuracies[k]) + "\n")
+        writer.submit(output.close)
+        writer.submit(container.saveTable, trials)
+        writer.close()
 
 ################################
 # The experiment starts here  #